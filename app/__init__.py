@@ -1,14 +1,74 @@
 from flask import Flask
 from app.routes.cart_routes import cart_bp
 from app.routes.stats_routes import stats_bp
-from app.models.database import db
+from app.routes.catalog_routes import catalog_bp
+from app.routes.metrics_routes import metrics_bp, TimedJSONProvider
+from app.models.database import db, check_schema
+from app.pools import engine_options, register_engine, psycopg2_connect_args
+from app.circuit_breaker import DependencyUnavailableError, start_budget
 from app.config import Config
+from sqlalchemy import exc
 import logging
-import time
+import math
+import redis
 
-def create_app():
+# A dependency that is down, too slow, or behind an open circuit breaker
+UNAVAILABLE_ERRORS = (
+    DependencyUnavailableError, redis.ConnectionError, redis.TimeoutError, exc.OperationalError, exc.TimeoutError
+)
+
+def unavailable_response(error: Exception):
+    """503 answer for UNAVAILABLE_ERRORS, retried once the circuit may have closed"""
+    logging.getLogger(__name__).warning(f"Dependency unavailable: {error}")
+    retry_after = str(max(1, math.ceil(Config.CIRCUIT_OPEN_SECONDS)))
+    return {'message': 'Servicio no disponible temporalmente, reintente más tarde'}, 503, {'Retry-After': retry_after}
+
+def start_worker_tasks(app) -> None:
+    """
+    Background threads of a serving process. Threads do not survive a fork,
+    so pre-forked workers start them after forking (see init_worker).
+    """
+    from app.cache.redis_client import redis_client
+    from app.cache.local_cache import local_cache
+    from app.services.product_stats import product_stats
+    from app.metrics import metrics
+    
+    # Listen for L1 invalidations published by the other workers
+    local_cache.start_invalidation_listener(redis_client, Config.CACHE_INVALIDATION_CHANNEL)
+    
+    # Track replica health, latency and lag for read routing
+    redis_client.start_health_checks()
+    
+    # Flush the buffered product stats in the background
+    product_stats.start()
+    
+    # Share this process's metrics with the other workers' /metrics
+    if Config.METRICS_MULTIPROC_DIR:
+        metrics.share(Config.METRICS_MULTIPROC_DIR, Config.METRICS_SNAPSHOT_INTERVAL)
+
+def init_worker(app) -> None:
+    """
+    Post-fork setup of a worker forked from a preloaded app (gunicorn.conf.py):
+    connection pools of its own and its background threads
+    """
+    from app.cache.redis_client import redis_client
+    
+    with app.app_context():
+        # Forget the parent's connections without closing them under its feet
+        db.engine.dispose(close=False)
+    redis_client.reset_after_fork()
+    start_worker_tasks(app)
+
+def create_app(start_workers: bool = True, require_schema: bool = True):
+    """
+    Create the Flask app. With start_workers=False (preloaded pre-forking
+    servers) background threads are left to init_worker. require_schema=False
+    skips the schema check, for scripts/migrate_schema.py.
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(connect_args=psycopg2_connect_args())
+    app.json = TimedJSONProvider(app)
     
     # Setup logging
     logging.basicConfig(
@@ -19,35 +79,122 @@ def create_app():
     # Initialize SQLAlchemy
     db.init_app(app)
     
-    # Create all tables
+    # Create missing tables; existing ones must have been migrated
     with app.app_context():
         db.create_all()
+        if require_schema:
+            check_schema(db.session.connection())
+            db.session.rollback()
+        register_engine('postgres', db.engine)
     
     # Register blueprints
     app.register_blueprint(cart_bp, url_prefix='/cart')
     app.register_blueprint(stats_bp, url_prefix='/stats')
+    app.register_blueprint(catalog_bp, url_prefix='/catalog')
+    app.register_blueprint(metrics_bp)
     
-    # Check Redis connection with retry
-    max_retries = 3
-    retry_count = 0
-    connected = False
-    
-    while retry_count < max_retries and not connected:
-        try:
-            from app.cache.redis_client import redis_client
-            if redis_client.is_connected():
-                app.logger.info("Successfully connected to Redis")
-                connected = True
-            else:
-                app.logger.warning(f"Failed to connect to Redis (attempt {retry_count + 1}/{max_retries})")
-                retry_count += 1
-                time.sleep(1)  # Wait for 1 second before retrying
-        except Exception as e:
-            app.logger.warning(f"Redis connection error: {e} (attempt {retry_count + 1}/{max_retries})")
-            retry_count += 1
-            time.sleep(1)  # Wait for 1 second before retrying
+    # Every request gets a latency budget for its Redis and PostgreSQL calls
+    @app.before_request
+    def start_request_budget():
+        start_budget(Config.REQUEST_LATENCY_BUDGET_MS)
     
+    for error in UNAVAILABLE_ERRORS:
+        app.register_error_handler(error, unavailable_response)
+    
+    # Check the Redis connection once, without waiting for it: while it is
+    # down reads go to PostgreSQL and the circuit breakers probe it
+    from app.cache.redis_client import redis_client
+    connected = redis_client.is_connected()
     if not connected:
-        app.logger.error("Could not connect to Redis after multiple attempts. Some features may be unavailable.")
+        app.logger.error("Could not connect to Redis. Carts are served from PostgreSQL until it is back.")
+    else:
+        app.logger.info("Successfully connected to Redis")
+        
+        # Move the top-products counters from the old hash to a sorted set
+        migrated = redis_client.migrate_hash_to_sorted_set(Config.PRODUCT_STATS_KEY)
+        if migrated:
+            app.logger.info(f"Migrated {migrated} product counters to a sorted set")
+        
+        # Write-behind cart versions continue after the ones in the database
+        if Config.PERSISTENCE_MODE == 'write_behind':
+            from app.services.cart_service import CartService
+            with app.app_context():
+                CartService().sync_version_counter()
+    
+    if start_workers:
+        start_worker_tasks(app)
+    
+    # Preload recently updated carts so a cold cache does not stampede PostgreSQL
+    if Config.CACHE_WARM_ON_STARTUP and start_workers and connected:
+        from app.services.cache_warmer import start_background_warming
+        start_background_warming(app)
+    
+    return app
+
+def create_asgi_app():
+    """
+    ASGI variant of create_app: same API served by Quart on top of
+    redis.asyncio and SQLAlchemy's asyncio engine (asyncpg)
+    """
+    from quart import Quart
+    from app.routes.async_cart_routes import async_cart_bp
+    from app.routes.async_stats_routes import async_stats_bp
+    from app.routes.async_catalog_routes import async_catalog_bp
+    from app.routes.async_metrics_routes import async_metrics_bp
+    from app.models.async_database import async_engine
+    from app.models.database import check_schema
+    from app.cache.async_redis_client import async_redis_client
+    from app.services.product_stats import product_stats
+    from app.services.async_cart_service import AsyncCartService
+    
+    app = Quart(__name__)
+    app.config.from_object(Config)
+    app.json = TimedJSONProvider(app)
+    
+    # Setup logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    # Register blueprints
+    app.register_blueprint(async_cart_bp, url_prefix='/cart')
+    app.register_blueprint(async_stats_bp, url_prefix='/stats')
+    app.register_blueprint(async_catalog_bp, url_prefix='/catalog')
+    app.register_blueprint(async_metrics_bp)
+    
+    # Async so the budget is set in the request's own context (sync hooks run in a thread)
+    @app.before_request
+    async def start_request_budget():
+        start_budget(Config.REQUEST_LATENCY_BUDGET_MS)
+    
+    async def unavailable(error: Exception):
+        return unavailable_response(error)
+    
+    for error in UNAVAILABLE_ERRORS:
+        app.register_error_handler(error, unavailable)
+    
+    @app.before_serving
+    async def startup():
+        # Create missing tables; existing ones must have been migrated
+        async with async_engine.begin() as conn:
+            await conn.run_sync(db.metadata.create_all)
+            await conn.run_sync(check_schema)
+        
+        if await async_redis_client.is_connected():
+            app.logger.info("Successfully connected to Redis")
+            migrated = await async_redis_client.migrate_hash_to_sorted_set(Config.PRODUCT_STATS_KEY)
+            if migrated:
+                app.logger.info(f"Migrated {migrated} product counters to a sorted set")
+            if Config.PERSISTENCE_MODE == 'write_behind':
+                await AsyncCartService().sync_version_counter()
+        else:
+            app.logger.error("Could not connect to Redis. Carts are served from PostgreSQL until it is back.")
+        start_worker_tasks(app)
+    
+    @app.after_serving
+    async def shutdown():
+        product_stats.flush()
+        await async_engine.dispose()
     
-    return app
\ No newline at end of file
+    return app
@@ -0,0 +1,363 @@
+import asyncio
+import time
+import uuid
+import redis
+import redis.asyncio as aioredis
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable, TypeVar
+from app.cache.redis_client import (
+    redis_client, RedisShard, FILL_HASH_SCRIPT, RELEASE_LOCK_SCRIPT,
+    RAISE_VERSION_SCRIPT, TOP_UNION_SCRIPT, FILTER_ADD_SCRIPT, UPDATE_VERSIONED_HASH_SCRIPT,
+    SET_VERSIONED_HASH_SCRIPT
+)
+from app.cache.codec import codec, dumps
+from app.config import Config
+from app.pools import async_redis_pool
+from app.circuit_breaker import AsyncGuardedRedis
+from app.metrics import redis_reads, stage, timed
+
+T = TypeVar('T')
+
+class AsyncRedisShard:
+    """redis.asyncio connections to the nodes of a RedisShard"""
+
+    def __init__(self, shard: RedisShard):
+        self.shard = shard
+        # Connection to master (for writes), behind the same breaker as the synchronous one
+        self.master = AsyncGuardedRedis(connection_pool=async_redis_pool(*shard.address))
+        self.master.guard = shard.guard
+        # Connections to replicas (for reads), keyed like the router's replicas
+        self.replicas = {
+            f"{host}:{port}": aioredis.Redis(connection_pool=async_redis_pool(host, port))
+            for host, port in shard.replica_addresses
+        }
+        self.router = shard.router
+
+class AsyncRedisClient:
+    """
+    redis.asyncio counterpart of RedisClient for the ASGI app. Shard choice
+    and replica choice reuse the hash ring and the health, latency and lag
+    tracking of the synchronous client, so both serving paths route keys
+    and reads the same way.
+    """
+
+    def __init__(self):
+        self.shards = [AsyncRedisShard(shard) for shard in redis_client.shards]
+        # The first shard keeps the shared keys (stats, versions, streams, pub/sub)
+        self.master = self.shards[0].master
+        self.replicas = self.shards[0].replicas
+        self.router = self.shards[0].router
+
+        # Default expiration time for cache items (30 minutes)
+        self.default_expiry = Config.CACHE_TTL
+
+        self._release_lock_script = self.master.register_script(RELEASE_LOCK_SCRIPT)
+        self._raise_version_script = self.master.register_script(RAISE_VERSION_SCRIPT)
+        self._top_union_script = self.master.register_script(TOP_UNION_SCRIPT)
+        self._fill_hash_script = self.master.register_script(FILL_HASH_SCRIPT)
+        self._filter_add_script = self.master.register_script(FILTER_ADD_SCRIPT)
+        self._update_versioned_hash_script = self.master.register_script(UPDATE_VERSIONED_HASH_SCRIPT)
+        self._set_versioned_hash_script = self.master.register_script(SET_VERSIONED_HASH_SCRIPT)
+
+    def shard_for(self, key: str) -> AsyncRedisShard:
+        """Shard holding a key"""
+        return self.shards[redis_client.shard_for(key).index]
+
+    async def _fan_out(self, groups: Dict[RedisShard, Any],
+                       operation: Callable[[AsyncRedisShard, Any], Awaitable[T]]) -> Dict[RedisShard, T]:
+        """Run an operation for each shard's part of a batch concurrently"""
+        results = await asyncio.gather(*(
+            operation(self.shards[shard.index], part) for shard, part in groups.items()
+        ))
+        return dict(zip(groups, results))
+
+    async def _read(self, operation: Callable[[aioredis.Redis], Awaitable[T]],
+                    shard: Optional[AsyncRedisShard] = None) -> T:
+        """Run a read on the routed replica of the shard (the first one by default), falling back to its master"""
+        shard = shard or self.shards[0]
+        with stage('redis_read'):
+            state = shard.router.choose(redis_client.current_read_floor(shard.shard))
+            if state is None:
+                redis_reads.inc(node='master')
+                return await operation(shard.master)
+            start = time.monotonic()
+            try:
+                result = await operation(shard.replicas[state.name])
+            except (redis.ConnectionError, redis.TimeoutError) as e:
+                shard.router.record_failure(state, e)
+                redis_reads.inc(node='master')
+                return await operation(shard.master)
+            shard.router.record_success(state, (time.monotonic() - start) * 1000)
+            redis_reads.inc(node=state.name)
+            return result
+
+    @staticmethod
+    @timed('cache_decode')
+    def _decode_hash(data: Any) -> Optional[Dict[str, Any]]:
+        if isinstance(data, Exception) or not data:
+            return None
+        try:
+            return {field: codec.decode(value) for field, value in data.items()}
+        except ValueError:
+            # Not JSON, so not written by this app: treat it as a miss
+            return None
+
+    @timed('redis_write')
+    async def fill_hashes(self, mappings: Dict[str, Dict[str, Any]], expiry: Optional[int] = None) -> int:
+        """Create several hashes with a single pipeline per shard, skipping keys that already exist"""
+        async def fill_shard(shard: AsyncRedisShard, shard_mappings: Dict[str, Dict[str, Any]]) -> int:
+            async with shard.master.pipeline(transaction=False) as pipe:
+                for key, mapping in shard_mappings.items():
+                    if not mapping:
+                        continue
+                    args = [expiry or self.default_expiry]
+                    for field, value in mapping.items():
+                        args.extend([field, codec.encode(value)])
+                    await self._fill_hash_script(keys=[key], args=args, client=pipe)
+                return sum(await pipe.execute()) if len(pipe) else 0
+        return sum((await self._fan_out(redis_client._group_mappings(mappings), fill_shard)).values())
+
+    async def get_hash_with_ttl(self, key: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        """Get a hash and its remaining TTL in milliseconds from a replica in one round trip"""
+        async def operation(replica: aioredis.Redis) -> List[Any]:
+            async with replica.pipeline(transaction=False) as pipe:
+                pipe.hgetall(key)
+                pipe.pttl(key)
+                return await pipe.execute(raise_on_error=False)
+        data, ttl_ms = await self._read(operation, self.shard_for(key))
+        fields = self._decode_hash(data)
+        return fields, ttl_ms if fields else -2
+
+    async def get_hash_and_lock_state(self, key: str, lock_key: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Get a hash and whether a lock is still held, both from the master (same shard)"""
+        async with self.shard_for(key).master.pipeline(transaction=False) as pipe:
+            pipe.hgetall(key)
+            pipe.exists(lock_key)
+            with stage('redis_read'):
+                data, locked = await pipe.execute(raise_on_error=False)
+        redis_reads.inc(node='master')
+        return self._decode_hash(data), bool(locked)
+
+    async def get_hashes(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Get several hashes with one pipelined round trip to a replica of each shard"""
+        if not keys:
+            return []
+        async def read_shard(shard: AsyncRedisShard, shard_keys: List[str]) -> List[Any]:
+            async def operation(replica: aioredis.Redis) -> List[Any]:
+                async with replica.pipeline(transaction=False) as pipe:
+                    for key in shard_keys:
+                        pipe.hgetall(key)
+                    return await pipe.execute(raise_on_error=False)
+            return await self._read(operation, shard)
+        groups = redis_client.group_by_shard(keys)
+        found = {}
+        for shard, replies in (await self._fan_out(groups, read_shard)).items():
+            found.update(zip(groups[shard], replies))
+        return [self._decode_hash(found[key]) for key in keys]
+
+    async def get_hash_field(self, key: str, field: str) -> Optional[Any]:
+        """Get a single field of a hash from a replica, decoded from JSON"""
+        try:
+            data = await self._read(lambda replica: replica.hget(key, field), self.shard_for(key))
+        except redis.ResponseError:
+            return None
+        return codec.decode(data) if data is not None else None
+
+    async def get_master_hash(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get all fields of a hash from the master, i.e. its latest copy"""
+        try:
+            with stage('redis_read'):
+                data = await self.shard_for(key).master.hgetall(key)
+        except redis.ResponseError:
+            return None
+        redis_reads.inc(node='master')
+        return self._decode_hash(data)
+
+    @timed('redis_write')
+    async def update_versioned_hash(self, key: str, set_fields: Dict[str, Any], delete_fields: List[str],
+                                    expected_version: int, version: int, expiry: Optional[int] = None) -> int:
+        """Versioned field-level update of a hash (1 applied, 0 missing, -1 mismatch)"""
+        args = [expiry or self.default_expiry, expected_version, version, len(set_fields)]
+        for field, value in set_fields.items():
+            args.extend([field, codec.encode(value)])
+        args.extend(delete_fields)
+        shard = self.shard_for(key)
+        applied = int(await self._update_versioned_hash_script(keys=[key], args=args, client=shard.master))
+        redis_client.mark_write(shard.shard)
+        return applied
+
+    @timed('redis_write')
+    async def set_versioned_hash(self, key: str, mapping: Dict[str, Any], version: int,
+                                 expected_version: Optional[int] = None, expiry: Optional[int] = None) -> int:
+        """Replace a hash at a new version, see RedisClient.set_versioned_hash (1 written, 0 not newer, -1 mismatch)"""
+        args = redis_client._versioned_hash_args(mapping, expected_version, version, expiry or self.default_expiry)
+        shard = self.shard_for(key)
+        written = int(await self._set_versioned_hash_script(keys=[key], args=args, client=shard.master))
+        redis_client.mark_write(shard.shard)
+        return written
+
+    @timed('redis_write')
+    async def set_versioned_hashes(self, mappings: Dict[str, Tuple[int, Dict[str, Any]]],
+                                   expiry: Optional[int] = None) -> List[str]:
+        """set_versioned_hash for several (version, mapping) pairs, with a single pipeline per shard (returns the keys written)"""
+        if not mappings:
+            return []
+        async def write_shard(shard: AsyncRedisShard, shard_mappings: Dict[str, Tuple[int, Dict[str, Any]]]) -> List[str]:
+            async with shard.master.pipeline(transaction=False) as pipe:
+                for key, (version, mapping) in shard_mappings.items():
+                    args = redis_client._versioned_hash_args(mapping, None, version, expiry or self.default_expiry)
+                    await self._set_versioned_hash_script(keys=[key], args=args, client=pipe)
+                return [key for key, written in zip(shard_mappings, await pipe.execute()) if written == 1]
+        written = await self._fan_out(redis_client._group_mappings(mappings), write_shard)
+        for shard in written:
+            redis_client.mark_write(shard)
+        return [key for keys in written.values() for key in keys]
+
+    @timed('redis_write')
+    async def next_version(self, key: str) -> int:
+        """Take the next value of a version counter"""
+        version = await self.master.incr(key)
+        redis_client.mark_write()
+        return version
+
+    async def get_version(self, key: str) -> Optional[int]:
+        """Read a version counter from a replica (None if it is not set)"""
+        version = await self._read(lambda replica: replica.get(key))
+        return int(version) if version is not None else None
+
+    @timed('redis_write')
+    async def raise_version(self, key: str, version: int) -> None:
+        """Set a version counter unless it already holds a newer version"""
+        await self._raise_version_script(keys=[key], args=[version])
+        redis_client.mark_write()
+
+    async def acquire_lock(self, key: str, ttl_ms: int) -> Optional[str]:
+        """Try to take a short-lived lock, returns its token or None if it is held"""
+        token = uuid.uuid4().hex
+        if await self.shard_for(key).master.set(key, token, nx=True, px=ttl_ms):
+            return token
+        return None
+
+    async def release_lock(self, key: str, token: str) -> None:
+        """Release a lock taken with acquire_lock (no-op if it already expired)"""
+        await self._release_lock_script(keys=[key], args=[token], client=self.shard_for(key).master)
+
+    @timed('redis_write')
+    async def delete_data(self, key: str) -> None:
+        """Delete data from Redis"""
+        shard = self.shard_for(key)
+        await shard.master.delete(key)
+        redis_client.mark_write(shard.shard)
+
+    async def get_top_values(self, key: str, count: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+        """Get a page of the highest scored members of a Redis sorted set"""
+        items = await self._read(lambda replica: replica.zrevrange(key, offset, offset + count - 1, withscores=True))
+        return [{"id": member, "count": int(score)} for member, score in items]
+
+    @timed('redis_write')
+    async def get_top_union(self, dest: str, sources: List[Tuple[str, float]], expiry: int,
+                            count: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+        """Get a page of the weighted union of several sorted sets, see RedisClient.get_top_union"""
+        keys, args = redis_client._top_union_args(sources, expiry, count, offset)
+        items = await self._top_union_script(keys=[dest] + keys, args=args)
+        return [{"id": items[i], "count": round(float(items[i + 1]))} for i in range(0, len(items), 2)]
+
+    async def migrate_hash_to_sorted_set(self, key: str) -> int:
+        """Convert a counter hash into a sorted set, see RedisClient.migrate_hash_to_sorted_set"""
+        async with self.master.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    if await pipe.type(key) != 'hash':
+                        return 0
+                    counters = await pipe.hgetall(key)
+                    pipe.multi()
+                    pipe.delete(key)
+                    if counters:
+                        pipe.zadd(key, {member: int(value) for member, value in counters.items()})
+                    await pipe.execute()
+                    return len(counters)
+                except redis.WatchError:
+                    # Someone incremented a counter meanwhile, try again
+                    continue
+
+    @timed('redis_write')
+    async def add_to_filter(self, key: str, rebuild_key: str, offsets: List[int]) -> None:
+        """Set the bits of a value in a Bloom filter (and in its rebuild, if one is running)"""
+        await self._filter_add_script(keys=[key, rebuild_key], args=offsets)
+        redis_client.mark_write()
+
+    async def check_filter(self, key: str, meta_key: str, offsets: List[List[int]]) -> Tuple[Optional[str], List[bool]]:
+        """Layout of a Bloom filter and whether each value may be in it, see RedisClient.check_filter"""
+        async with self.master.pipeline(transaction=False) as pipe:
+            pipe.hget(meta_key, 'layout')
+            for value_offsets in offsets:
+                for offset in value_offsets:
+                    pipe.getbit(key, offset)
+            with stage('redis_read'):
+                replies = await pipe.execute()
+        redis_reads.inc(node='master')
+        return replies[0], redis_client._filter_hits(replies[1:], offsets)
+
+    async def count_filter_removal(self, meta_key: str) -> None:
+        """Count a value that left the set but is still in the filter"""
+        await self.master.hincrby(meta_key, 'removed', 1)
+
+    async def get_filter_meta(self, meta_key: str) -> Dict[str, str]:
+        """Layout, build time and removals since the build of a Bloom filter"""
+        return await self._read(lambda replica: replica.hgetall(meta_key))
+
+    @timed('redis_write')
+    async def append_stream(self, stream: str, record: Dict[str, Any]) -> str:
+        """Append a JSON record to a Redis Stream and return its entry id"""
+        return await self.master.xadd(stream, {'data': dumps(record)})
+
+    async def get_stream_lag(self, stream: str, group: str) -> Dict[str, Any]:
+        """Backlog of a consumer group, see RedisClient.get_stream_lag"""
+        if not await self.master.exists(stream):
+            return {'length': 0, 'pending': 0, 'undelivered': 0,
+                    'oldest_pending_age_ms': None, 'oldest_undelivered_age_ms': None}
+        groups = {info['name']: info for info in await self.master.xinfo_groups(stream)}
+        info = groups.get(group)
+        if info is None:
+            length = await self.master.xlen(stream)
+            oldest = await self.master.xrange(stream, count=1)
+            return {'length': length, 'pending': 0, 'undelivered': length,
+                    'oldest_pending_age_ms': None,
+                    'oldest_undelivered_age_ms': redis_client._stream_id_age_ms(oldest[0][0] if oldest else None)}
+
+        pending = await self.master.xpending(stream, group)
+        next_undelivered = await self.master.xrange(stream, min=f"({info['last-delivered-id']}", count=1)
+        return {
+            'length': await self.master.xlen(stream),
+            'pending': pending['pending'],
+            'undelivered': info.get('lag'),
+            'oldest_pending_age_ms': redis_client._stream_id_age_ms(pending['min']),
+            'oldest_undelivered_age_ms': redis_client._stream_id_age_ms(
+                next_undelivered[0][0] if next_undelivered else None
+            )
+        }
+
+    async def publish(self, channel: str, message: str) -> None:
+        """Publish a message on a pub/sub channel through the master"""
+        await self.master.publish(channel, message)
+
+    async def end_session(self) -> Optional[str]:
+        """New read-your-writes session token if the request wrote anything"""
+        written = redis_client.take_write_flag()
+        if not written:
+            return None
+        try:
+            roles = await asyncio.gather(*(self.shards[index].master.execute_command('ROLE') for index in written))
+        except redis.RedisError:
+            return None
+        return redis_client.session_token({index: role[1] for index, role in zip(written, roles)})
+
+    async def is_connected(self) -> bool:
+        """Check if the Redis master of every shard is connected"""
+        try:
+            return all(await asyncio.gather(*(shard.master.ping() for shard in self.shards)))
+        except redis.RedisError:
+            return False
+
+# Global async Redis client instance
+async_redis_client = AsyncRedisClient()
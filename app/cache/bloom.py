@@ -0,0 +1,23 @@
+import hashlib
+import math
+from typing import List, Tuple
+
+def bloom_size(capacity: int, error_rate: float) -> Tuple[int, int]:
+    """
+    Number of bits and of hash functions of a Bloom filter holding
+    `capacity` values with the given false positive rate
+    """
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+def bloom_offsets(value: str, bits: int, hashes: int) -> List[int]:
+    """
+    Bit offsets of a value, by double hashing (Kirsch-Mitzenmacher): two
+    64-bit halves of one digest stand in for `hashes` independent hashes
+    """
+    digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], 'big')
+    # Odd step, so the offsets never collapse onto a single bit
+    step = int.from_bytes(digest[8:], 'big') | 1
+    return [(first + i * step) % bits for i in range(hashes)]
@@ -0,0 +1,34 @@
+import orjson
+from typing import Any, Dict, List
+
+def dumps(value: Any, sort_keys: bool = False) -> str:
+    """Compact JSON text"""
+    return orjson.dumps(value, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode()
+
+def loads(data: str) -> Any:
+    return orjson.loads(data)
+
+class CacheCodec:
+    """Encodes the values stored in Redis as compact JSON"""
+
+    def encode(self, value: Any) -> str:
+        return dumps(value)
+
+    def decode(self, data: str) -> Any:
+        """Decode a stored value, raising ValueError if it is not JSON"""
+        return loads(data)
+
+def cart_body(user_id: str, items: List[Dict[str, Any]], version: int = 0) -> str:
+    """
+    JSON response body of a cart (same document as jsonify(cart.to_dict())),
+    built straight from item dicts without creating model objects
+    """
+    return dumps({
+        'user_id': user_id,
+        'items': items,
+        'total': sum(item['price'] * item['quantity'] for item in items if item['price'] is not None),
+        'version': version
+    }, sort_keys=True)
+
+# Global codec instance
+codec = CacheCodec()
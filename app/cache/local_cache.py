@@ -0,0 +1,171 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Any, Dict, Tuple
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+class LocalCache:
+    """Bounded in-process LRU + TTL cache that sits in front of Redis.
+
+    Entries are evicted when either the entry budget or the (estimated) byte
+    budget is exceeded. Other workers invalidate our copies through a Redis
+    pub/sub channel (see ``start_invalidation_listener``).
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: int, enabled: bool = True):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # Unique id so a worker can ignore its own invalidation messages
+        self.origin = uuid.uuid4().hex
+        self._entries: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _estimate_size(value: Any) -> int:
+        """Rough size of a cached value, measured as its JSON length"""
+        if isinstance(value, (str, bytes)):
+            return len(value)
+        if isinstance(value, tuple):
+            # e.g. a (version, body) pair
+            return sum(LocalCache._estimate_size(part) for part in value)
+        try:
+            return len(json.dumps(value))
+        except (TypeError, ValueError):
+            return 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None if missing/expired"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, size = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a value, evicting least recently used entries if over budget"""
+        if not self.enabled:
+            return
+        size = self._estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (value, time.monotonic() + self.ttl, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        """Drop a single key from the local cache"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """Drop every entry (e.g. after losing the invalidation channel)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters for monitoring the local cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+    def invalidation_message(self, key: str) -> str:
+        """Pub/sub payload telling the other workers to drop key"""
+        return f"{self.origin}:{key}"
+
+    def publish_invalidation(self, redis_client, channel: str, key: str) -> None:
+        """
+        Invalidate key locally and tell the other workers to do the same. A
+        failed publish is logged: their copies then expire with the TTL.
+        """
+        self.invalidate(key)
+        if self.enabled:
+            try:
+                redis_client.publish(channel, self.invalidation_message(key))
+            except Exception as e:
+                logger.warning(f"Cache invalidation of {key} not published: {e}")
+
+    def _handle_message(self, message: Dict[str, Any]) -> None:
+        if message.get('type') != 'message':
+            return
+        origin, _, key = message['data'].partition(':')
+        if origin != self.origin:
+            self.invalidate(key)
+
+    def _listen(self, redis_client, channel: str) -> None:
+        while True:
+            try:
+                pubsub = redis_client.pubsub()
+                pubsub.subscribe(channel)
+                while True:
+                    # Poll below the socket timeout so an idle channel is not an error
+                    message = pubsub.get_message(timeout=0.5)
+                    if message is not None:
+                        self._handle_message(message)
+            except Exception as e:
+                # Messages may have been lost while disconnected, so start cold
+                logger.warning(f"Cache invalidation listener error: {e}")
+                self.clear()
+                time.sleep(1)
+
+    def start_invalidation_listener(self, redis_client, channel: str) -> None:
+        """Subscribe to the invalidation channel in a daemon thread"""
+        if not self.enabled or self._listener is not None:
+            return
+        self._listener = threading.Thread(
+            target=self._listen, args=(redis_client, channel), name='local-cache-invalidation', daemon=True
+        )
+        self._listener.start()
+
+# Global local cache instance
+local_cache = LocalCache(
+    max_entries=Config.LOCAL_CACHE_MAX_ENTRIES,
+    max_bytes=Config.LOCAL_CACHE_MAX_BYTES,
+    ttl=Config.LOCAL_CACHE_TTL,
+    enabled=Config.LOCAL_CACHE_ENABLED
+)
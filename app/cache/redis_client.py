@@ -1,74 +1,800 @@
-import json
+import time
+import uuid
 import redis
-from typing import Optional, Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+from typing import Optional, Dict, Any, List, Tuple, Callable, TypeVar
+from app.cache.replica_router import ReplicaRouter
+from app.cache.sharding import HashRing
+from app.circuit_breaker import GuardedRedis, RedisGuard, circuit_breaker
+from app.pools import redis_pool
+from app.metrics import redis_reads, stage, timed
+from app.cache.codec import codec, dumps, loads
 from app.config import Config
 
+T = TypeVar('T')
+
+# Read-your-writes state of the current request: the master offset reads must
+# have caught up with, and whether this request wrote anything
+_read_floor: ContextVar[Optional[Dict[int, int]]] = ContextVar('redis_read_floor', default=None)
+_wrote: ContextVar[Tuple[int, ...]] = ContextVar('redis_wrote', default=())
+
+# Create a hash with a TTL only if the key does not exist yet, so preloading
+# never overwrites a fresher entry written by a request.
+# ARGV: expiry, field/value pairs...
+FILL_HASH_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Versioned hashes keep their version in the _version field (0 when missing).
+# Apply field-level changes and refresh the TTL only if the hash holds the
+# expected version, then stamp the new one.
+# ARGV: expiry, expected version, new version, number of fields to set,
+# field/value pairs..., fields to delete...
+# Returns 1 when applied, 0 when the key is missing (or is not a hash) and
+# -1 when it holds another version; nothing is written in the last two cases.
+UPDATE_VERSIONED_HASH_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'hash' then
+    return 0
+end
+if tonumber(redis.call('HGET', KEYS[1], '_version') or '0') ~= tonumber(ARGV[2]) then
+    return -1
+end
+local set_count = tonumber(ARGV[4])
+for i = 0, set_count - 1 do
+    redis.call('HSET', KEYS[1], ARGV[5 + 2 * i], ARGV[6 + 2 * i])
+end
+for i = 5 + 2 * set_count, #ARGV do
+    redis.call('HDEL', KEYS[1], ARGV[i])
+end
+redis.call('HSET', KEYS[1], '_version', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Replace a versioned hash. With an expected version only if it holds that
+# version (a missing key counts as version 0); without one ('') only if it
+# holds an older version than the new one, so a slow writer never puts an
+# older copy back. ARGV: expiry, expected version, new version, field/value pairs...
+# Returns 1 when written, 0 when skipped as not newer, -1 when the version differs.
+SET_VERSIONED_HASH_SCRIPT = """
+local current = 0
+if redis.call('TYPE', KEYS[1]).ok == 'hash' then
+    current = tonumber(redis.call('HGET', KEYS[1], '_version') or '0')
+end
+if ARGV[2] ~= '' then
+    if current ~= tonumber(ARGV[2]) then
+        return -1
+    end
+elseif current >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], '_version', ARGV[3], unpack(ARGV, 4))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Delete a versioned hash unless it holds a newer version than the given
+# one, i.e. a change made after that version was read. ARGV: version
+# Returns 1 when deleted, 0 when missing or newer.
+DELETE_VERSIONED_HASH_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok == 'hash'
+        and tonumber(redis.call('HGET', KEYS[1], '_version') or '0') > tonumber(ARGV[1]) then
+    return 0
+end
+return redis.call('DEL', KEYS[1])
+"""
+
+# Raise a numeric version key, never lowering it, so out-of-order writers
+# cannot move readers back to an older version. ARGV: version
+RAISE_VERSION_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Merge weighted sorted sets into a short-lived destination (unless it is
+# still cached) and return a page of its members scoring at least 0.5, i.e.
+# whose count rounds to 1 or more.
+# KEYS: destination, sources... ARGV: expiry, offset, count, weights...
+TOP_UNION_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    local args = {'ZUNIONSTORE', KEYS[1], #KEYS - 1}
+    for i = 2, #KEYS do
+        args[#args + 1] = KEYS[i]
+    end
+    args[#args + 1] = 'WEIGHTS'
+    for i = 4, #ARGV do
+        args[#args + 1] = ARGV[i]
+    end
+    redis.call(unpack(args))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return redis.call('ZREVRANGEBYSCORE', KEYS[1], '+inf', '0.5', 'WITHSCORES', 'LIMIT', ARGV[2], ARGV[3])
+"""
+
+# Set the bits of a Bloom filter, and of its rebuild in progress if there is
+# one, so values added while the filter is rebuilt are not lost on the swap.
+# KEYS: filter, filter being rebuilt. ARGV: bit offsets...
+FILTER_ADD_SCRIPT = """
+local rebuilding = redis.call('EXISTS', KEYS[2]) == 1
+for i = 1, #ARGV do
+    redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+    if rebuilding then
+        redis.call('SETBIT', KEYS[2], ARGV[i], 1)
+    end
+end
+return 1
+"""
+
+# Delete a lock only if it is still held by the caller's token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def shard_specs() -> List[Tuple[str, Tuple[str, int], List[Tuple[str, int]]]]:
+    """Configured shards, or a single one made of the master and its replicas"""
+    return Config.REDIS_SHARDS or [
+        ('default', (Config.REDIS_MASTER_HOST, Config.REDIS_MASTER_PORT), Config.REDIS_REPLICAS)
+    ]
+
+class RedisShard:
+    """A master and its read replicas, holding one part of the cart keys"""
+    
+    def __init__(self, index: int, name: str, address: Tuple[str, int], replicas: List[Tuple[str, int]]):
+        self.index = index
+        self.name = name
+        self.address = address
+        self.replica_addresses = replicas
+        # Connection to master (for writes), behind the shard's circuit breaker
+        self.master = GuardedRedis(connection_pool=redis_pool(*address))
+        self.master.guard = RedisGuard(circuit_breaker(f"redis:{name}"), Config.REDIS_DEFERRED_MAX)
+        self.guard = self.master.guard
+        # Connections to replicas (for reads), routed by health and latency
+        self.router = ReplicaRouter(
+            self.master,
+            {
+                f"{host}:{port}": redis.Redis(connection_pool=redis_pool(host, port))
+                for host, port in replicas
+            },
+            health_interval=Config.REPLICA_HEALTH_INTERVAL,
+            retry_interval=Config.REPLICA_RETRY_INTERVAL,
+            max_lag_bytes=Config.REPLICA_MAX_LAG_BYTES
+        )
+
 class RedisClient:
+    """
+    Redis access for the app. Cart keys (and their locks, which share the
+    cart's hash tag) are spread over REDIS_SHARDS with a consistent hash
+    ring; the keys shared by every cart live on the first shard, whose
+    master is `self.master`. With a single shard this is the plain
+    master/replicas setup.
+    """
+    
     def __init__(self):
-        # Connection to master (for writes)
-        self.master = redis.Redis(
-            host=Config.REDIS_MASTER_HOST,
-            port=Config.REDIS_MASTER_PORT,
-            decode_responses=True
-        )
-        
-        # Connections to replicas (for reads)
-        self.replicas = [
-            redis.Redis(host=Config.REDIS_REPLICA_1_HOST, port=Config.REDIS_REPLICA_1_PORT, decode_responses=True),
-            redis.Redis(host=Config.REDIS_REPLICA_2_HOST, port=Config.REDIS_REPLICA_2_PORT, decode_responses=True)
+        self.shards = [
+            RedisShard(index, name, address, replicas)
+            for index, (name, address, replicas) in enumerate(shard_specs())
         ]
+        self.ring = HashRing([shard.name for shard in self.shards], Config.REDIS_SHARD_VNODES)
+        self._shards_by_name = {shard.name: shard for shard in self.shards}
+        # Batch operations run on every shard they touch in parallel
+        self._executor = self._make_executor()
+        
+        # The first shard keeps the shared keys (stats, versions, streams, pub/sub)
+        self.master = self.shards[0].master
+        self.router = self.shards[0].router
+        self.read_your_writes = Config.REDIS_READ_YOUR_WRITES
         
         # Default expiration time for cache items (30 minutes)
         self.default_expiry = Config.CACHE_TTL
+        
+        self._release_lock_script = self.master.register_script(RELEASE_LOCK_SCRIPT)
+        self._fill_hash_script = self.master.register_script(FILL_HASH_SCRIPT)
+        self._raise_version_script = self.master.register_script(RAISE_VERSION_SCRIPT)
+        self._top_union_script = self.master.register_script(TOP_UNION_SCRIPT)
+        self._filter_add_script = self.master.register_script(FILTER_ADD_SCRIPT)
+        self._update_versioned_hash_script = self.master.register_script(UPDATE_VERSIONED_HASH_SCRIPT)
+        self._set_versioned_hash_script = self.master.register_script(SET_VERSIONED_HASH_SCRIPT)
+        self._delete_versioned_hash_script = self.master.register_script(DELETE_VERSIONED_HASH_SCRIPT)
+    
+    def _make_executor(self) -> Optional[ThreadPoolExecutor]:
+        if len(self.shards) == 1:
+            return None
+        return ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='redis-shard')
+    
+    def reset_after_fork(self) -> None:
+        """
+        Drop the connections and threads inherited from the parent process.
+        Pre-forked workers call it before serving, see init_worker.
+        """
+        for shard in self.shards:
+            shard.master.connection_pool.reset()
+            for state in shard.router.replicas:
+                state.client.connection_pool.reset()
+        self._executor = self._make_executor()
+    
+    def shard_for(self, key: str) -> RedisShard:
+        """Shard holding a key"""
+        if len(self.shards) == 1:
+            return self.shards[0]
+        return self._shards_by_name[self.ring.get_node(key)]
+    
+    def group_by_shard(self, keys: List[str]) -> Dict[RedisShard, List[str]]:
+        """Keys grouped by the shard holding them"""
+        if len(self.shards) == 1:
+            return {self.shards[0]: list(keys)} if keys else {}
+        return {self._shards_by_name[name]: group for name, group in self.ring.group(keys).items()}
+    
+    def _fan_out(self, groups: Dict[RedisShard, Any], operation: Callable[[RedisShard, Any], T]) -> Dict[RedisShard, T]:
+        """Run an operation for each shard's part of a batch, in parallel when there are several"""
+        if len(groups) <= 1:
+            return {shard: operation(shard, part) for shard, part in groups.items()}
+        futures = {
+            shard: self._executor.submit(copy_context().run, operation, shard, part)
+            for shard, part in groups.items()
+        }
+        return {shard: future.result() for shard, future in futures.items()}
+    
+    def _read(self, operation: Callable[[redis.Redis], T], shard: Optional[RedisShard] = None) -> T:
+        """
+        Run a read on the replica of the shard (the first one by default)
+        picked by its router. Falls back to the master when no replica
+        qualifies (e.g. none has caught up with this session's last write)
+        or when the chosen replica fails.
+        """
+        shard = shard or self.shards[0]
+        with stage('redis_read'):
+            state = shard.router.choose(self.current_read_floor(shard))
+            if state is None:
+                redis_reads.inc(node='master')
+                return operation(shard.master)
+            start = time.monotonic()
+            try:
+                result = operation(state.client)
+            except (redis.ConnectionError, redis.TimeoutError) as e:
+                shard.router.record_failure(state, e)
+                redis_reads.inc(node='master')
+                return operation(shard.master)
+            shard.router.record_success(state, (time.monotonic() - start) * 1000)
+            redis_reads.inc(node=state.name)
+            return result
+    
+    @staticmethod
+    @timed('cache_decode')
+    def _decode_hash(data: Any) -> Optional[Dict[str, Any]]:
+        """Decode the JSON fields of an HGETALL reply (None for a miss or an error)"""
+        if isinstance(data, Exception) or not data:
+            return None
+        try:
+            return {field: codec.decode(value) for field, value in data.items()}
+        except ValueError:
+            # Not JSON, so not written by this app: treat it as a miss
+            return None
+    
+    def mark_write(self, shard: Optional[RedisShard] = None) -> None:
+        """Remember that the current request wrote to the master of a shard (the first one by default)"""
+        if self.read_your_writes:
+            index = shard.index if shard is not None else 0
+            if index not in _wrote.get():
+                _wrote.set(_wrote.get() + (index,))
+    
+    def take_write_flag(self) -> Tuple[int, ...]:
+        """Shards the current request wrote to (resets the flag)"""
+        written = _wrote.get()
+        if not self.read_your_writes or not written:
+            return ()
+        _wrote.set(())
+        return written
+    
+    def current_read_floor(self, shard: Optional[RedisShard] = None) -> Optional[int]:
+        """Master offset the current request's reads on a shard must have caught up with"""
+        floors = _read_floor.get()
+        if floors is None:
+            return None
+        return floors.get(shard.index if shard is not None else 0)
+    
+    def session_token(self, offsets: Dict[int, int]) -> str:
+        """
+        Session token for the master offsets of the written shards: the bare
+        offset with a single shard, "index:offset,..." otherwise
+        """
+        if len(self.shards) == 1:
+            return str(offsets[0])
+        return ','.join(f"{index}:{offset}" for index, offset in sorted(offsets.items()))
+    
+    def begin_session(self, token: Optional[str]) -> None:
+        """
+        Start a request with the session token returned by a previous write:
+        reads are then served only by replicas that replicated that far
+        """
+        _wrote.set(())
+        _read_floor.set(None)
+        if not self.read_your_writes or not token:
+            return
+        if token.isdigit():
+            _read_floor.set({0: int(token)})
+            return
+        floors = {}
+        for part in token.split(','):
+            index, _, offset = part.partition(':')
+            if not (index.isdigit() and offset.isdigit()):
+                return
+            floors[int(index)] = int(offset)
+        _read_floor.set(floors)
+    
+    def end_session(self) -> Optional[str]:
+        """New session token (the master offsets) if the request wrote anything"""
+        written = self.take_write_flag()
+        if not written:
+            return None
+        try:
+            return self.session_token({
+                index: self.shards[index].master.execute_command('ROLE')[1] for index in written
+            })
+        except redis.RedisError:
+            return None
+    
+    def start_health_checks(self) -> None:
+        """Start probing replica latency and lag in the background"""
+        for shard in self.shards:
+            shard.router.start()
+    
+    def get_replica_stats(self) -> List[Dict[str, Any]]:
+        """Health, latency, lag and read counts of every replica"""
+        return [
+            dict(stats, shard=shard.name)
+            for shard in self.shards for stats in shard.router.get_stats()
+        ]
+    
+    def get_hash_with_ttl(self, key: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        """Get a hash and its remaining TTL in milliseconds from a replica in one round trip"""
+        def operation(replica: redis.Redis) -> List[Any]:
+            pipe = replica.pipeline(transaction=False)
+            pipe.hgetall(key)
+            pipe.pttl(key)
+            return pipe.execute(raise_on_error=False)
+        data, ttl_ms = self._read(operation, self.shard_for(key))
+        fields = self._decode_hash(data)
+        return fields, ttl_ms if fields else -2
+    
+    def get_hash_and_lock_state(self, key: str, lock_key: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Get a hash and whether a lock is still held, both from the master (same shard)"""
+        pipe = self.shard_for(key).master.pipeline(transaction=False)
+        pipe.hgetall(key)
+        pipe.exists(lock_key)
+        with stage('redis_read'):
+            data, locked = pipe.execute(raise_on_error=False)
+        redis_reads.inc(node='master')
+        return self._decode_hash(data), bool(locked)
+    
+    def get_hashes(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Get several hashes with one pipelined round trip to a replica of each shard"""
+        if not keys:
+            return []
+        def read_shard(shard: RedisShard, shard_keys: List[str]) -> List[Any]:
+            def operation(replica: redis.Redis) -> List[Any]:
+                pipe = replica.pipeline(transaction=False)
+                for key in shard_keys:
+                    pipe.hgetall(key)
+                return pipe.execute(raise_on_error=False)
+            return self._read(operation, shard)
+        groups = self.group_by_shard(keys)
+        found = {}
+        for shard, replies in self._fan_out(groups, read_shard).items():
+            found.update(zip(groups[shard], replies))
+        return [self._decode_hash(found[key]) for key in keys]
+    
+    def _group_mappings(self, mappings: Dict[str, Dict[str, Any]]) -> Dict[RedisShard, Dict[str, Dict[str, Any]]]:
+        return {
+            shard: {key: mappings[key] for key in keys}
+            for shard, keys in self.group_by_shard(list(mappings)).items()
+        }
+    
+    @timed('redis_write')
+    def fill_hashes(self, mappings: Dict[str, Dict[str, Any]], expiry: Optional[int] = None) -> int:
+        """
+        Create several hashes with a single pipeline per shard, skipping keys
+        that already exist. Returns the number of hashes written.
+        """
+        def fill_shard(shard: RedisShard, shard_mappings: Dict[str, Dict[str, Any]]) -> int:
+            pipe = shard.master.pipeline(transaction=False)
+            for key, mapping in shard_mappings.items():
+                if not mapping:
+                    continue
+                args = [expiry or self.default_expiry]
+                for field, value in mapping.items():
+                    args.extend([field, codec.encode(value)])
+                self._fill_hash_script(keys=[key], args=args, client=pipe)
+            return sum(pipe.execute()) if len(pipe) else 0
+        return sum(self._fan_out(self._group_mappings(mappings), fill_shard).values())
+    
+    def get_hash_field(self, key: str, field: str) -> Optional[Any]:
+        """Get a single field of a hash from a replica, decoded from JSON"""
+        try:
+            data = self._read(lambda replica: replica.hget(key, field), self.shard_for(key))
+        except redis.ResponseError:
+            return None
+        return codec.decode(data) if data is not None else None
     
-    def _get_replica(self) -> redis.Redis:
-        """Get a replica connection using a simple round-robin strategy"""
-        import random
-        return random.choice(self.replicas)
-    
-    def set_data(self, key: str, data: Any, expiry: Optional[int] = None) -> None:
-        """Store data in Redis master with optional expiry time"""
-        serialized = json.dumps(data)
-        self.master.set(key, serialized, ex=expiry or self.default_expiry)
-    
-    def get_data(self, key: str) -> Optional[Any]:
-        """Get data from a Redis replica"""
-        replica = self._get_replica()
-        data = replica.get(key)
-        if data:
-            return json.loads(data)
+    def get_master_hash(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get all fields of a hash from the master, i.e. its latest copy"""
+        try:
+            with stage('redis_read'):
+                data = self.shard_for(key).master.hgetall(key)
+        except redis.ResponseError:
+            return None
+        redis_reads.inc(node='master')
+        return self._decode_hash(data)
+    
+    @staticmethod
+    def _versioned_hash_args(mapping: Dict[str, Any], expected_version: Optional[int], version: int,
+                             expiry: int) -> List[Any]:
+        args = [expiry, '' if expected_version is None else expected_version, version]
+        for field, value in mapping.items():
+            args.extend([field, codec.encode(value)])
+        return args
+    
+    @timed('redis_write')
+    def update_versioned_hash(self, key: str, set_fields: Dict[str, Any], delete_fields: List[str],
+                              expected_version: int, version: int, expiry: Optional[int] = None) -> int:
+        """
+        Set and delete individual hash fields and refresh the TTL in one
+        atomic step, only if the hash holds expected_version (it is then
+        stamped with the new version).
+        Returns 1 when applied, 0 when the hash is missing, -1 on a version mismatch.
+        """
+        args = [expiry or self.default_expiry, expected_version, version, len(set_fields)]
+        for field, value in set_fields.items():
+            args.extend([field, codec.encode(value)])
+        args.extend(delete_fields)
+        shard = self.shard_for(key)
+        applied = int(self._update_versioned_hash_script(keys=[key], args=args, client=shard.master))
+        self.mark_write(shard)
+        return applied
+    
+    @timed('redis_write')
+    def set_versioned_hash(self, key: str, mapping: Dict[str, Any], version: int,
+                           expected_version: Optional[int] = None, expiry: Optional[int] = None) -> int:
+        """
+        Replace a hash with the given fields at a new version: if it holds
+        expected_version, or without one, if what it holds is older.
+        Returns 1 when written, 0 when skipped as not newer, -1 on a version mismatch.
+        """
+        args = self._versioned_hash_args(mapping, expected_version, version, expiry or self.default_expiry)
+        shard = self.shard_for(key)
+        written = int(self._set_versioned_hash_script(keys=[key], args=args, client=shard.master))
+        self.mark_write(shard)
+        return written
+    
+    @timed('redis_write')
+    def set_versioned_hashes(self, mappings: Dict[str, Tuple[int, Dict[str, Any]]],
+                             expiry: Optional[int] = None) -> List[str]:
+        """
+        set_versioned_hash (without an expected version) for several
+        (version, mapping) pairs, with a single pipeline per shard. Returns
+        the keys written, i.e. not already holding a newer version.
+        """
+        if not mappings:
+            return []
+        def write_shard(shard: RedisShard, shard_mappings: Dict[str, Tuple[int, Dict[str, Any]]]) -> List[str]:
+            pipe = shard.master.pipeline(transaction=False)
+            for key, (version, mapping) in shard_mappings.items():
+                args = self._versioned_hash_args(mapping, None, version, expiry or self.default_expiry)
+                self._set_versioned_hash_script(keys=[key], args=args, client=pipe)
+            return [key for key, written in zip(shard_mappings, pipe.execute()) if written == 1]
+        written = self._fan_out(self._group_mappings(mappings), write_shard)
+        for shard in written:
+            self.mark_write(shard)
+        return [key for keys in written.values() for key in keys]
+    
+    @timed('redis_write')
+    def delete_versioned_hashes(self, versions: Dict[str, int]) -> List[str]:
+        """
+        Delete several versioned hashes, each unless it holds a newer version
+        than the given one, with a single pipeline per shard. Returns the keys deleted.
+        """
+        if not versions:
+            return []
+        def delete_shard(shard: RedisShard, shard_versions: Dict[str, int]) -> List[str]:
+            pipe = shard.master.pipeline(transaction=False)
+            for key, version in shard_versions.items():
+                self._delete_versioned_hash_script(keys=[key], args=[version], client=pipe)
+            return [key for key, deleted in zip(shard_versions, pipe.execute()) if deleted == 1]
+        deleted = self._fan_out(self._group_mappings(versions), delete_shard)
+        for shard in deleted:
+            self.mark_write(shard)
+        return [key for keys in deleted.values() for key in keys]
+    
+    @timed('redis_write')
+    def next_version(self, key: str) -> int:
+        """Take the next value of a version counter"""
+        version = self.master.incr(key)
+        self.mark_write()
+        return version
+    
+    def get_version(self, key: str) -> Optional[int]:
+        """Read a version counter from a replica (None if it is not set)"""
+        version = self._read(lambda replica: replica.get(key))
+        return int(version) if version is not None else None
+    
+    @timed('redis_write')
+    def raise_version(self, key: str, version: int) -> None:
+        """Set a version counter unless it already holds a newer version"""
+        self._raise_version_script(keys=[key], args=[version])
+        self.mark_write()
+    
+    def acquire_lock(self, key: str, ttl_ms: int) -> Optional[str]:
+        """Try to take a short-lived lock, returns its token or None if it is held"""
+        token = uuid.uuid4().hex
+        if self.shard_for(key).master.set(key, token, nx=True, px=ttl_ms):
+            return token
         return None
     
+    def release_lock(self, key: str, token: str) -> None:
+        """Release a lock taken with acquire_lock (no-op if it already expired)"""
+        self._release_lock_script(keys=[key], args=[token], client=self.shard_for(key).master)
+    
+    @timed('redis_write')
     def delete_data(self, key: str) -> None:
         """Delete data from Redis"""
-        self.master.delete(key)
+        shard = self.shard_for(key)
+        shard.master.delete(key)
+        self.mark_write(shard)
+    
+    @timed('redis_write')
+    def increment_scores(self, keys: Dict[str, Optional[int]], amounts: Dict[str, int]) -> None:
+        """
+        Increment members' scores in several sorted sets with a single
+        pipeline, refreshing the expiry of the keys that have one
+        """
+        if not amounts:
+            return
+        pipe = self.master.pipeline(transaction=False)
+        for key, expiry in keys.items():
+            for member, amount in amounts.items():
+                pipe.zincrby(key, amount, member)
+            if expiry:
+                pipe.expire(key, expiry)
+        pipe.execute()
+    
+    def get_top_values(self, key: str, count: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+        """Get a page of the highest scored members of a Redis sorted set"""
+        items = self._read(lambda replica: replica.zrevrange(key, offset, offset + count - 1, withscores=True))
+        return [{"id": member, "count": int(score)} for member, score in items]
+    
+    @staticmethod
+    def _top_union_args(sources: List[Tuple[str, float]], expiry: int, count: int, offset: int):
+        keys = [key for key, _ in sources]
+        return keys, [expiry, offset, count] + [weight for _, weight in sources]
+    
+    @timed('redis_write')
+    def get_top_union(self, dest: str, sources: List[Tuple[str, float]], expiry: int,
+                      count: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Get a page of the highest scored members of the weighted union of
+        several sorted sets, cached in dest for expiry seconds (on the master)
+        """
+        keys, args = self._top_union_args(sources, expiry, count, offset)
+        items = self._top_union_script(keys=[dest] + keys, args=args)
+        return [{"id": items[i], "count": round(float(items[i + 1]))} for i in range(0, len(items), 2)]
+    
+    def migrate_hash_to_sorted_set(self, key: str) -> int:
+        """
+        Convert a counter hash into a sorted set with the same scores.
+        Returns the number of migrated members (0 if there was nothing to do).
+        """
+        with self.master.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    if pipe.type(key) != 'hash':
+                        return 0
+                    counters = pipe.hgetall(key)
+                    pipe.multi()
+                    pipe.delete(key)
+                    if counters:
+                        pipe.zadd(key, {member: int(value) for member, value in counters.items()})
+                    pipe.execute()
+                    return len(counters)
+                except redis.WatchError:
+                    # Someone incremented a counter meanwhile, try again
+                    continue
+    
+    @timed('redis_write')
+    def add_to_filter(self, key: str, rebuild_key: str, offsets: List[int]) -> None:
+        """Set the bits of a value in a Bloom filter (and in its rebuild, if one is running)"""
+        self._filter_add_script(keys=[key, rebuild_key], args=offsets)
+        self.mark_write()
+    
+    @staticmethod
+    def _filter_hits(bits: List[int], offsets: List[List[int]]) -> List[bool]:
+        """Whether every bit of each value is set, from the flat GETBIT replies"""
+        hits = []
+        position = 0
+        for value_offsets in offsets:
+            hits.append(all(bits[position:position + len(value_offsets)]))
+            position += len(value_offsets)
+        return hits
+    
+    def check_filter(self, key: str, meta_key: str, offsets: List[List[int]]) -> Tuple[Optional[str], List[bool]]:
+        """
+        Layout of a Bloom filter (None until it is built) and whether each
+        value may be in it, in one round trip. Read from the master: a
+        replica that has not received an add yet would answer a false negative.
+        """
+        pipe = self.master.pipeline(transaction=False)
+        pipe.hget(meta_key, 'layout')
+        for value_offsets in offsets:
+            for offset in value_offsets:
+                pipe.getbit(key, offset)
+        with stage('redis_read'):
+            replies = pipe.execute()
+        redis_reads.inc(node='master')
+        return replies[0], self._filter_hits(replies[1:], offsets)
+    
+    def start_filter_rebuild(self, rebuild_key: str, bits: int, expiry: int) -> None:
+        """Create an empty filter to rebuild into; from now on adds also go to it"""
+        pipe = self.master.pipeline(transaction=True)
+        pipe.delete(rebuild_key)
+        pipe.setbit(rebuild_key, bits - 1, 0)
+        pipe.expire(rebuild_key, expiry)
+        pipe.execute()
     
-    def increment_counter(self, key: str, field: str, amount: int = 1) -> None:
-        """Increment a hash field value by the given amount"""
-        self.master.hincrby(key, field, amount)
+    def set_bits(self, key: str, offsets: List[int], expiry: int) -> None:
+        """Set many bits with one pipeline and refresh the key's expiry"""
+        pipe = self.master.pipeline(transaction=False)
+        for offset in offsets:
+            pipe.setbit(key, offset, 1)
+        pipe.expire(key, expiry)
+        pipe.execute()
     
-    def get_top_values(self, key: str, count: int = 10) -> List[Dict[str, Any]]:
-        """Get the top N values from a Redis hash, sorted by value"""
-        replica = self._get_replica()
-        all_items = replica.hgetall(key)
-        if not all_items:
+    def finish_filter_rebuild(self, rebuild_key: str, key: str, meta_key: str, meta: Dict[str, Any]) -> None:
+        """Swap the rebuilt filter in and mark it ready, atomically"""
+        pipe = self.master.pipeline(transaction=True)
+        pipe.rename(rebuild_key, key)
+        pipe.persist(key)
+        pipe.delete(meta_key)
+        pipe.hset(meta_key, mapping=meta)
+        pipe.execute()
+        self.mark_write()
+    
+    def count_filter_removal(self, meta_key: str, count: int = 1) -> None:
+        """Count values that left the set but are still in the filter (Bloom filters cannot delete)"""
+        self.master.hincrby(meta_key, 'removed', count)
+    
+    def get_filter_meta(self, meta_key: str) -> Dict[str, str]:
+        """Layout, build time and removals since the build of a Bloom filter"""
+        return self._read(lambda replica: replica.hgetall(meta_key))
+    
+    @timed('redis_write')
+    def append_stream(self, stream: str, record: Dict[str, Any]) -> str:
+        """Append a JSON record to a Redis Stream and return its entry id"""
+        return self.master.xadd(stream, {'data': dumps(record)})
+    
+    def ensure_consumer_group(self, stream: str, group: str) -> None:
+        """Create the consumer group (and the stream) if it does not exist yet"""
+        try:
+            self.master.xgroup_create(stream, group, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+    
+    @staticmethod
+    def _decode_stream_entries(entries) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+        return [
+            (entry_id, loads(fields['data']) if fields else None)
+            for entry_id, fields in entries
+        ]
+    
+    def read_stream_group(self, stream: str, group: str, consumer: str, count: int,
+                          block_ms: int, pending: bool = False) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Read new entries for a consumer of the group, waiting up to block_ms,
+        or with pending=True the entries it was given but did not acknowledge
+        """
+        if pending:
+            response = self.master.xreadgroup(group, consumer, {stream: '0'}, count=count)
+        else:
+            response = self.master.xreadgroup(group, consumer, {stream: '>'}, count=count, block=block_ms)
+        if not response:
             return []
+        return self._decode_stream_entries(response[0][1])
+    
+    def claim_stale_entries(self, stream: str, group: str, consumer: str, min_idle_ms: int,
+                            count: int) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+        """Take over entries left pending by consumers that stopped acknowledging"""
+        response = self.master.xautoclaim(stream, group, consumer, min_idle_ms, start_id='0-0', count=count)
+        return self._decode_stream_entries(response[1])
+    
+    def count_pending_entries(self, stream: str, group: str) -> int:
+        """Entries delivered to any consumer of the group and not acknowledged yet"""
+        return self.master.xpending(stream, group)['pending']
+    
+    def ack_stream_entries(self, stream: str, group: str, entry_ids: List[str]) -> None:
+        """Acknowledge processed entries and remove them from the stream"""
+        if not entry_ids:
+            return
+        pipe = self.master.pipeline(transaction=True)
+        pipe.xack(stream, group, *entry_ids)
+        pipe.xdel(stream, *entry_ids)
+        pipe.execute()
+    
+    @staticmethod
+    def _stream_id_age_ms(entry_id: Optional[str]) -> Optional[int]:
+        """Age of a stream entry, based on the millisecond timestamp in its id"""
+        if not entry_id:
+            return None
+        return max(0, int(time.time() * 1000) - int(entry_id.split('-')[0]))
+    
+    def get_stream_lag(self, stream: str, group: str) -> Dict[str, Any]:
+        """Backlog of a consumer group: entries waiting, in flight and their age"""
+        if not self.master.exists(stream):
+            return {'length': 0, 'pending': 0, 'undelivered': 0,
+                    'oldest_pending_age_ms': None, 'oldest_undelivered_age_ms': None}
+        groups = {info['name']: info for info in self.master.xinfo_groups(stream)}
+        info = groups.get(group)
+        if info is None:
+            length = self.master.xlen(stream)
+            oldest = self.master.xrange(stream, count=1)
+            return {'length': length, 'pending': 0, 'undelivered': length,
+                    'oldest_pending_age_ms': None,
+                    'oldest_undelivered_age_ms': self._stream_id_age_ms(oldest[0][0] if oldest else None)}
         
-        # Convert values to integers and sort
-        sorted_items = sorted(
-            [(k, int(v)) for k, v in all_items.items()], 
-            key=lambda x: x[1], 
-            reverse=True
-        )
-        
-        # Return top N
-        return [{"id": item[0], "count": item[1]} for item in sorted_items[:count]]
+        pending = self.master.xpending(stream, group)
+        next_undelivered = self.master.xrange(stream, min=f"({info['last-delivered-id']}", count=1)
+        return {
+            'length': self.master.xlen(stream),
+            'pending': pending['pending'],
+            'undelivered': info.get('lag'),
+            'oldest_pending_age_ms': self._stream_id_age_ms(pending['min']),
+            'oldest_undelivered_age_ms': self._stream_id_age_ms(next_undelivered[0][0] if next_undelivered else None)
+        }
+    
+    def defer_delete(self, key: str) -> None:
+        """Delete a key once its shard is reachable again (for cache writes skipped during an outage)"""
+        self.shard_for(key).guard.defer('DEL', key)
+    
+    def defer_filter_add(self, key: str, offsets: List[int]) -> None:
+        """Set the bits of a Bloom filter (first shard) once Redis is reachable again"""
+        for offset in offsets:
+            self.shards[0].guard.defer('SETBIT', key, offset, 1)
+    
+    def defer_raise_version(self, key: str, version: int) -> None:
+        """Raise a version counter (first shard) once Redis is reachable again"""
+        self.shards[0].guard.defer('EVAL', RAISE_VERSION_SCRIPT, 1, key, version)
+    
+    def get_deferred_stats(self) -> List[Dict[str, Any]]:
+        """Commands waiting for each shard to come back, and those dropped for lack of room"""
+        return [
+            {'shard': shard.name, 'deferred': shard.guard.deferred_count(), 'dropped': shard.guard.dropped}
+            for shard in self.shards
+        ]
+    
+    def publish(self, channel: str, message: str) -> None:
+        """Publish a message on a pub/sub channel through the master"""
+        self.master.publish(channel, message)
+    
+    def pubsub(self) -> redis.client.PubSub:
+        """Create a pub/sub object on the master connection"""
+        return self.master.pubsub(ignore_subscribe_messages=True)
     
     def is_connected(self) -> bool:
-        """Check if Redis master is connected"""
+        """Check if the Redis master of every shard is connected"""
         try:
-            return self.master.ping()
-        except:
+            return all(shard.master.ping() for shard in self.shards)
+        except redis.RedisError:
             return False
 
 # Global Redis client instance
@@ -0,0 +1,145 @@
+import logging
+import random
+import threading
+import time
+import redis
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+class ReplicaState:
+    """Health, latency and replication offset of one read replica"""
+
+    def __init__(self, name: str, client: redis.Redis):
+        self.name = name
+        self.client = client
+        self.latency_ms: Optional[float] = None
+        self.offset: Optional[int] = None
+        self.lag_bytes: Optional[int] = None
+        self.healthy = True
+        self.ejected_until = 0.0
+        self.reads = 0
+        self.failures = 0
+
+    def available(self, now: float) -> bool:
+        return self.healthy and self.ejected_until <= now
+
+class ReplicaRouter:
+    """
+    Picks the replica for each read. Replicas are probed periodically for
+    latency and `master_repl_offset` lag; slow replicas get proportionally
+    less traffic, lagging or failing ones are ejected and retried later.
+    """
+
+    # Weight of the newest sample in the latency moving average
+    LATENCY_ALPHA = 0.2
+
+    def __init__(self, master: redis.Redis, replicas: Dict[str, redis.Redis], health_interval: float,
+                 retry_interval: float, max_lag_bytes: int):
+        self.master = master
+        self.replicas = [ReplicaState(name, client) for name, client in replicas.items()]
+        self.health_interval = health_interval
+        self.retry_interval = retry_interval
+        self.max_lag_bytes = max_lag_bytes
+        self.master_offset: Optional[int] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _observe_latency(self, state: ReplicaState, elapsed_ms: float) -> None:
+        if state.latency_ms is None:
+            state.latency_ms = elapsed_ms
+        else:
+            state.latency_ms += self.LATENCY_ALPHA * (elapsed_ms - state.latency_ms)
+
+    def _eject(self, state: ReplicaState, reason: str) -> None:
+        if state.ejected_until <= time.monotonic():
+            logger.warning(f"Ejecting Redis replica {state.name}: {reason}")
+        state.healthy = False
+        state.ejected_until = time.monotonic() + self.retry_interval
+
+    def probe(self) -> None:
+        """Refresh latency and replication lag of every replica that is due for a check"""
+        try:
+            self.master_offset = self.master.info('replication')['master_repl_offset']
+        except redis.RedisError as e:
+            logger.warning(f"Could not read master replication offset: {e}")
+
+        now = time.monotonic()
+        for state in self.replicas:
+            if not state.healthy and state.ejected_until > now:
+                continue
+            start = time.monotonic()
+            try:
+                info = state.client.info('replication')
+            except redis.RedisError as e:
+                with self._lock:
+                    state.failures += 1
+                    self._eject(state, str(e))
+                continue
+
+            with self._lock:
+                self._observe_latency(state, (time.monotonic() - start) * 1000)
+                state.offset = info.get('slave_repl_offset', info.get('master_repl_offset'))
+                if self.master_offset is not None and state.offset is not None:
+                    state.lag_bytes = max(0, self.master_offset - state.offset)
+                if info.get('master_link_status', 'up') != 'up':
+                    self._eject(state, 'replication link down')
+                elif state.lag_bytes is not None and state.lag_bytes > self.max_lag_bytes:
+                    self._eject(state, f"lagging {state.lag_bytes} bytes behind the master")
+                else:
+                    state.healthy = True
+                    state.ejected_until = 0.0
+
+    def _run(self) -> None:
+        while True:
+            self.probe()
+            time.sleep(self.health_interval)
+
+    def start(self) -> None:
+        """Probe replicas in a daemon thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='redis-replica-health', daemon=True)
+        self._thread.start()
+
+    def choose(self, min_offset: Optional[int] = None) -> Optional[ReplicaState]:
+        """
+        Pick an available replica, weighted towards the lowest latency. With
+        min_offset only replicas known to have replicated that far qualify.
+        Returns None when the read should go to the master.
+        """
+        now = time.monotonic()
+        candidates = [
+            state for state in self.replicas
+            if state.available(now) and (min_offset is None or (state.offset is not None and state.offset >= min_offset))
+        ]
+        if not candidates:
+            return None
+        weights = [1.0 / max(state.latency_ms or 1.0, 0.01) for state in candidates]
+        return random.choices(candidates, weights=weights)[0]
+
+    def record_success(self, state: ReplicaState, elapsed_ms: float) -> None:
+        with self._lock:
+            state.reads += 1
+            self._observe_latency(state, elapsed_ms)
+
+    def record_failure(self, state: ReplicaState, error: Exception) -> None:
+        with self._lock:
+            state.failures += 1
+            self._eject(state, str(error))
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Current view of every replica"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'name': state.name,
+                    'available': state.available(now),
+                    'latency_ms': round(state.latency_ms, 3) if state.latency_ms is not None else None,
+                    'offset': state.offset,
+                    'lag_bytes': state.lag_bytes,
+                    'reads': state.reads,
+                    'failures': state.failures
+                } for state in self.replicas
+            ]
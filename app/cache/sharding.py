@@ -0,0 +1,52 @@
+import bisect
+import hashlib
+from typing import Dict, List, Iterable, TypeVar
+
+T = TypeVar('T')
+
+def hash_tag(key: str) -> str:
+    """
+    Part of the key that decides its shard, with Redis Cluster semantics:
+    the text between the first '{' and the next '}' if it is not empty,
+    otherwise the whole key. 'cart:{u1}' and 'lock:cart:{u1}' share 'u1'.
+    """
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes. Each node owns `vnodes` points
+    of the ring and a key belongs to the first point after its hash, so
+    adding a node only moves about 1/N of the keys, all of them to the new
+    node. Nodes are identified by name, not by address, so moving a shard to
+    another host does not move its keys.
+    """
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = 160):
+        points = sorted(
+            (_ring_hash(f"{node}#{index}"), node)
+            for node in nodes for index in range(vnodes)
+        )
+        if not points:
+            raise ValueError('A hash ring needs at least one node')
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def get_node(self, key: str) -> str:
+        """Node owning a key (its hash tag, see hash_tag)"""
+        index = bisect.bisect(self._hashes, _ring_hash(hash_tag(key)))
+        return self._nodes[index % len(self._nodes)]
+
+    def group(self, keys: Iterable[str]) -> Dict[str, List[str]]:
+        """Keys grouped by the node owning them, keeping their order"""
+        groups: Dict[str, List[str]] = {}
+        for key in keys:
+            groups.setdefault(self.get_node(key), []).append(key)
+        return groups
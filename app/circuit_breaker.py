@@ -0,0 +1,295 @@
+import threading
+import time
+import redis
+import redis.asyncio as aioredis
+from contextvars import ContextVar
+from typing import Optional, Dict, List, Any, Tuple, Callable, Awaitable, TypeVar
+from app.metrics import metrics
+from app.config import Config
+
+T = TypeVar('T')
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+# Value of each state in the circuit_breaker_state gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breaker_transitions = metrics.counter(
+    'circuit_breaker_transitions_total', 'Circuit breaker state changes, by new state', ('breaker', 'state')
+)
+breaker_rejections = metrics.counter(
+    'circuit_breaker_rejected_total', 'Calls failed fast because the circuit was open', ('breaker',)
+)
+budget_exhausted = metrics.counter(
+    'request_budget_exceeded_total', 'Calls refused because the request had spent its latency budget', ('dependency',)
+)
+
+class DependencyUnavailableError(Exception):
+    """A dependency cannot be called now; requests answer 503"""
+
+class CircuitOpenError(DependencyUnavailableError):
+    """The dependency's circuit is open: it failed recently and is not being called"""
+
+class BudgetExceededError(DependencyUnavailableError):
+    """The request has spent its latency budget"""
+
+# Redis flavours, so the code that already handles Redis connection
+# failures (replica fallback, cache bypass) handles these the same way
+class RedisCircuitOpenError(CircuitOpenError, redis.ConnectionError):
+    pass
+
+class RedisBudgetExceededError(BudgetExceededError, redis.TimeoutError):
+    pass
+
+# Deadline (time.monotonic) of the current request, None outside requests
+_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default=None)
+
+def start_budget(budget_ms: int) -> None:
+    """Give the current request budget_ms milliseconds for its dependency calls (0 = no limit)"""
+    _deadline.set(time.monotonic() + budget_ms / 1000 if budget_ms > 0 else None)
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left in the current request's budget, None without one"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def check_budget(dependency: str, error: type = BudgetExceededError) -> None:
+    """Refuse to call a dependency once the request's budget is spent"""
+    remaining = remaining_budget()
+    if remaining is not None and remaining <= 0:
+        budget_exhausted.inc(dependency=dependency)
+        raise error(f"Latency budget spent before calling {dependency}")
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one dependency. Closed, calls go through; once
+    failure_threshold failures happen within failure_window seconds it
+    opens and calls fail fast for open_seconds. Then it is half-open: a
+    single trial call goes through and closes the circuit if it succeeds or
+    opens it again if it fails.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, failure_window: float, open_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._failures: List[float] = []
+        self._opened_at = 0.0
+        self._trial_started: Optional[float] = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        breaker_transitions.inc(breaker=self.name, state=state)
+
+    def before_call(self, error: type = CircuitOpenError) -> bool:
+        """
+        Admit a call or raise `error` if the circuit is open. Returns True
+        when the call is the half-open trial.
+        """
+        if self.state == CLOSED:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            # A trial that never reported back (e.g. a killed thread) is replaced
+            if self.state == HALF_OPEN and (self._trial_started is None or now - self._trial_started >= self.open_seconds):
+                self._trial_started = now
+                return True
+            if self.state == CLOSED:
+                return False
+            self.rejected += 1
+        breaker_rejections.inc(breaker=self.name)
+        raise error(f"Circuit {self.name} is open")
+
+    def record_success(self) -> None:
+        if self.state == CLOSED:
+            return
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._failures.clear()
+                self._trial_started = None
+                self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._trial_started = None
+                self._opened_at = now
+                self._transition(OPEN)
+                return
+            if self.state == OPEN:
+                return
+            self._failures = [failed_at for failed_at in self._failures if now - failed_at < self.failure_window]
+            self._failures.append(now)
+            if len(self._failures) >= self.failure_threshold:
+                self._opened_at = now
+                self._transition(OPEN)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'breaker': self.name, 'state': self.state, 'rejected': self.rejected}
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def circuit_breaker(name: str) -> CircuitBreaker:
+    """Shared breaker of a dependency, created with the CIRCUIT_* settings"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=Config.CIRCUIT_FAILURE_THRESHOLD,
+                failure_window=Config.CIRCUIT_FAILURE_WINDOW,
+                open_seconds=Config.CIRCUIT_OPEN_SECONDS
+            )
+        return _breakers[name]
+
+def breaker_stats() -> List[Dict[str, Any]]:
+    """State of every breaker of this process"""
+    return [breaker.get_stats() for breaker in list(_breakers.values())]
+
+class RedisGuard:
+    """
+    Circuit breaker of a Redis master plus the commands to replay when it
+    is reachable again. Cache writes skipped while it was down are deferred
+    here (as deletes of the keys they would have changed, for instance) and
+    sent before the next command that goes through, so no read sees the
+    cache as it was before the failure. That is the half-open trial after
+    an outage, or just the next call when the failure (a single timeout,
+    a spent budget) did not open the circuit.
+    """
+
+    def __init__(self, breaker: CircuitBreaker, max_deferred: int):
+        self.breaker = breaker
+        self.max_deferred = max_deferred
+        self._deferred: Dict[Tuple, None] = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def defer(self, *command: Any) -> None:
+        """Remember a command to run once Redis is back (duplicates are kept once)"""
+        with self._lock:
+            if command in self._deferred or len(self._deferred) < self.max_deferred:
+                self._deferred[command] = None
+            else:
+                self.dropped += 1
+
+    def deferred_count(self) -> int:
+        return len(self._deferred)
+
+    def _take_deferred(self) -> List[Tuple]:
+        with self._lock:
+            commands, self._deferred = list(self._deferred), {}
+        return commands
+
+    def _restore_deferred(self, commands: List[Tuple]) -> None:
+        with self._lock:
+            self._deferred = dict.fromkeys(commands + list(self._deferred))
+
+    def _admit(self) -> None:
+        check_budget(f"redis:{self.breaker.name}", RedisBudgetExceededError)
+        self.breaker.before_call(RedisCircuitOpenError)
+
+    def call(self, operation: Callable[[], T], replay: Callable[[List[Tuple]], Any]) -> T:
+        """Run a command (or pipeline) through the breaker"""
+        self._admit()
+        failed = False
+        try:
+            commands = self._take_deferred() if self._deferred else []
+            if commands:
+                try:
+                    replay(commands)
+                except Exception:
+                    self._restore_deferred(commands)
+                    raise
+            return operation()
+        except (redis.ConnectionError, redis.TimeoutError):
+            failed = True
+            raise
+        finally:
+            if failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+    async def call_async(self, operation: Callable[[], Awaitable[T]],
+                         replay: Callable[[List[Tuple]], Awaitable[Any]]) -> T:
+        """asyncio version of call"""
+        self._admit()
+        failed = False
+        try:
+            commands = self._take_deferred() if self._deferred else []
+            if commands:
+                try:
+                    await replay(commands)
+                except Exception:
+                    self._restore_deferred(commands)
+                    raise
+            return await operation()
+        except (redis.ConnectionError, redis.TimeoutError):
+            failed = True
+            raise
+        finally:
+            if failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+class GuardedPipeline(redis.client.Pipeline):
+    guard: RedisGuard
+    replay: Callable[[List[Tuple]], Any]
+
+    def execute(self, raise_on_error: bool = True) -> List[Any]:
+        return self.guard.call(lambda: super(GuardedPipeline, self).execute(raise_on_error), self.replay)
+
+class GuardedRedis(redis.Redis):
+    """redis.Redis whose commands and pipelines go through a RedisGuard (set `guard` after creating it)"""
+    guard: RedisGuard
+
+    def execute_command(self, *args, **options):
+        return self.guard.call(lambda: super(GuardedRedis, self).execute_command(*args, **options), self._replay)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> GuardedPipeline:
+        pipe = GuardedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipe.guard = self.guard
+        pipe.replay = self._replay
+        return pipe
+
+    def _replay(self, commands: List[Tuple]) -> None:
+        """Send deferred commands in one pipeline, bypassing the guard"""
+        pipe = redis.client.Pipeline(self.connection_pool, self.response_callbacks, False, None)
+        for command in commands:
+            pipe.execute_command(*command)
+        pipe.execute(raise_on_error=False)
+
+class AsyncGuardedPipeline(aioredis.client.Pipeline):
+    guard: RedisGuard
+    replay: Callable[[List[Tuple]], Awaitable[Any]]
+
+    async def execute(self, raise_on_error: bool = True) -> List[Any]:
+        return await self.guard.call_async(lambda: super(AsyncGuardedPipeline, self).execute(raise_on_error), self.replay)
+
+class AsyncGuardedRedis(aioredis.Redis):
+    """redis.asyncio counterpart of GuardedRedis (shares the guard of the synchronous client)"""
+    guard: RedisGuard
+
+    async def execute_command(self, *args, **options):
+        return await self.guard.call_async(
+            lambda: super(AsyncGuardedRedis, self).execute_command(*args, **options), self._replay
+        )
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> AsyncGuardedPipeline:
+        pipe = AsyncGuardedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipe.guard = self.guard
+        pipe.replay = self._replay
+        return pipe
+
+    async def _replay(self, commands: List[Tuple]) -> None:
+        pipe = aioredis.client.Pipeline(self.connection_pool, self.response_callbacks, False, None)
+        for command in commands:
+            pipe.execute_command(*command)
+        await pipe.execute(raise_on_error=False)
@@ -1,5 +1,26 @@
 import os
 
+def _parse_hosts(value: str):
+    """Parse a "host:port,host:port" list"""
+    return [
+        (host, int(port))
+        for host, port in (entry.strip().rsplit(':', 1) for entry in value.split(',') if entry.strip())
+    ]
+
+def _parse_shards(value: str):
+    """
+    Parse a "name=host:port/replica:port,replica:port;name=..." list of
+    Redis shards into (name, (host, port), [(host, port), ...]) tuples
+    """
+    shards = []
+    for entry in value.split(';'):
+        if not entry.strip():
+            continue
+        name, nodes = entry.strip().split('=', 1)
+        master, _, replicas = nodes.partition('/')
+        shards.append((name.strip(), _parse_hosts(master)[0], _parse_hosts(replicas)))
+    return shards
+
 class Config:   
     # PostgreSQL config
     POSTGRES_USER = 'postgres'
@@ -11,6 +32,22 @@ class Config:
     
     SQLALCHEMY_DATABASE_URI = f'postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Same database through asyncpg, used by the ASGI app
+    SQLALCHEMY_ASYNC_DATABASE_URI = f'postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}'
+    # Connection pool of each engine (per process): persistent connections,
+    # extra ones allowed under load, seconds to wait for a free connection,
+    # seconds before a connection is replaced (-1 = never) and whether to
+    # test connections on checkout. DB_KEEPALIVES_IDLE enables TCP keepalive
+    # probes after that many idle seconds (0 = system default).
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'false').lower() == 'true'
+    DB_KEEPALIVES_IDLE = int(os.environ.get('DB_KEEPALIVES_IDLE', 0))
+    # Seconds to open a connection and milliseconds a statement may run (0 = no limit)
+    DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 2))
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))
 
     # Redis config
     # Use localhost when running locally, container names when in Docker
@@ -20,10 +57,170 @@ class Config:
     REDIS_REPLICA_1_PORT = int(os.environ.get('REDIS_REPLICA_1_PORT', 6380))
     REDIS_REPLICA_2_HOST = os.environ.get('REDIS_REPLICA_2_HOST', 'localhost')
     REDIS_REPLICA_2_PORT = int(os.environ.get('REDIS_REPLICA_2_PORT', 6381))
+    # Any number of replicas as "host:port,host:port" (defaults to the two above)
+    REDIS_REPLICAS = _parse_hosts(os.environ.get(
+        'REDIS_REPLICAS',
+        f'{REDIS_REPLICA_1_HOST}:{REDIS_REPLICA_1_PORT},{REDIS_REPLICA_2_HOST}:{REDIS_REPLICA_2_PORT}'
+    ))
+    # Replica routing: seconds between health/lag probes, seconds before an
+    # ejected replica is retried and the replication lag that ejects a replica
+    REPLICA_HEALTH_INTERVAL = float(os.environ.get('REPLICA_HEALTH_INTERVAL', 1.0))
+    REPLICA_RETRY_INTERVAL = float(os.environ.get('REPLICA_RETRY_INTERVAL', 5.0))
+    REPLICA_MAX_LAG_BYTES = int(os.environ.get('REPLICA_MAX_LAG_BYTES', 1024 * 1024))
+    # Read-your-writes: writes return an X-Cart-Session token with the master
+    # offset and reads carrying it only go to replicas that caught up
+    REDIS_READ_YOUR_WRITES = os.environ.get('REDIS_READ_YOUR_WRITES', 'false').lower() == 'true'
+    # Sharding: cart keys spread over several master/replica groups with a
+    # consistent hash ring ("name=host:port/replica:port,...;name=..."). The
+    # first shard also keeps the shared keys (stats, catalog version, the
+    # write-behind stream and pub/sub). Empty means one shard made of
+    # REDIS_MASTER_HOST and REDIS_REPLICAS.
+    REDIS_SHARDS = _parse_shards(os.environ.get('REDIS_SHARDS', ''))
+    REDIS_SHARD_VNODES = int(os.environ.get('REDIS_SHARD_VNODES', 160))
+    # Connection pool of each Redis node (per process). With
+    # REDIS_POOL_BLOCKING a full pool makes callers wait up to
+    # REDIS_POOL_TIMEOUT seconds instead of failing at once. Socket timeouts
+    # in seconds (0 = none), health check interval in seconds (0 = off).
+    REDIS_POOL_MAX_CONNECTIONS = int(os.environ.get('REDIS_POOL_MAX_CONNECTIONS', 50))
+    REDIS_POOL_BLOCKING = os.environ.get('REDIS_POOL_BLOCKING', 'true').lower() == 'true'
+    REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', 5.0))
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 1.0)) or None
+    REDIS_SOCKET_CONNECT_TIMEOUT = float(os.environ.get('REDIS_SOCKET_CONNECT_TIMEOUT', 2.0)) or None
+    REDIS_SOCKET_KEEPALIVE = os.environ.get('REDIS_SOCKET_KEEPALIVE', 'true').lower() == 'true'
+    REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+    
+    # Circuit breakers, one per Redis shard master and one for PostgreSQL:
+    # CIRCUIT_FAILURE_THRESHOLD failures (timeouts, refused connections)
+    # within CIRCUIT_FAILURE_WINDOW seconds open the circuit, then calls fail
+    # fast for CIRCUIT_OPEN_SECONDS until a single trial call closes it again.
+    # Cache writes skipped while Redis is unreachable are replayed by that
+    # trial; at most REDIS_DEFERRED_MAX of them are remembered per shard.
+    CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+    CIRCUIT_FAILURE_WINDOW = float(os.environ.get('CIRCUIT_FAILURE_WINDOW', 10.0))
+    CIRCUIT_OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', 5.0))
+    REDIS_DEFERRED_MAX = int(os.environ.get('REDIS_DEFERRED_MAX', 100000))
+    # Milliseconds a request may spend before its Redis and PostgreSQL calls
+    # are refused and it answers 503 (0 = no limit)
+    REQUEST_LATENCY_BUDGET_MS = int(os.environ.get('REQUEST_LATENCY_BUDGET_MS', 2000))
     
     # Cache TTL in seconds (30 minutes)
     CACHE_TTL = 1800
     
     # Key prefixes
     CART_KEY_PREFIX = 'cart:'
-    PRODUCT_STATS_KEY = 'stats:top_products'
\ No newline at end of file
+    PRODUCT_STATS_KEY = 'stats:top_products'
+    # Product stats: deltas are buffered per process and flushed every
+    # STATS_FLUSH_INTERVAL seconds (0 writes every change through) or once
+    # STATS_FLUSH_MAX_PRODUCTS products are pending. Besides the all-time
+    # sorted set they go to hourly and daily buckets kept for the TTLs below.
+    STATS_FLUSH_INTERVAL = float(os.environ.get('STATS_FLUSH_INTERVAL', 1.0))
+    STATS_FLUSH_MAX_PRODUCTS = int(os.environ.get('STATS_FLUSH_MAX_PRODUCTS', 1000))
+    STATS_HOUR_BUCKET_TTL = int(os.environ.get('STATS_HOUR_BUCKET_TTL', 2 * 24 * 3600))
+    STATS_DAY_BUCKET_TTL = int(os.environ.get('STATS_DAY_BUCKET_TTL', 9 * 24 * 3600))
+    # Seconds a merged hour/day/week window is reused by /stats/top-products
+    STATS_WINDOW_CACHE_TTL = int(os.environ.get('STATS_WINDOW_CACHE_TTL', 5))
+    # Product catalog: every change raises the version key, and each process
+    # checks it at most every CATALOG_REFRESH_INTERVAL seconds to reload only
+    # the products that changed since its in-memory snapshot
+    CATALOG_VERSION_KEY = 'catalog:version'
+    CATALOG_REFRESH_INTERVAL = float(os.environ.get('CATALOG_REFRESH_INTERVAL', 1.0))
+    # Maximum number of users accepted by the batch cart endpoint
+    CART_BATCH_MAX_USERS = 500
+    # Maximum number of operations accepted by PATCH /cart/<user_id>
+    CART_PATCH_MAX_OPERATIONS = 100
+    # Default and maximum page size of /cart/<user_id>/items
+    CART_ITEMS_PAGE_SIZE = 50
+    CART_ITEMS_MAX_PAGE_SIZE = 500
+    # Upper bound for the page size of /stats/top-products
+    TOP_PRODUCTS_MAX_COUNT = 100
+
+    # Single-flight protection on cache misses: one worker per key loads from
+    # PostgreSQL while the others wait for it to fill the cache
+    CACHE_LOCK_PREFIX = 'lock:'
+    CACHE_LOCK_TTL_MS = int(os.environ.get('CACHE_LOCK_TTL_MS', 5000))
+    CACHE_LOCK_WAIT_MS = int(os.environ.get('CACHE_LOCK_WAIT_MS', 2000))
+    CACHE_LOCK_POLL_MS = int(os.environ.get('CACHE_LOCK_POLL_MS', 25))
+    # XFetch probabilistic early refresh before expiry (0 disables it)
+    CACHE_XFETCH_BETA = float(os.environ.get('CACHE_XFETCH_BETA', 1.0))
+    # Negative caching: a user without a cart is cached as a hash holding
+    # only the '_empty' marker for CACHE_EMPTY_TTL seconds (0 disables it);
+    # the first write to the cart replaces it
+    CACHE_EMPTY_TTL = int(os.environ.get('CACHE_EMPTY_TTL', 60))
+    # Optimistic concurrency: a cart write is a compare-and-set on the version
+    # it read, redone on a fresh copy up to CART_WRITE_RETRIES times when
+    # another write got there first (the request then answers 409)
+    CART_WRITE_RETRIES = int(os.environ.get('CART_WRITE_RETRIES', 3))
+    # Bloom filter of the users that have a cart, so misses for the others
+    # skip PostgreSQL. Used once built by scripts/rebuild_cart_filter.py;
+    # sized for CART_FILTER_CAPACITY users at CART_FILTER_ERROR_RATE false
+    # positives (changing either needs a rebuild)
+    CART_FILTER_ENABLED = os.environ.get('CART_FILTER_ENABLED', 'false').lower() == 'true'
+    CART_FILTER_KEY = 'carts:filter'
+    CART_FILTER_CAPACITY = int(os.environ.get('CART_FILTER_CAPACITY', 1000000))
+    CART_FILTER_ERROR_RATE = float(os.environ.get('CART_FILTER_ERROR_RATE', 0.01))
+
+    # Persistence mode: 'write_through' commits to PostgreSQL inside the request,
+    # 'write_behind' appends every change to a Redis Stream flushed by worker.py
+    PERSISTENCE_MODE = os.environ.get('PERSISTENCE_MODE', 'write_through')
+    CART_CHANGES_STREAM = 'stream:cart_changes'
+    # Write-behind cart versions are taken from this counter (raised at
+    # startup past the database sequence) since the change reaches
+    # PostgreSQL only later
+    CART_VERSION_KEY = 'carts:version'
+    CART_FLUSHER_GROUP = 'cart-flusher'
+    FLUSHER_BATCH_SIZE = int(os.environ.get('FLUSHER_BATCH_SIZE', 500))
+    FLUSHER_BLOCK_MS = int(os.environ.get('FLUSHER_BLOCK_MS', 1000))
+    # Pending entries idle for this long are taken over from dead consumers
+    FLUSHER_CLAIM_IDLE_MS = int(os.environ.get('FLUSHER_CLAIM_IDLE_MS', 30000))
+    FLUSHER_STATS_INTERVAL = int(os.environ.get('FLUSHER_STATS_INTERVAL', 60))
+
+    # In-process (L1) cart cache in front of Redis, disabled by default
+    LOCAL_CACHE_ENABLED = os.environ.get('LOCAL_CACHE_ENABLED', 'false').lower() == 'true'
+    LOCAL_CACHE_MAX_ENTRIES = int(os.environ.get('LOCAL_CACHE_MAX_ENTRIES', 10000))
+    LOCAL_CACHE_MAX_BYTES = int(os.environ.get('LOCAL_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    LOCAL_CACHE_TTL = int(os.environ.get('LOCAL_CACHE_TTL', 10))
+    # Pub/sub channel used by workers to invalidate each other's L1 entries
+    CACHE_INVALIDATION_CHANNEL = 'cache:invalidate'
+    
+    # Cache warming: preload the most recently updated carts into Redis, at
+    # startup (in the background) when CACHE_WARM_ON_STARTUP is set or with
+    # scripts/warm_cache.py. Rate limit in carts per second (0 = unlimited).
+    CACHE_WARM_ON_STARTUP = os.environ.get('CACHE_WARM_ON_STARTUP', 'false').lower() == 'true'
+    CACHE_WARM_MAX_CARTS = int(os.environ.get('CACHE_WARM_MAX_CARTS', 50000))
+    CACHE_WARM_SINCE_HOURS = float(os.environ.get('CACHE_WARM_SINCE_HOURS', 24))
+    CACHE_WARM_CHUNK_SIZE = int(os.environ.get('CACHE_WARM_CHUNK_SIZE', 500))
+    CACHE_WARM_RATE_LIMIT = float(os.environ.get('CACHE_WARM_RATE_LIMIT', 5000))
+    
+    # Abandoned carts: carts not updated for CART_ARCHIVE_AFTER_DAYS days are
+    # moved to the cart_archive table in batches of CART_ARCHIVE_BATCH_SIZE
+    # (at most CART_ARCHIVE_MAX_BATCHES per pass, 0 = until none is left),
+    # every CART_ARCHIVE_INTERVAL seconds by worker.py when CART_ARCHIVE_ENABLED
+    # is set, or with scripts/archive_carts.py. Monthly archive partitions
+    # older than CART_ARCHIVE_RETENTION_MONTHS are dropped (0 = kept forever)
+    CART_ARCHIVE_ENABLED = os.environ.get('CART_ARCHIVE_ENABLED', 'false').lower() == 'true'
+    CART_ARCHIVE_AFTER_DAYS = float(os.environ.get('CART_ARCHIVE_AFTER_DAYS', 30))
+    CART_ARCHIVE_BATCH_SIZE = int(os.environ.get('CART_ARCHIVE_BATCH_SIZE', 500))
+    CART_ARCHIVE_MAX_BATCHES = int(os.environ.get('CART_ARCHIVE_MAX_BATCHES', 0))
+    CART_ARCHIVE_INTERVAL = int(os.environ.get('CART_ARCHIVE_INTERVAL', 3600))
+    CART_ARCHIVE_RETENTION_MONTHS = int(os.environ.get('CART_ARCHIVE_RETENTION_MONTHS', 0))
+    
+    # Metrics: with SERVER_TIMING_ENABLED, requests that send an X-Server-Timing
+    # header get a Server-Timing response header with their per-stage timings
+    SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+    # Processes serving the same app (gunicorn workers) write their metrics
+    # to METRICS_MULTIPROC_DIR every METRICS_SNAPSHOT_INTERVAL seconds, and
+    # /metrics reports all of them. gunicorn.conf.py uses a temporary
+    # directory when it is not set; empty it before starting other servers
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR', '')
+    METRICS_SNAPSHOT_INTERVAL = float(os.environ.get('METRICS_SNAPSHOT_INTERVAL', 5))
+
+    # Production server (gunicorn.conf.py): pre-forked workers, each with
+    # SERVER_THREADS threads (0 workers = 2 per CPU + 1), request timeout and
+    # seconds an idle keep-alive connection is held open
+    SERVER_BIND = os.environ.get('SERVER_BIND', '0.0.0.0:5000')
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', 0))
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 4))
+    SERVER_TIMEOUT = int(os.environ.get('SERVER_TIMEOUT', 30))
+    SERVER_KEEPALIVE = int(os.environ.get('SERVER_KEEPALIVE', 5))
+    # Werkzeug debugger and reloader of the development server (run.py)
+    DEV_SERVER_DEBUG = os.environ.get('DEV_SERVER_DEBUG', 'true').lower() == 'true'
@@ -0,0 +1,345 @@
+import functools
+import glob
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List, Tuple, Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets in seconds, from sub-millisecond Redis reads to slow requests
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(values: Dict[Tuple[str, ...], Any], key: Tuple[str, ...], value: float) -> None:
+        """Add another process's value of a label set to values"""
+        values[key] = values.get(key, 0) + value
+
+    def render(self, values: Optional[Dict[Tuple[str, ...], float]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        values = self.values() if values is None else values
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # Per label set: bucket counts, sum, count
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def values(self) -> Dict[Tuple[str, ...], Tuple[List[int], float, int]]:
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+
+    @staticmethod
+    def merge(values: Dict[Tuple[str, ...], Any], key: Tuple[str, ...], value: Tuple[List[int], float, int]) -> None:
+        """Add another process's bucket counts, sum and count of a label set to values"""
+        counts, total, count = value
+        if key in values:
+            merged_counts, merged_total, merged_count = values[key]
+            counts = [a + b for a, b in zip(merged_counts, counts)]
+            total, count = merged_total + total, merged_count + count
+        values[key] = (list(counts), total, count)
+
+    def render(self, values: Optional[Dict[Tuple[str, ...], Tuple[List[int], float, int]]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        values = self.values() if values is None else values
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+class RequestMetrics:
+    """Stage timings and database round trips of the request being served"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.db_round_trips = 0
+
+    def add_stage(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        entries = [f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in self.stages.items()]
+        entries.append(f'db;desc="{self.db_round_trips} round trips"')
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.3f}")
+        return ', '.join(entries)
+
+_current_request: ContextVar[Optional[RequestMetrics]] = ContextVar('request_metrics', default=None)
+
+Family = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+
+SNAPSHOT_PATTERN = 'metrics-*.json'
+
+def _render_family(name: str, description: str, metric_type: str,
+                   samples: List[Tuple[Dict[str, Any], float]]) -> List[str]:
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        names = tuple(labels)
+        lines.append(f"{name}{_format_labels(names, tuple(str(labels[n]) for n in names))} {_format_value(value)}")
+    return lines
+
+def _snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    """Replace a file atomically, so readers never see half of it"""
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+def reset_shared_metrics(directory: str) -> None:
+    """Delete the snapshots of a previous run (the server's master calls it before forking)"""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, SNAPSHOT_PATTERN)):
+        os.remove(path)
+
+def mark_process_dead(directory: str, pid: int) -> None:
+    """
+    Drop the gauges of a process that exited. Its counters and histograms
+    stay in the totals, which would otherwise go backwards.
+    """
+    path = _snapshot_path(directory, pid)
+    try:
+        with open(path) as file:
+            snapshot = json.load(file)
+    except (OSError, ValueError):
+        return
+    snapshot['collected'] = []
+    _write_json(path, snapshot)
+
+class MetricsRegistry:
+    """
+    Process-wide metrics rendered in the Prometheus text format. Collectors
+    are callables returning (name, description, type, [(labels, value)]) tuples,
+    evaluated on every scrape for values that already live elsewhere.
+
+    Pre-forked workers each have their own registry, and a scrape reaches
+    only one of them. With share() every process writes its values to a
+    common directory and render() reports the sum of the counters and
+    histograms of every process, plus the collector samples of each live
+    process with a `worker` label (its pid).
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], List[Family]]] = []
+        self._lock = threading.Lock()
+        self.shared_dir: Optional[str] = None
+
+    def counter(self, name: str, description: str, labels: Tuple[str, ...] = ()) -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, description, labels, buckets))
+
+    def register_collector(self, collector: Callable) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _collect(self) -> List[Family]:
+        with self._lock:
+            collectors = list(self._collectors)
+        return [family for collector in collectors for family in collector()]
+
+    def share(self, directory: str, interval: float) -> None:
+        """Write this process's values to directory now and every interval seconds, see the class docstring"""
+        os.makedirs(directory, exist_ok=True)
+        self.shared_dir = directory
+        self.write_snapshot()
+
+        def run() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_snapshot()
+                except Exception as e:
+                    logger.warning(f"Metrics snapshot not written: {e}")
+
+        threading.Thread(target=run, name='metrics-snapshot', daemon=True).start()
+
+    def write_snapshot(self) -> None:
+        """Write the current values of this process to the shared directory"""
+        if self.shared_dir is None:
+            return
+        with self._lock:
+            metrics = list(self._metrics.values())
+        _write_json(_snapshot_path(self.shared_dir, os.getpid()), {
+            'metrics': {metric.name: [[list(key), value] for key, value in metric.values().items()] for metric in metrics},
+            'collected': [
+                [name, description, metric_type, [[labels, value] for labels, value in samples]]
+                for name, description, metric_type, samples in self._collect()
+            ]
+        })
+
+    def _render_shared(self) -> str:
+        # This process's own values are always current
+        self.write_snapshot()
+        with self._lock:
+            metrics = dict(self._metrics)
+        merged: Dict[str, Dict[Tuple[str, ...], Any]] = {name: {} for name in metrics}
+        families: Dict[str, Family] = {}
+        for path in sorted(glob.glob(os.path.join(self.shared_dir, SNAPSHOT_PATTERN))):
+            try:
+                with open(path) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Metrics snapshot {path} skipped: {e}")
+                continue
+            worker = os.path.basename(path)[len('metrics-'):-len('.json')]
+            for name, samples in snapshot['metrics'].items():
+                if name in metrics:
+                    for key, value in samples:
+                        metrics[name].merge(merged[name], tuple(key), value)
+            for name, description, metric_type, samples in snapshot['collected']:
+                family = families.setdefault(name, (name, description, metric_type, []))
+                family[3].extend(({**labels, 'worker': worker}, value) for labels, value in samples)
+        lines = []
+        for name, metric in metrics.items():
+            lines.extend(metric.render(merged[name]))
+        for family in families.values():
+            lines.extend(_render_family(*family))
+        return '\n'.join(lines) + '\n'
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        if self.shared_dir is not None:
+            return self._render_shared()
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        for family in self._collect():
+            lines.extend(_render_family(*family))
+        return '\n'.join(lines) + '\n'
+
+# Global metrics registry
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    'cart_stage_duration_seconds', 'Time spent in each stage of request handling', ('stage',)
+)
+db_queries = metrics.counter('cart_db_queries_total', 'SQL statements sent to PostgreSQL')
+redis_reads = metrics.counter('cart_redis_reads_total', 'Redis reads by serving node', ('node',))
+cache_lookups = metrics.counter(
+    'cart_cache_lookups_total', 'Cart cache lookups by operation and result (l1_hit, redis_hit, miss)',
+    ('operation', 'result')
+)
+
+def begin_request() -> RequestMetrics:
+    """Start collecting stage timings for the current request"""
+    request_metrics = RequestMetrics()
+    _current_request.set(request_metrics)
+    return request_metrics
+
+def end_request() -> Optional[RequestMetrics]:
+    """Stop collecting for the current request and return what was collected"""
+    request_metrics = _current_request.get()
+    _current_request.set(None)
+    return request_metrics
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Record time spent in a stage, globally and for the current request"""
+    stage_seconds.observe(seconds, stage=stage)
+    request_metrics = _current_request.get()
+    if request_metrics is not None:
+        request_metrics.add_stage(stage, seconds)
+
+def count_db_round_trip() -> None:
+    db_queries.inc()
+    request_metrics = _current_request.get()
+    if request_metrics is not None:
+        request_metrics.db_round_trips += 1
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the enclosed block as the given stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+def timed(name: str) -> Callable:
+    """Decorator timing every call of a function (or coroutine) as the given stage"""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,10 @@
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.pools import engine_options, register_engine, asyncpg_connect_args, TimedAsyncQueuePool
+from app.config import Config
+
+# asyncio engine for the ASGI app, sharing the models declared in database.py
+async_engine = create_async_engine(
+    Config.SQLALCHEMY_ASYNC_DATABASE_URI, **engine_options(poolclass=TimedAsyncQueuePool, connect_args=asyncpg_connect_args())
+)
+register_engine('postgres-async', async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
\ No newline at end of file
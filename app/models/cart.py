@@ -1,12 +1,26 @@
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Optional, Iterable, ValuesView
 
-@dataclass
-class CartItem:
+@dataclass(frozen=True, slots=True)
+class Product:
     product_id: int
     name: str
     price: float
+    
+    def to_dict(self) -> Dict:
+        return {
+            'product_id': self.product_id,
+            'name': self.name,
+            'price': self.price
+        }
+
+@dataclass(slots=True)
+class CartItem:
+    product_id: int
     quantity: int
+    # Joined from the catalog, never stored with the cart
+    name: Optional[str] = None
+    price: Optional[float] = None
     
     def to_dict(self) -> Dict:
         return {
@@ -15,39 +29,119 @@ class CartItem:
             'price': self.price,
             'quantity': self.quantity
         }
+    
+    def to_record(self) -> Dict:
+        """What is stored for the item: the product reference and the quantity"""
+        return {
+            'product_id': self.product_id,
+            'quantity': self.quantity
+        }
 
-@dataclass
 class Cart:
-    user_id: str
-    items: List[CartItem]
+    """
+    Cart lines indexed by product_id (in insertion order), with a running
+    total and item count, so adding, updating or removing a line does not
+    depend on the size of the cart. version is the version of the last saved
+    change (0 for a cart that was never saved).
+    """
+    __slots__ = ('user_id', 'version', '_lines', '_total', '_item_count', '_sorted_ids')
+    
+    def __init__(self, user_id: str, items: Iterable[CartItem] = (), version: int = 0):
+        self.user_id = user_id
+        self.version = version
+        self._lines: Dict[int, CartItem] = {}
+        self._total = 0.0
+        self._item_count = 0
+        # Product ids in order for paging, rebuilt only after lines come or go
+        self._sorted_ids: Optional[List[int]] = None
+        for item in items:
+            self.add_item(item)
+    
+    @staticmethod
+    def _subtotal(item: CartItem) -> float:
+        return item.price * item.quantity if item.price is not None else 0.0
+    
+    def _adjust(self, total: float, quantity: int) -> None:
+        self._total += total
+        self._item_count += quantity
+        if not self._lines:
+            # Do not carry rounding residue into an empty cart
+            self._total = 0.0
+    
+    @property
+    def items(self) -> ValuesView[CartItem]:
+        return self._lines.values()
     
     @property
     def total(self) -> float:
-        return sum(item.price * item.quantity for item in self.items)
-    
-    def add_item(self, item: CartItem) -> None:
-        # Buscar si el producto ya existe
-        for existing_item in self.items:
-            if existing_item.product_id == item.product_id:
-                existing_item.quantity += item.quantity
-                return
-        self.items.append(item)
-    
-    def remove_item(self, product_id: int) -> bool:
-        initial_length = len(self.items)
-        self.items = [item for item in self.items if item.product_id != product_id]
-        return len(self.items) < initial_length
-    
-    def update_quantity(self, product_id: int, quantity: int) -> bool:
-        for item in self.items:
-            if item.product_id == product_id:
-                item.quantity = quantity
-                return True
-        return False
+        return self._total
+    
+    @property
+    def item_count(self) -> int:
+        """Sum of the quantities of every line"""
+        return self._item_count
+    
+    @property
+    def line_count(self) -> int:
+        return len(self._lines)
+    
+    def get_item(self, product_id: int) -> Optional[CartItem]:
+        return self._lines.get(product_id)
+    
+    def add_item(self, item: CartItem) -> CartItem:
+        """Add a line or merge it into the existing one, returns the resulting line"""
+        existing_item = self._lines.get(item.product_id)
+        if existing_item is None:
+            self._lines[item.product_id] = item
+            self._sorted_ids = None
+            self._adjust(self._subtotal(item), item.quantity)
+            return item
+        previous = self._subtotal(existing_item)
+        existing_item.quantity += item.quantity
+        self._adjust(self._subtotal(existing_item) - previous, item.quantity)
+        return existing_item
+    
+    def remove_item(self, product_id: int) -> Optional[CartItem]:
+        """Remove a line, returns it (None if the product was not in the cart)"""
+        item = self._lines.pop(product_id, None)
+        if item is not None:
+            self._sorted_ids = None
+            self._adjust(-self._subtotal(item), -item.quantity)
+        return item
+    
+    def update_quantity(self, product_id: int, quantity: int) -> Optional[CartItem]:
+        """Set the quantity of a line, returns it (None if the product was not in the cart)"""
+        item = self._lines.get(product_id)
+        if item is None:
+            return None
+        previous, previous_quantity = self._subtotal(item), item.quantity
+        item.quantity = quantity
+        self._adjust(self._subtotal(item) - previous, quantity - previous_quantity)
+        return item
+    
+    def page(self, offset: int, limit: int) -> List[CartItem]:
+        """Lines ordered by product_id, from offset, at most limit of them"""
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self._lines)
+        return [self._lines[product_id] for product_id in self._sorted_ids[offset:offset + limit]]
     
     def to_dict(self) -> Dict:
         return {
             'user_id': self.user_id,
             'items': [item.to_dict() for item in self.items],
-            'total': self.total
+            'total': self.total,
+            'version': self.version
+        }
+    
+    def page_to_dict(self, offset: int, limit: int) -> Dict:
+        """One page of lines plus the totals of the whole cart"""
+        return {
+            'user_id': self.user_id,
+            'items': [item.to_dict() for item in self.page(offset, limit)],
+            'offset': offset,
+            'limit': limit,
+            'line_count': self.line_count,
+            'item_count': self.item_count,
+            'total': self.total,
+            'version': self.version
         }
@@ -1,16 +1,41 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
 from datetime import datetime, timezone
+from typing import List
+from app.metrics import count_db_round_trip, observe_stage
+import time
 
 db = SQLAlchemy()
 
+# Catalog versions, assigned to every product change in commit order
+CATALOG_VERSION_SEQ = db.Sequence('catalog_version_seq')
+# Cart versions, assigned to every cart change; global, so a version is never
+# reused even after a cart is deleted and created again
+CART_VERSION_SEQ = db.Sequence('cart_version_seq')
+
+class DBProduct(db.Model):
+    __tablename__ = 'products'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    # Catalog version of the last change, read by the incremental snapshot refresh
+    version = db.Column(db.BigInteger, CATALOG_VERSION_SEQ, server_default=CATALOG_VERSION_SEQ.next_value(),
+                        nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
 class DBCartItem(db.Model):
     __tablename__ = 'cart_items'
+    __table_args__ = (
+        db.UniqueConstraint('cart_id', 'product_id', name='uq_cart_items_cart_id_product_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cart_id = db.Column(db.Integer, db.ForeignKey('carts.id'), nullable=False)
-    product_id = db.Column(db.Integer, nullable=False)
-    name = db.Column(db.String(100), nullable=False)
-    price = db.Column(db.Float, nullable=False)
+    # Name and price live in the catalog, items only reference the product
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
@@ -19,7 +44,148 @@ class DBCart(db.Model):
     __tablename__ = 'carts'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String(100), nullable=False)
+    user_id = db.Column(db.String(100), nullable=False, unique=True, index=True)
     items = db.relationship('DBCartItem', backref='cart', lazy=True, cascade='all, delete-orphan')
+    # Version of the last change, for conditional requests and optimistic concurrency
+    version = db.Column(db.BigInteger, CART_VERSION_SEQ, server_default=CART_VERSION_SEQ.next_value(),
+                        nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
\ No newline at end of file
+    # Indexed for the cache warmer (newest first) and the archiver (oldest first)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc),
+                           index=True)
+
+class DBCartArchive(db.Model):
+    """
+    Abandoned carts moved out of carts and cart_items by the archiver, one
+    row per cart with its items as [[product_id, quantity], ...]. Range
+    partitioned by month of archived_at, so old archives are purged by
+    dropping a partition (the archiver creates and drops them).
+    """
+    __tablename__ = 'cart_archive'
+    __table_args__ = {'postgresql_partition_by': 'RANGE (archived_at)'}
+    
+    # The partition key has to be part of the primary key
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    archived_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.String(100), nullable=False, index=True)
+    version = db.Column(db.BigInteger, nullable=False)
+    items = db.Column(JSONB, nullable=False)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+
+class SchemaMigrationRequiredError(RuntimeError):
+    """The database was created by an older version and has to be migrated first"""
+
+# Schema changes for tables created by older versions (db.create_all does
+# not alter existing tables). They rewrite data, so they only run through
+# scripts/migrate_schema.py, in a single transaction, never on startup.
+MIGRATION_STATEMENTS = [
+    # Older versions did not prevent duplicate carts or cart lines, which
+    # the unique indexes below reject. A user's carts are merged into the
+    # most recently updated one, and then the most recently updated line of
+    # each product wins.
+    """
+    CREATE TEMP TABLE cart_merges ON COMMIT DROP AS
+    SELECT id, keep_id FROM (
+        SELECT id, first_value(id) OVER (
+            PARTITION BY user_id ORDER BY updated_at DESC NULLS LAST, id DESC
+        ) AS keep_id FROM carts
+    ) ranked WHERE id <> keep_id
+    """,
+    'UPDATE cart_items SET cart_id = cart_merges.keep_id FROM cart_merges WHERE cart_items.cart_id = cart_merges.id',
+    'DELETE FROM carts USING cart_merges WHERE carts.id = cart_merges.id',
+    """
+    DELETE FROM cart_items WHERE id IN (
+        SELECT id FROM (
+            SELECT id, row_number() OVER (
+                PARTITION BY cart_id, product_id ORDER BY updated_at DESC NULLS LAST, id DESC
+            ) AS line FROM cart_items
+        ) ranked WHERE line > 1
+    )
+    """,
+    # Unique indexes used by the upserts
+    'CREATE UNIQUE INDEX IF NOT EXISTS ix_carts_user_id ON carts (user_id)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_items_cart_id_product_id ON cart_items (cart_id, product_id)',
+    'CREATE INDEX IF NOT EXISTS ix_carts_updated_at ON carts (updated_at)',
+    # Versioned carts: existing rows take a version each
+    'CREATE SEQUENCE IF NOT EXISTS cart_version_seq',
+    "ALTER TABLE carts ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('cart_version_seq')",
+    # Move the name and price copied into every cart item to the products table
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_name = 'cart_items' AND column_name = 'name') THEN
+            INSERT INTO products (id, name, price, updated_at)
+            SELECT DISTINCT ON (product_id) product_id, name, price, now() FROM cart_items
+            ORDER BY product_id, updated_at DESC
+            ON CONFLICT (id) DO NOTHING;
+            ALTER TABLE cart_items DROP COLUMN name, DROP COLUMN price;
+        END IF;
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'cart_items_product_id_fkey') THEN
+            ALTER TABLE cart_items ADD CONSTRAINT cart_items_product_id_fkey
+                FOREIGN KEY (product_id) REFERENCES products (id);
+        END IF;
+    END $$
+    """
+]
+
+# What MIGRATION_STATEMENTS leave in place: description -> query that is true once done
+SCHEMA_CHECKS = {
+    'unique index ix_carts_user_id': "SELECT to_regclass('ix_carts_user_id') IS NOT NULL",
+    'unique index uq_cart_items_cart_id_product_id': "SELECT to_regclass('uq_cart_items_cart_id_product_id') IS NOT NULL",
+    'index ix_carts_updated_at': "SELECT to_regclass('ix_carts_updated_at') IS NOT NULL",
+    'column carts.version': (
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'carts' AND column_name = 'version')"
+    ),
+    'cart_items without name/price (moved to products)': (
+        "SELECT NOT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'cart_items' AND column_name = 'name')"
+    ),
+    'foreign key cart_items_product_id_fkey': (
+        "SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'cart_items_product_id_fkey')"
+    )
+}
+
+def pending_migrations(connection) -> List[str]:
+    """Schema changes still missing in the database (read only)"""
+    return [name for name, query in SCHEMA_CHECKS.items() if not connection.execute(text(query)).scalar()]
+
+def check_schema(connection) -> None:
+    """Refuse to start on a database that scripts/migrate_schema.py has not migrated yet"""
+    pending = pending_migrations(connection)
+    if pending:
+        raise SchemaMigrationRequiredError(
+            f"Database schema is out of date (missing: {', '.join(pending)}). "
+            f"Run `python -m scripts.migrate_schema` before starting the app."
+        )
+
+def migrate_schema() -> List[str]:
+    """Apply MIGRATION_STATEMENTS in one transaction, returns what was missing before"""
+    pending = pending_migrations(db.session.connection())
+    try:
+        # A migration may take longer than a request may
+        db.session.execute(text('SET LOCAL statement_timeout = 0'))
+        for statement in MIGRATION_STATEMENTS:
+            db.session.execute(text(statement))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return pending
+
+# Count and time every statement sent by any engine (sync or asyncio) for /metrics
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    observe_stage('db_query', time.perf_counter() - conn.info['query_start'].pop())
+    count_db_round_trip()
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get('query_start'):
+        context.connection.info['query_start'].pop()
@@ -0,0 +1,207 @@
+import time
+import redis
+import redis.asyncio as aioredis
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from typing import Dict, List, Any
+from app.circuit_breaker import circuit_breaker, check_budget
+from app.metrics import metrics
+from app.config import Config
+
+pool_wait_seconds = metrics.histogram(
+    'connection_pool_wait_seconds', 'Time to get a connection from a pool (including connecting)', ('pool',),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+pool_exhausted = metrics.counter(
+    'connection_pool_exhausted_total', 'Checkouts that failed because every connection was in use', ('pool',)
+)
+
+# Every pool created by the app, reported by pool_stats()
+_redis_pools: List[Any] = []
+_engines: Dict[str, Any] = {}
+
+class RedisPoolStats:
+    """Saturation of a redis-py connection pool (sync or asyncio)"""
+    pool_name = 'redis'
+
+    def in_use(self) -> int:
+        if hasattr(self, '_in_use_connections'):
+            return len(self._in_use_connections)
+        # Sync BlockingConnectionPool: created connections minus the idle ones in the queue
+        return len(self._connections) - sum(1 for connection in list(self.pool.queue) if connection is not None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        in_use = self.in_use()
+        return {
+            'pool': self.pool_name,
+            'in_use': in_use,
+            'max': self.max_connections,
+            'saturation': round(in_use / self.max_connections, 3) if self.max_connections else 0.0
+        }
+
+    def _record_failure(self) -> None:
+        if self.in_use() >= self.max_connections:
+            pool_exhausted.inc(pool=self.pool_name)
+
+class TimedRedisPool(RedisPoolStats):
+    def get_connection(self, command_name, *keys, **options):
+        started = time.perf_counter()
+        try:
+            return super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError:
+            self._record_failure()
+            raise
+        finally:
+            pool_wait_seconds.observe(time.perf_counter() - started, pool=self.pool_name)
+
+class TimedAsyncRedisPool(RedisPoolStats):
+    async def get_connection(self, command_name, *keys, **options):
+        started = time.perf_counter()
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError:
+            self._record_failure()
+            raise
+        finally:
+            pool_wait_seconds.observe(time.perf_counter() - started, pool=self.pool_name)
+
+class TimedConnectionPool(TimedRedisPool, redis.ConnectionPool):
+    pass
+
+class TimedBlockingConnectionPool(TimedRedisPool, redis.BlockingConnectionPool):
+    pass
+
+class TimedAsyncConnectionPool(TimedAsyncRedisPool, aioredis.ConnectionPool):
+    pass
+
+class TimedAsyncBlockingConnectionPool(TimedAsyncRedisPool, aioredis.BlockingConnectionPool):
+    pass
+
+def _redis_pool_kwargs(host: str, port: int) -> Dict[str, Any]:
+    return {
+        'host': host,
+        'port': port,
+        'decode_responses': True,
+        'max_connections': Config.REDIS_POOL_MAX_CONNECTIONS,
+        'socket_timeout': Config.REDIS_SOCKET_TIMEOUT,
+        'socket_connect_timeout': Config.REDIS_SOCKET_CONNECT_TIMEOUT,
+        'socket_keepalive': Config.REDIS_SOCKET_KEEPALIVE,
+        'health_check_interval': Config.REDIS_HEALTH_CHECK_INTERVAL
+    }
+
+def redis_pool(host: str, port: int) -> redis.ConnectionPool:
+    """
+    Connection pool for a Redis node, sized and timed by the REDIS_POOL_*
+    and REDIS_SOCKET_* settings. With REDIS_POOL_BLOCKING a full pool makes
+    callers wait up to REDIS_POOL_TIMEOUT seconds instead of failing.
+    """
+    if Config.REDIS_POOL_BLOCKING:
+        pool = TimedBlockingConnectionPool(timeout=Config.REDIS_POOL_TIMEOUT, **_redis_pool_kwargs(host, port))
+    else:
+        pool = TimedConnectionPool(**_redis_pool_kwargs(host, port))
+    pool.pool_name = f"redis:{host}:{port}"
+    _redis_pools.append(pool)
+    return pool
+
+def async_redis_pool(host: str, port: int) -> aioredis.ConnectionPool:
+    """redis.asyncio counterpart of redis_pool"""
+    if Config.REDIS_POOL_BLOCKING:
+        pool = TimedAsyncBlockingConnectionPool(timeout=Config.REDIS_POOL_TIMEOUT, **_redis_pool_kwargs(host, port))
+    else:
+        pool = TimedAsyncConnectionPool(**_redis_pool_kwargs(host, port))
+    pool.pool_name = f"redis-async:{host}:{port}"
+    _redis_pools.append(pool)
+    return pool
+
+# Shared by the sync and asyncio engines: both talk to the same server
+postgres_breaker = circuit_breaker('postgres')
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records checkout wait times and timeouts, and checks out
+    through the PostgreSQL circuit breaker and the request's latency budget
+    """
+    pool_name = 'postgres'
+
+    def connect(self):
+        check_budget('postgres')
+        postgres_breaker.before_call()
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            pool_exhausted.inc(pool=self.pool_name)
+            postgres_breaker.record_failure()
+            raise
+        except Exception:
+            postgres_breaker.record_failure()
+            raise
+        finally:
+            pool_wait_seconds.observe(time.perf_counter() - started, pool=self.pool_name)
+        postgres_breaker.record_success()
+        return connection
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    pool_name = 'postgres-async'
+
+def psycopg2_connect_args() -> Dict[str, Any]:
+    """libpq settings: connect and statement timeouts, TCP keepalive"""
+    args: Dict[str, Any] = {'connect_timeout': Config.DB_CONNECT_TIMEOUT}
+    if Config.DB_STATEMENT_TIMEOUT_MS:
+        args['options'] = f"-c statement_timeout={Config.DB_STATEMENT_TIMEOUT_MS}"
+    if Config.DB_KEEPALIVES_IDLE:
+        args.update(keepalives=1, keepalives_idle=Config.DB_KEEPALIVES_IDLE)
+    return args
+
+def asyncpg_connect_args() -> Dict[str, Any]:
+    """asyncpg counterpart of psycopg2_connect_args (keepalive is left to the system)"""
+    args: Dict[str, Any] = {'timeout': Config.DB_CONNECT_TIMEOUT}
+    if Config.DB_STATEMENT_TIMEOUT_MS:
+        args['server_settings'] = {'statement_timeout': str(Config.DB_STATEMENT_TIMEOUT_MS)}
+    return args
+
+def engine_options(**overrides: Any) -> Dict[str, Any]:
+    """SQLAlchemy engine options from the DB_POOL_* settings"""
+    options = {
+        'pool_size': Config.DB_POOL_SIZE,
+        'max_overflow': Config.DB_MAX_OVERFLOW,
+        'pool_timeout': Config.DB_POOL_TIMEOUT,
+        'pool_recycle': Config.DB_POOL_RECYCLE,
+        'pool_pre_ping': Config.DB_POOL_PRE_PING,
+        'poolclass': TimedQueuePool
+    }
+    options.update(overrides)
+    return options
+
+def _check_statement_budget(conn, cursor, statement, parameters, context, executemany) -> None:
+    check_budget('postgres')
+
+def _record_db_error(context) -> None:
+    # Timeouts and lost connections count against the breaker, SQL errors do not
+    if context.is_disconnect or isinstance(context.sqlalchemy_exception, exc.OperationalError):
+        postgres_breaker.record_failure()
+
+def register_engine(name: str, engine) -> None:
+    """
+    Report the pool of an engine in pool_stats() (read on every call, it
+    changes on dispose) and hold its statements to the latency budget and
+    its failures to the breaker
+    """
+    _engines[name] = engine
+    if not event.contains(engine, 'before_cursor_execute', _check_statement_budget):
+        event.listen(engine, 'before_cursor_execute', _check_statement_budget)
+        event.listen(engine, 'handle_error', _record_db_error)
+
+def pool_stats() -> List[Dict[str, Any]]:
+    """Connections in use and limit of every Redis and PostgreSQL pool of this process"""
+    stats = [pool.get_stats() for pool in _redis_pools]
+    for name, engine in _engines.items():
+        pool = engine.pool
+        limit = pool.size() + max(pool._max_overflow, 0)
+        stats.append({
+            'pool': name,
+            'in_use': pool.checkedout(),
+            'max': limit,
+            'saturation': round(pool.checkedout() / limit, 3) if limit else 0.0
+        })
+    return stats
@@ -0,0 +1,119 @@
+from quart import Blueprint, Response, jsonify, request
+from app.services.async_cart_service import AsyncCartService
+from app.services.cart_service import CartOperationError, CartVersionConflictError
+from app.routes.cart_routes import (
+    json_object, parse_operations, parse_item, parse_quantity, if_match_version, with_etag,
+    version_conflict_body
+)
+from app.cache.redis_client import redis_client
+from app.cache.async_redis_client import async_redis_client
+from app.config import Config
+
+async_cart_bp = Blueprint('async_cart', __name__)
+cart_service = AsyncCartService()
+
+SESSION_HEADER = 'X-Cart-Session'
+
+@async_cart_bp.before_request
+async def begin_session():
+    # Read-your-writes: route reads to replicas that caught up with the client's last write
+    redis_client.begin_session(request.headers.get(SESSION_HEADER))
+
+@async_cart_bp.after_request
+async def end_session(response):
+    token = await async_redis_client.end_session()
+    if token is not None:
+        response.headers[SESSION_HEADER] = token
+    return response
+
+@async_cart_bp.errorhandler(CartVersionConflictError)
+async def version_conflict(error):
+    body, status = version_conflict_body(error, request.headers.get('If-Match'))
+    return jsonify(body), status
+
+def not_modified(etag: str) -> Response:
+    return with_etag(Response('', status=304), etag)
+
+@async_cart_bp.route('/<user_id>', methods=['GET'])
+async def get_cart(user_id):
+    # Conditional GET: a cached version matching If-None-Match answers 304
+    if request.if_none_match:
+        etag = await cart_service.get_cart_etag(user_id)
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+    # Cache hits return the cached body as is, without building a Cart
+    etag, body = await cart_service.get_cart_body(user_id)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    return with_etag(Response(body, mimetype='application/json'), etag)
+
+@async_cart_bp.route('/<user_id>', methods=['PATCH'])
+async def patch_cart(user_id):
+    """Apply a list of add/update/remove operations atomically"""
+    operations = parse_operations(await request.get_json(silent=True))
+    if operations is None:
+        return jsonify({'message': 'Se requiere una lista operations de add/update/remove válidas'}), 400
+    if len(operations) > Config.CART_PATCH_MAX_OPERATIONS:
+        return jsonify({'message': f'Máximo {Config.CART_PATCH_MAX_OPERATIONS} operaciones por solicitud'}), 400
+    try:
+        cart = await cart_service.apply_operations(
+            user_id, operations, if_match_version(request.headers.get('If-Match'))
+        )
+    except CartOperationError as e:
+        return jsonify({'message': e.message, 'operation': e.index}), 404
+    return with_etag(jsonify({'message': 'Carrito actualizado', 'cart': cart.to_dict()}), cart_service.etag(cart.version))
+
+@async_cart_bp.route('/<user_id>/items', methods=['GET'])
+async def get_cart_items(user_id):
+    """Return one page of the cart lines, ordered by product_id"""
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', Config.CART_ITEMS_PAGE_SIZE, type=int)
+    if offset < 0 or limit < 1:
+        return jsonify({'message': 'Parámetros offset/limit inválidos'}), 400
+    limit = min(limit, Config.CART_ITEMS_MAX_PAGE_SIZE)
+    return jsonify(await cart_service.get_cart_page(user_id, offset, limit))
+
+@async_cart_bp.route('/batch', methods=['POST'])
+async def get_carts():
+    user_ids = json_object(await request.get_json(silent=True)).get('user_ids')
+    if not isinstance(user_ids, list) or not all(isinstance(user_id, str) for user_id in user_ids):
+        return jsonify({'message': 'Se requiere una lista user_ids'}), 400
+    if len(user_ids) > Config.CART_BATCH_MAX_USERS:
+        return jsonify({'message': f'Máximo {Config.CART_BATCH_MAX_USERS} usuarios por solicitud'}), 400
+    bodies = await cart_service.get_cart_bodies(user_ids)
+    return Response('{"carts":[' + ','.join(bodies.values()) + ']}', mimetype='application/json')
+
+@async_cart_bp.route('/<user_id>/add', methods=['POST'])
+async def add_to_cart(user_id):
+    item_data = parse_item(await request.get_json(silent=True))
+    if item_data is None:
+        return jsonify({'message': 'Se requieren product_id y quantity (entero positivo)'}), 400
+    # Name and price come from the catalog, not from the client
+    cart = await cart_service.add_item(user_id, item_data, if_match_version(request.headers.get('If-Match')))
+    if cart is None:
+        return jsonify({'message': 'Producto no encontrado'}), 404
+    return with_etag(jsonify({'message': 'Item agregado', 'cart': cart.to_dict()}), cart_service.etag(cart.version))
+
+@async_cart_bp.route('/<user_id>/remove/<int:product_id>', methods=['POST'])
+async def remove_from_cart(user_id, product_id):
+    cart = await cart_service.remove_item(user_id, product_id, if_match_version(request.headers.get('If-Match')))
+    return with_etag(jsonify({'message': 'Item eliminado', 'cart': cart.to_dict()}), cart_service.etag(cart.version))
+
+@async_cart_bp.route('/<user_id>/update/<int:product_id>', methods=['PUT'])
+async def update_quantity(user_id, product_id):
+    quantity = parse_quantity(await request.get_json(silent=True))
+    if quantity is None:
+        return jsonify({'message': 'Se requiere quantity (entero positivo)'}), 400
+    cart = await cart_service.update_quantity(
+        user_id, product_id, quantity, if_match_version(request.headers.get('If-Match'))
+    )
+    if cart:
+        return with_etag(
+            jsonify({'message': 'Cantidad actualizada', 'cart': cart.to_dict()}), cart_service.etag(cart.version)
+        )
+    return jsonify({'message': 'Producto no encontrado'}), 404
+
+@async_cart_bp.route('/<user_id>/clear', methods=['POST'])
+async def clear_cart(user_id):
+    version = await cart_service.clear_cart(user_id, if_match_version(request.headers.get('If-Match')))
+    return with_etag(jsonify({'message': 'Carrito limpiado', 'version': version}), cart_service.etag(version))
\ No newline at end of file
@@ -0,0 +1,30 @@
+from quart import Blueprint, jsonify, request
+from app.routes.catalog_routes import parse_product
+from app.services.async_catalog_service import async_catalog
+
+async_catalog_bp = Blueprint('async_catalog', __name__)
+
+@async_catalog_bp.route('/products', methods=['GET'])
+async def list_products():
+    """Return every product of the catalog snapshot"""
+    products = await async_catalog.list_products()
+    return jsonify({
+        'version': async_catalog.snapshot.version,
+        'products': [product.to_dict() for product in products]
+    })
+
+@async_catalog_bp.route('/products/<int:product_id>', methods=['GET'])
+async def get_product(product_id):
+    product = await async_catalog.get_product(product_id)
+    if product is None:
+        return jsonify({'message': 'Producto no encontrado'}), 404
+    return jsonify(product.to_dict())
+
+@async_catalog_bp.route('/products/<int:product_id>', methods=['PUT'])
+async def save_product(product_id):
+    """Create or update a product; carts show the new name and price on their next read"""
+    product = parse_product(product_id, await request.get_json(silent=True))
+    if product is None:
+        return jsonify({'message': 'Se requieren name y price (número no negativo)'}), 400
+    version = await async_catalog.save_products([product])
+    return jsonify({'message': 'Producto guardado', 'product': product.to_dict(), 'version': version})
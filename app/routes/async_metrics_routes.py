@@ -0,0 +1,31 @@
+from quart import Blueprint, Response, request
+from app.metrics import metrics, begin_request, end_request
+from app.routes.metrics_routes import SERVER_TIMING_HEADER, request_seconds, request_db_round_trips
+from app.config import Config
+import time
+
+async_metrics_bp = Blueprint('async_metrics', __name__)
+
+@async_metrics_bp.before_app_request
+async def start_request_metrics():
+    begin_request()
+
+@async_metrics_bp.after_app_request
+async def record_request_metrics(response):
+    request_metrics = end_request()
+    if request_metrics is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_seconds.observe(
+        time.perf_counter() - request_metrics.start,
+        endpoint=endpoint, method=request.method, status=response.status_code
+    )
+    request_db_round_trips.observe(request_metrics.db_round_trips, endpoint=endpoint)
+    if Config.SERVER_TIMING_ENABLED and request.headers.get(SERVER_TIMING_HEADER) is not None:
+        response.headers['Server-Timing'] = request_metrics.server_timing()
+    return response
+
+@async_metrics_bp.route('/metrics', methods=['GET'])
+async def get_metrics():
+    """Return every metric in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -1,34 +1,175 @@
-from flask import Blueprint, jsonify, request
-from app.services.cart_service import CartService
+from flask import Blueprint, Response, jsonify, request
+from app.services.cart_service import CartService, CartOperationError, CartVersionConflictError, etag_version
+from app.cache.redis_client import redis_client
+from app.config import Config
+from typing import Optional, Dict, List, Any, Tuple
 
 cart_bp = Blueprint('cart', __name__)
 cart_service = CartService()
 
+SESSION_HEADER = 'X-Cart-Session'
+CART_OPERATIONS = ('add', 'update', 'remove')
+
+def json_object(data) -> Dict[str, Any]:
+    """Request body if it is a JSON object, an empty one otherwise (arrays, scalars, no body)"""
+    return data if isinstance(data, dict) else {}
+
+def is_integer(value: Any, minimum: Optional[int] = None) -> bool:
+    """True for a JSON integer (true/false are not), at least minimum if given"""
+    return isinstance(value, int) and not isinstance(value, bool) and (minimum is None or value >= minimum)
+
+def parse_operations(data) -> Optional[List[Dict[str, Any]]]:
+    """Operations of a PATCH body, None if any of them is malformed"""
+    operations = json_object(data).get('operations')
+    if not isinstance(operations, list) or not operations:
+        return None
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS \
+                or not is_integer(operation.get('product_id')):
+            return None
+        if operation['op'] != 'remove' and not is_integer(operation.get('quantity'), 1):
+            return None
+    return operations
+
+def parse_item(data) -> Optional[Dict[str, Any]]:
+    """Item of an add body, None if product_id or quantity are invalid"""
+    item_data = json_object(data)
+    if not is_integer(item_data.get('product_id')) or not is_integer(item_data.get('quantity'), 1):
+        return None
+    return item_data
+
+def parse_quantity(data) -> Optional[int]:
+    """Quantity of an update body, None if it is missing or not a positive integer"""
+    quantity = json_object(data).get('quantity')
+    return quantity if is_integer(quantity, 1) else None
+
+def if_match_version(header: Optional[str]) -> Optional[int]:
+    """
+    Cart version an If-Match header requires: None without one (or with *),
+    -1 (no version) if its first ETag is not a cart ETag
+    """
+    if not header or header.strip() == '*':
+        return None
+    etag = header.split(',')[0].strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    version = etag_version(etag.strip('"'))
+    return -1 if version is None else version
+
+def with_etag(response, etag: str):
+    # Weak: equal versions give equal carts, not byte-identical bodies
+    response.set_etag(etag, weak=True)
+    return response
+
+def version_conflict_body(error: CartVersionConflictError, if_match: Optional[str]) -> Tuple[Dict[str, Any], int]:
+    """
+    412 when the cart is not at the version named by If-Match, 409 when
+    concurrent writes kept winning until the retries ran out
+    """
+    if if_match_version(if_match) is not None:
+        body = {'message': 'El carrito cambió desde la versión indicada en If-Match'}
+        if error.version is not None:
+            body['version'] = error.version
+        return body, 412
+    return {'message': 'El carrito cambió durante la operación, reintente'}, 409
+
+@cart_bp.before_request
+def begin_session():
+    # Read-your-writes: route reads to replicas that caught up with the client's last write
+    redis_client.begin_session(request.headers.get(SESSION_HEADER))
+
+@cart_bp.after_request
+def end_session(response):
+    token = redis_client.end_session()
+    if token is not None:
+        response.headers[SESSION_HEADER] = token
+    return response
+
+@cart_bp.errorhandler(CartVersionConflictError)
+def version_conflict(error):
+    body, status = version_conflict_body(error, request.headers.get('If-Match'))
+    return jsonify(body), status
+
+def not_modified(etag: str) -> Response:
+    return with_etag(Response(status=304), etag)
+
 @cart_bp.route('/<user_id>', methods=['GET'])
 def get_cart(user_id):
-    cart = cart_service.get_cart(user_id)
-    return jsonify(cart.to_dict())
+    # Conditional GET: a cached version matching If-None-Match answers 304
+    # without reading or joining the cart's items
+    if request.if_none_match:
+        etag = cart_service.get_cart_etag(user_id)
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+    # Cache hits return the cached body as is, without building a Cart
+    etag, body = cart_service.get_cart_body(user_id)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    return with_etag(Response(body, mimetype='application/json'), etag)
+
+@cart_bp.route('/<user_id>', methods=['PATCH'])
+def patch_cart(user_id):
+    """Apply a list of add/update/remove operations atomically"""
+    operations = parse_operations(request.get_json(silent=True))
+    if operations is None:
+        return jsonify({'message': 'Se requiere una lista operations de add/update/remove válidas'}), 400
+    if len(operations) > Config.CART_PATCH_MAX_OPERATIONS:
+        return jsonify({'message': f'Máximo {Config.CART_PATCH_MAX_OPERATIONS} operaciones por solicitud'}), 400
+    try:
+        cart = cart_service.apply_operations(user_id, operations, if_match_version(request.headers.get('If-Match')))
+    except CartOperationError as e:
+        return jsonify({'message': e.message, 'operation': e.index}), 404
+    return with_etag(jsonify({'message': 'Carrito actualizado', 'cart': cart.to_dict()}), cart_service.etag(cart.version))
+
+@cart_bp.route('/<user_id>/items', methods=['GET'])
+def get_cart_items(user_id):
+    """Return one page of the cart lines, ordered by product_id"""
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', Config.CART_ITEMS_PAGE_SIZE, type=int)
+    if offset < 0 or limit < 1:
+        return jsonify({'message': 'Parámetros offset/limit inválidos'}), 400
+    limit = min(limit, Config.CART_ITEMS_MAX_PAGE_SIZE)
+    return jsonify(cart_service.get_cart_page(user_id, offset, limit))
+
+@cart_bp.route('/batch', methods=['POST'])
+def get_carts():
+    user_ids = json_object(request.get_json(silent=True)).get('user_ids')
+    if not isinstance(user_ids, list) or not all(isinstance(user_id, str) for user_id in user_ids):
+        return jsonify({'message': 'Se requiere una lista user_ids'}), 400
+    if len(user_ids) > Config.CART_BATCH_MAX_USERS:
+        return jsonify({'message': f'Máximo {Config.CART_BATCH_MAX_USERS} usuarios por solicitud'}), 400
+    bodies = cart_service.get_cart_bodies(user_ids)
+    return Response('{"carts":[' + ','.join(bodies.values()) + ']}', mimetype='application/json')
 
 @cart_bp.route('/<user_id>/add', methods=['POST'])
 def add_to_cart(user_id):
-    item_data = request.json
-    cart = cart_service.add_item(user_id, item_data)
-    return jsonify({'message': 'Item agregado', 'cart': cart.to_dict()})
+    item_data = parse_item(request.get_json(silent=True))
+    if item_data is None:
+        return jsonify({'message': 'Se requieren product_id y quantity (entero positivo)'}), 400
+    # Name and price come from the catalog, not from the client
+    cart = cart_service.add_item(user_id, item_data, if_match_version(request.headers.get('If-Match')))
+    if cart is None:
+        return jsonify({'message': 'Producto no encontrado'}), 404
+    return with_etag(jsonify({'message': 'Item agregado', 'cart': cart.to_dict()}), cart_service.etag(cart.version))
 
 @cart_bp.route('/<user_id>/remove/<int:product_id>', methods=['POST'])
 def remove_from_cart(user_id, product_id):
-    cart = cart_service.remove_item(user_id, product_id)
-    return jsonify({'message': 'Item eliminado', 'cart': cart.to_dict()})
+    cart = cart_service.remove_item(user_id, product_id, if_match_version(request.headers.get('If-Match')))
+    return with_etag(jsonify({'message': 'Item eliminado', 'cart': cart.to_dict()}), cart_service.etag(cart.version))
 
 @cart_bp.route('/<user_id>/update/<int:product_id>', methods=['PUT'])
 def update_quantity(user_id, product_id):
-    quantity = request.json.get('quantity')
-    cart = cart_service.update_quantity(user_id, product_id, quantity)
+    quantity = parse_quantity(request.get_json(silent=True))
+    if quantity is None:
+        return jsonify({'message': 'Se requiere quantity (entero positivo)'}), 400
+    cart = cart_service.update_quantity(user_id, product_id, quantity, if_match_version(request.headers.get('If-Match')))
     if cart:
-        return jsonify({'message': 'Cantidad actualizada', 'cart': cart.to_dict()})
+        return with_etag(
+            jsonify({'message': 'Cantidad actualizada', 'cart': cart.to_dict()}), cart_service.etag(cart.version)
+        )
     return jsonify({'message': 'Producto no encontrado'}), 404
 
 @cart_bp.route('/<user_id>/clear', methods=['POST'])
 def clear_cart(user_id):
-    cart_service.clear_cart(user_id)
-    return jsonify({'message': 'Carrito limpiado'})
\ No newline at end of file
+    version = cart_service.clear_cart(user_id, if_match_version(request.headers.get('If-Match')))
+    return with_etag(jsonify({'message': 'Carrito limpiado', 'version': version}), cart_service.etag(version))
\ No newline at end of file
@@ -0,0 +1,41 @@
+from flask import Blueprint, jsonify, request
+from app.models.cart import Product
+from app.routes.cart_routes import json_object
+from typing import Optional
+from app.services.catalog_service import catalog
+
+catalog_bp = Blueprint('catalog', __name__)
+
+def parse_product(product_id: int, data) -> Optional[Product]:
+    """Product from a request body, None if name or price are invalid"""
+    data = json_object(data)
+    name = data.get('name')
+    price = data.get('price')
+    if not isinstance(name, str) or not name or isinstance(price, bool) \
+            or not isinstance(price, (int, float)) or price < 0:
+        return None
+    return Product(product_id=product_id, name=name, price=float(price))
+
+@catalog_bp.route('/products', methods=['GET'])
+def list_products():
+    """Return every product of the catalog snapshot"""
+    return jsonify({
+        'version': catalog.snapshot.version,
+        'products': [product.to_dict() for product in catalog.list_products()]
+    })
+
+@catalog_bp.route('/products/<int:product_id>', methods=['GET'])
+def get_product(product_id):
+    product = catalog.get_product(product_id)
+    if product is None:
+        return jsonify({'message': 'Producto no encontrado'}), 404
+    return jsonify(product.to_dict())
+
+@catalog_bp.route('/products/<int:product_id>', methods=['PUT'])
+def save_product(product_id):
+    """Create or update a product; carts show the new name and price on their next read"""
+    product = parse_product(product_id, request.get_json(silent=True))
+    if product is None:
+        return jsonify({'message': 'Se requieren name y price (número no negativo)'}), 400
+    version = catalog.save_products([product])
+    return jsonify({'message': 'Producto guardado', 'product': product.to_dict(), 'version': version})
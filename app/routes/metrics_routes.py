@@ -0,0 +1,137 @@
+from flask import Blueprint, Response, request
+from flask.json.provider import DefaultJSONProvider
+from app.metrics import metrics, cache_lookups, begin_request, end_request, stage
+from app.cache.redis_client import redis_client
+from app.cache.local_cache import local_cache
+from app.services.catalog_service import catalog
+from app.services.product_stats import product_stats
+from app.pools import pool_stats
+from app.circuit_breaker import breaker_stats, STATE_VALUES
+from app.config import Config
+import time
+
+metrics_bp = Blueprint('metrics', __name__)
+
+SERVER_TIMING_HEADER = 'X-Server-Timing'
+
+request_seconds = metrics.histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint, method and status', ('endpoint', 'method', 'status')
+)
+request_db_round_trips = metrics.histogram(
+    'http_request_db_round_trips', 'SQL statements per request by endpoint', ('endpoint',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50)
+)
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that times response serialization (jsonify) as a stage"""
+
+    def dumps(self, obj, **kwargs):
+        with stage('serialize'):
+            return super().dumps(obj, **kwargs)
+
+def collect_cache_ratios():
+    """Hit ratio per operation, derived from the lookup counters"""
+    totals = {}
+    for (operation, result), value in cache_lookups.values().items():
+        hits, lookups = totals.get(operation, (0, 0))
+        totals[operation] = (hits + (value if result != 'miss' else 0), lookups + value)
+    return [(
+        'cart_cache_hit_ratio', 'Share of cart lookups served from L1 or Redis', 'gauge',
+        [({'operation': operation}, hits / lookups if lookups else 0.0) for operation, (hits, lookups) in totals.items()]
+    )]
+
+def collect_local_cache():
+    stats = local_cache.get_stats()
+    return [
+        ('cart_local_cache_entries', 'Entries in the in-process cart cache', 'gauge', [({}, stats['entries'])]),
+        ('cart_local_cache_bytes', 'Estimated size of the in-process cart cache', 'gauge', [({}, stats['bytes'])]),
+        ('cart_local_cache_evictions_total', 'In-process cache evictions', 'counter', [({}, stats['evictions'])])
+    ]
+
+def collect_replicas():
+    replicas = redis_client.get_replica_stats()
+    return [
+        ('redis_replica_available', 'Whether the replica receives reads', 'gauge',
+         [({'replica': r['name']}, 1 if r['available'] else 0) for r in replicas]),
+        ('redis_replica_latency_ms', 'Moving average of the replica read latency', 'gauge',
+         [({'replica': r['name']}, r['latency_ms']) for r in replicas if r['latency_ms'] is not None]),
+        ('redis_replica_lag_bytes', 'Replication lag behind the master', 'gauge',
+         [({'replica': r['name']}, r['lag_bytes']) for r in replicas if r['lag_bytes'] is not None])
+    ]
+
+def collect_catalog():
+    stats = catalog.get_stats()
+    return [
+        ('catalog_snapshot_version', 'Catalog version of the in-process snapshot', 'gauge', [({}, stats['version'])]),
+        ('catalog_snapshot_products', 'Products in the in-process catalog snapshot', 'gauge', [({}, stats['products'])])
+    ]
+
+def collect_product_stats():
+    stats = product_stats.get_stats()
+    return [
+        ('product_stats_pending', 'Products with buffered stats deltas not yet flushed', 'gauge',
+         [({}, stats['pending_products'])]),
+        ('product_stats_flushes_total', 'Product stats flushes by result', 'counter',
+         [({'result': 'ok'}, stats['flushes']), ({'result': 'error'}, stats['failed_flushes'])])
+    ]
+
+def collect_pools():
+    stats = pool_stats()
+    return [
+        ('connection_pool_in_use', 'Connections checked out of the pool', 'gauge',
+         [({'pool': pool['pool']}, pool['in_use']) for pool in stats]),
+        ('connection_pool_max', 'Connection limit of the pool', 'gauge',
+         [({'pool': pool['pool']}, pool['max']) for pool in stats]),
+        ('connection_pool_saturation', 'Share of the pool limit in use', 'gauge',
+         [({'pool': pool['pool']}, pool['saturation']) for pool in stats])
+    ]
+
+def collect_circuit_breakers():
+    deferred = redis_client.get_deferred_stats()
+    return [
+        ('circuit_breaker_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)', 'gauge',
+         [({'breaker': breaker['breaker']}, STATE_VALUES[breaker['state']]) for breaker in breaker_stats()]),
+        ('redis_deferred_commands', 'Cache writes waiting for a Redis shard to come back', 'gauge',
+         [({'shard': shard['shard']}, shard['deferred']) for shard in deferred]),
+        ('redis_deferred_dropped', 'Deferred cache writes dropped because the queue was full', 'gauge',
+         [({'shard': shard['shard']}, shard['dropped']) for shard in deferred])
+    ]
+
+metrics.register_collector(collect_cache_ratios)
+metrics.register_collector(collect_local_cache)
+metrics.register_collector(collect_replicas)
+metrics.register_collector(collect_catalog)
+metrics.register_collector(collect_product_stats)
+metrics.register_collector(collect_pools)
+metrics.register_collector(collect_circuit_breakers)
+
+def endpoint_label() -> str:
+    """Route pattern of the current request, so user ids do not explode the label set"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def wants_server_timing() -> bool:
+    return Config.SERVER_TIMING_ENABLED and request.headers.get(SERVER_TIMING_HEADER) is not None
+
+@metrics_bp.before_app_request
+def start_request_metrics():
+    begin_request()
+
+@metrics_bp.after_app_request
+def record_request_metrics(response):
+    request_metrics = end_request()
+    if request_metrics is None:
+        return response
+    endpoint = endpoint_label()
+    request_seconds.observe(
+        time.perf_counter() - request_metrics.start,
+        endpoint=endpoint, method=request.method, status=response.status_code
+    )
+    request_db_round_trips.observe(request_metrics.db_round_trips, endpoint=endpoint)
+    if wants_server_timing():
+        response.headers['Server-Timing'] = request_metrics.server_timing()
+    return response
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Return every metric in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -1,13 +1,62 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from app.services.cart_service import CartService
+from app.services.product_stats import STATS_WINDOWS
+from app.pools import pool_stats
+from app.circuit_breaker import breaker_stats
+from app.cache.redis_client import redis_client
+from app.config import Config
 
 stats_bp = Blueprint('stats', __name__)
 cart_service = CartService()
 
 @stats_bp.route('/top-products', methods=['GET'])
 def get_top_products():
-    """Return the top 10 most purchased products"""
-    top_products = cart_service.get_top_products(10)
+    """
+    Return the most purchased products, 10 at a time by default, over the
+    last hour, day or week or since the beginning (window=all, the default)
+    """
+    count = request.args.get('count', 10, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    window = request.args.get('window', 'all')
+    if count < 1 or offset < 0:
+        return jsonify({'message': 'Parámetros count/offset inválidos'}), 400
+    if window not in STATS_WINDOWS:
+        return jsonify({'message': 'Parámetro window inválido (hour, day, week o all)'}), 400
+    count = min(count, Config.TOP_PRODUCTS_MAX_COUNT)
+    top_products = cart_service.get_top_products(count, offset, window)
     return jsonify({
-        'top_products': top_products
-    }) 
\ No newline at end of file
+        'top_products': top_products,
+        'count': count,
+        'offset': offset,
+        'window': window
+    })
+
+@stats_bp.route('/local-cache', methods=['GET'])
+def get_local_cache_stats():
+    """Return hit, miss and eviction counters of the in-process cart cache"""
+    return jsonify(cart_service.get_local_cache_stats())
+
+@stats_bp.route('/write-behind', methods=['GET'])
+def get_write_behind_stats():
+    """Return the backlog of cart changes not yet flushed to PostgreSQL"""
+    return jsonify(cart_service.get_write_behind_stats())
+
+@stats_bp.route('/replicas', methods=['GET'])
+def get_replica_stats():
+    """Return health, latency and replication lag of the Redis replicas"""
+    return jsonify({'replicas': cart_service.get_replica_stats()})
+
+@stats_bp.route('/cart-filter', methods=['GET'])
+def get_cart_filter_stats():
+    """Return whether the filter of users with a cart is ready, its size and staleness"""
+    return jsonify(cart_service.get_cart_filter_stats())
+
+@stats_bp.route('/pools', methods=['GET'])
+def get_pool_stats():
+    """Return connections in use and limits of the Redis and PostgreSQL pools of this worker"""
+    return jsonify({'pools': pool_stats()})
+
+@stats_bp.route('/circuit-breakers', methods=['GET'])
+def get_circuit_breaker_stats():
+    """Return the state of the Redis and PostgreSQL circuit breakers and the cache writes waiting for Redis"""
+    return jsonify({'breakers': breaker_stats(), 'redis_deferred': redis_client.get_deferred_stats()})
@@ -0,0 +1,530 @@
+from app.models.cart import Cart, CartItem
+from app.models.database import DBCart
+from app.models.async_database import AsyncSessionLocal
+from app.cache.redis_client import redis_client
+from app.cache.async_redis_client import async_redis_client
+from app.cache.local_cache import local_cache
+from app.metrics import cache_lookups
+from app.services.cart_service import (
+    CartService, CartChange, CartVersionConflictError, EMPTY_CART_FIELD, VERSION_FIELD, cart_etag,
+    cart_write_conflicts
+)
+from app.services.async_catalog_service import async_catalog
+from app.cache.codec import cart_body
+from app.config import Config
+from sqlalchemy import select, text
+from sqlalchemy.orm import joinedload, selectinload
+from datetime import datetime, timezone
+from typing import Optional, Dict, List, Any, Tuple, Callable
+import asyncio
+import logging
+import redis
+import time
+
+logger = logging.getLogger(__name__)
+
+class AsyncCartService(CartService):
+    """
+    asyncio version of CartService for the ASGI app. It keeps the same cache
+    layout, keys, SQL statements and rules (inherited from CartService); only
+    the Redis and PostgreSQL calls are awaited instead of blocking. The
+    catalog snapshot is brought up to date (awaited) before any join with it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.catalog = async_catalog
+
+    async def _set_cached_cart(self, cart: Cart, delta_ms: Optional[int] = None) -> None:
+        """Write the whole cart to Redis unless it holds a newer version, see CartService._set_cached_cart"""
+        cart_key = self._get_cart_key(cart.user_id)
+        try:
+            written = await async_redis_client.set_versioned_hash(
+                cart_key, self._cache_mapping(cart, delta_ms), cart.version, expiry=self.cache_ttl
+            )
+        except redis.RedisError as e:
+            self._skip_cache_write(cart_key, e)
+            return
+        if written == 1:
+            local_cache.set(cart_key, (cart.version, self._cart_body(cart)))
+
+    async def _publish_cart_change(self, cart: Cart, latest: bool = True) -> None:
+        """Invalidate other workers' L1 copies and store the new local one (unless a newer version is cached)"""
+        cart_key = self._get_cart_key(cart.user_id)
+        await self._publish_invalidation(cart_key)
+        if latest:
+            local_cache.set(cart_key, (cart.version, self._cart_body(cart)))
+
+    async def _publish_invalidation(self, cart_key: str) -> None:
+        local_cache.invalidate(cart_key)
+        if local_cache.enabled:
+            try:
+                await async_redis_client.publish(self.invalidation_channel, local_cache.invalidation_message(cart_key))
+            except redis.RedisError as e:
+                logger.warning(f"Cache invalidation of {cart_key} not published: {e}")
+
+    async def _write_cart_delta(self, cart: Cart, changed: List[CartItem], removed: List[int],
+                                previous_version: Optional[int]) -> None:
+        """Write only the changed product fields of a cached cart, see CartService._write_cart_delta"""
+        cart_key = self._get_cart_key(cart.user_id)
+        try:
+            written = 0
+            if previous_version is not None:
+                written = await async_redis_client.update_versioned_hash(
+                    cart_key,
+                    self._cart_to_hash(changed),
+                    [str(product_id) for product_id in removed] + [EMPTY_CART_FIELD],
+                    previous_version, cart.version, self.cache_ttl
+                )
+            if written != 1:
+                written = await async_redis_client.set_versioned_hash(
+                    cart_key, self._cart_to_hash(cart.items), cart.version, expiry=self.cache_ttl
+                )
+            await self._publish_cart_change(cart, latest=written == 1)
+        except redis.RedisError as e:
+            self._skip_cache_write(cart_key, e)
+
+    async def _might_have_carts(self, user_ids: List[str]) -> List[bool]:
+        """Whether each user may have a cart, see CartFilter.might_have_carts"""
+        if not self.cart_filter.enabled or not user_ids:
+            return [True] * len(user_ids)
+        try:
+            layout, hits = await async_redis_client.check_filter(
+                self.cart_filter.key, self.cart_filter.meta_key,
+                [self.cart_filter.offsets(user_id) for user_id in user_ids]
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Cart filter unavailable: {e}")
+            layout, hits = None, [True] * len(user_ids)
+        return self.cart_filter.answers(layout, hits)
+
+    async def get_cart(self, user_id: str) -> Cart:
+        """Cache-Aside read, see CartService.get_cart"""
+        cached, cart = await self._lookup_cart(user_id, as_body=False)
+        return cart if cart is not None else self._cart_from_body(cached[1])
+
+    async def get_cart_body(self, user_id: str) -> Tuple[str, str]:
+        """ETag and JSON response body of the cart, see CartService.get_cart_body"""
+        catalog_version = (await self.catalog.refresh()).version
+        cached, cart = await self._lookup_cart(user_id)
+        version, body = cached if cached is not None else (cart.version, self._cart_body(cart))
+        return cart_etag(version, catalog_version), body
+
+    async def get_cart_etag(self, user_id: str) -> Optional[str]:
+        """ETag of a cached cart from its version alone, see CartService.get_cart_etag"""
+        catalog_version = (await self.catalog.refresh()).version
+        cart_key = self._get_cart_key(user_id)
+        cached = local_cache.get(cart_key)
+        if cached is not None:
+            cache_lookups.inc(operation='get_cart_etag', result='l1_hit')
+            return cart_etag(cached[0], catalog_version)
+        try:
+            version = await async_redis_client.get_hash_field(cart_key, VERSION_FIELD)
+        except redis.RedisError:
+            version = None
+        cache_lookups.inc(operation='get_cart_etag', result='miss' if version is None else 'redis_hit')
+        return cart_etag(version, catalog_version) if version is not None else None
+
+    async def get_cart_page(self, user_id: str, offset: int, limit: int) -> Dict[str, Any]:
+        """One page of cart lines, see CartService.get_cart_page"""
+        return (await self.get_cart(user_id)).page_to_dict(offset, limit)
+
+    async def _lookup_cart(self, user_id: str,
+                           as_body: bool = True) -> Tuple[Optional[Tuple[int, str]], Optional[Cart]]:
+        """Cache-Aside lookup, see CartService._lookup_cart"""
+        cart_key = self._get_cart_key(user_id)
+        cached = local_cache.get(cart_key)
+        if cached is not None:
+            logger.info(f"Cache HIT for cart: {user_id}")
+            cache_lookups.inc(operation='get_cart', result='l1_hit')
+            return cached, None
+
+        try:
+            return await self._lookup_redis(user_id, as_body)
+        except redis.RedisError as e:
+            logger.warning(f"Cache bypassed for cart {user_id}: {e}")
+            cache_lookups.inc(operation='get_cart', result='bypass')
+            return None, await self._read_cart_from_db(user_id) or Cart(user_id=user_id, items=[])
+
+    async def _lookup_redis(self, user_id: str, as_body: bool) -> Tuple[Optional[Tuple[int, str]], Optional[Cart]]:
+        """Redis part of _lookup_cart, including the single-flight load on a miss"""
+        cart_key = self._get_cart_key(user_id)
+        fields, ttl_ms = await async_redis_client.get_hash_with_ttl(cart_key)
+        if fields:
+            logger.info(f"Cache HIT for cart: {user_id}")
+            cache_lookups.inc(operation='get_cart', result='redis_hit')
+            if self._should_refresh_early(fields, ttl_ms):
+                cart = await self._refresh_cart(user_id)
+                if cart is not None:
+                    return None, cart
+            await self.catalog.ensure_products(self._hash_quantities(fields))
+            return self._from_hash(user_id, fields, as_body)
+
+        logger.info(f"Cache MISS for cart: {user_id}")
+        cache_lookups.inc(operation='get_cart', result='miss')
+        if not (await self._might_have_carts([user_id]))[0]:
+            return None, Cart(user_id=user_id, items=[])
+        return await self._load_cart(user_id, as_body)
+
+    async def _read_cart_from_db(self, user_id: str) -> Optional[Cart]:
+        """Get the cart from the database, None if the user has none"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(DBCart).options(selectinload(DBCart.items)).where(DBCart.user_id == user_id)
+            )
+            db_cart = result.scalar_one_or_none()
+            if not db_cart:
+                return None
+            await self.catalog.ensure_products(item.product_id for item in db_cart.items)
+            return self._cart_from_db(db_cart)
+
+    async def _load_cart_from_db(self, user_id: str) -> Optional[Cart]:
+        """Get the cart from the database and update the cache"""
+        start = time.monotonic()
+        cart = await self._read_cart_from_db(user_id)
+        if cart is None:
+            try:
+                await async_redis_client.fill_hashes(self._empty_cart_mappings([user_id]), self.empty_cart_ttl)
+            except redis.RedisError as e:
+                logger.warning(f"Empty cart of {user_id} not cached: {e}")
+            return None
+        await self._set_cached_cart(cart, delta_ms=int((time.monotonic() - start) * 1000))
+        return cart
+
+    async def _load_cart(self, user_id: str,
+                         as_body: bool = True) -> Tuple[Optional[Tuple[int, str]], Optional[Cart]]:
+        """Single-flight cache miss, see CartService._load_cart"""
+        cart_key = self._get_cart_key(user_id)
+        lock_key = f"{self.lock_prefix}{cart_key}"
+        token = await async_redis_client.acquire_lock(lock_key, self.lock_ttl_ms)
+        if token is None:
+            deadline = time.monotonic() + self.lock_wait_ms / 1000
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.lock_poll_ms / 1000)
+                fields, locked = await async_redis_client.get_hash_and_lock_state(cart_key, lock_key)
+                if fields:
+                    await self.catalog.ensure_products(self._hash_quantities(fields))
+                    return self._from_hash(user_id, fields, as_body)
+                if not locked:
+                    break
+            return None, await self._load_cart_from_db(user_id) or Cart(user_id=user_id, items=[])
+
+        try:
+            return None, await self._load_cart_from_db(user_id) or Cart(user_id=user_id, items=[])
+        finally:
+            await async_redis_client.release_lock(lock_key, token)
+
+    async def _refresh_cart(self, user_id: str) -> Optional[Cart]:
+        """Early refresh of a cached cart, skipped if another worker is already on it"""
+        cart_key = self._get_cart_key(user_id)
+        lock_key = f"{self.lock_prefix}{cart_key}"
+        token = await async_redis_client.acquire_lock(lock_key, self.lock_ttl_ms)
+        if token is None:
+            return None
+        try:
+            logger.info(f"Early refresh for cart: {user_id}")
+            cart = await self._load_cart_from_db(user_id)
+            if cart is None:
+                await async_redis_client.delete_data(cart_key)
+                local_cache.invalidate(cart_key)
+                return Cart(user_id=user_id, items=[])
+            return cart
+        finally:
+            await async_redis_client.release_lock(lock_key, token)
+
+    async def get_carts(self, user_ids: List[str]) -> Dict[str, Cart]:
+        """Batch version of get_cart, see get_cart_bodies"""
+        bodies = await self.get_cart_bodies(user_ids)
+        return {user_id: self._cart_from_body(body) for user_id, body in bodies.items()}
+
+    async def get_cart_bodies(self, user_ids: List[str]) -> Dict[str, str]:
+        """Batch Cache-Aside read, see CartService.get_cart_bodies"""
+        user_ids = list(dict.fromkeys(user_ids))
+        bodies: Dict[str, str] = {}
+
+        pending = []
+        for user_id in user_ids:
+            cached = local_cache.get(self._get_cart_key(user_id))
+            if cached is not None:
+                bodies[user_id] = cached[1]
+            else:
+                pending.append(user_id)
+
+        misses = []
+        try:
+            cached_hashes = await async_redis_client.get_hashes([self._get_cart_key(user_id) for user_id in pending])
+        except redis.RedisError as e:
+            logger.warning(f"Cache bypassed for a batch of {len(pending)} carts: {e}")
+            cached_hashes = [None] * len(pending)
+        await self.catalog.ensure_products(
+            product_id for fields in cached_hashes if fields for product_id in self._hash_quantities(fields)
+        )
+        for user_id, fields in zip(pending, cached_hashes):
+            if fields:
+                bodies[user_id] = self._hash_to_body(user_id, fields)
+                local_cache.set(self._get_cart_key(user_id), (self._hash_version(fields), bodies[user_id]))
+            else:
+                misses.append(user_id)
+
+        logger.info(f"Batch cart read: {len(user_ids) - len(misses)} HIT, {len(misses)} MISS")
+        cache_lookups.inc(len(user_ids) - len(pending), operation='get_carts', result='l1_hit')
+        cache_lookups.inc(len(pending) - len(misses), operation='get_carts', result='redis_hit')
+        cache_lookups.inc(len(misses), operation='get_carts', result='miss')
+        misses = [user_id for user_id, maybe in zip(misses, await self._might_have_carts(misses)) if maybe]
+        if misses:
+            async with AsyncSessionLocal() as session:
+                # Single query for every miss, items eagerly loaded in the same round trip
+                result = await session.execute(
+                    select(DBCart).options(joinedload(DBCart.items)).where(DBCart.user_id.in_(misses))
+                )
+                db_carts = result.unique().scalars().all()
+            await self.catalog.ensure_products(item.product_id for db_cart in db_carts for item in db_cart.items)
+            loaded = [self._cart_from_db(db_cart) for db_cart in db_carts]
+            backfill = {}
+            for cart in loaded:
+                bodies[cart.user_id] = self._cart_body(cart)
+                backfill[self._get_cart_key(cart.user_id)] = (cart.version, self._cart_to_hash(cart.items))
+            try:
+                written = set(await async_redis_client.set_versioned_hashes(backfill, self.cache_ttl))
+                await async_redis_client.fill_hashes(
+                    self._empty_cart_mappings([user_id for user_id in misses if user_id not in bodies]),
+                    self.empty_cart_ttl
+                )
+            except redis.RedisError as e:
+                logger.warning(f"Batch of {len(misses)} carts not cached: {e}")
+            else:
+                for cart in loaded:
+                    cart_key = self._get_cart_key(cart.user_id)
+                    if cart_key in written:
+                        local_cache.set(cart_key, (cart.version, bodies[cart.user_id]))
+
+        return {user_id: bodies.get(user_id) or cart_body(user_id, []) for user_id in user_ids}
+
+    async def save_cart(self, cart: Cart) -> None:
+        """Save cart to both database and cache at a new version"""
+        await self._persist_cart(cart)
+
+    async def _add_to_filter(self, user_id: str) -> None:
+        if not self.cart_filter.enabled:
+            return
+        offsets = self.cart_filter.offsets(user_id)
+        try:
+            await async_redis_client.add_to_filter(self.cart_filter.key, self.cart_filter.rebuild_key, offsets)
+        except redis.RedisError as e:
+            logger.warning(f"Cart filter add of {user_id} deferred: {e}")
+            redis_client.defer_filter_add(self.cart_filter.key, offsets)
+
+    async def _persist_cart(self, cart: Cart, previous_version: Optional[int] = None, was_empty: bool = False,
+                            changed: Optional[List[CartItem]] = None, removed: Optional[List[int]] = None) -> None:
+        """
+        Commit the cart to the database or stage it for the flusher at a new
+        version, after adding it to the cart filter, see CartService._persist_cart
+        """
+        await self._add_to_filter(cart.user_id)
+        if self.write_behind:
+            await self._stage_cart(cart, previous_version, changed or [], removed or [])
+            return
+
+        # asyncpg does not convert aware datetimes for TIMESTAMP WITHOUT TIME ZONE columns
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        async with AsyncSessionLocal() as session, session.begin():
+            if previous_version is None:
+                row = (await session.execute(self._cart_upsert_statement(cart.user_id, now))).one()
+            else:
+                row = (await session.execute(
+                    self._cart_version_update_statement(cart.user_id, previous_version, now)
+                )).first() if previous_version else None
+                if row is None and was_empty:
+                    row = (await session.execute(self._cart_insert_statement(cart.user_id, now))).first()
+                if row is None:
+                    raise CartVersionConflictError(cart.user_id)
+            cart_id, cart.version = row
+            if cart.items:
+                await session.execute(self._items_upsert_statement(cart_id, cart.items, now))
+            await session.execute(self._items_prune_statement(cart_id, cart.items))
+        await self._write_cart_delta(cart, changed or [], removed or [], previous_version)
+
+    async def _stage_cart(self, cart: Cart, previous_version: Optional[int], changed: List[CartItem],
+                          removed: List[int]) -> None:
+        """Write-behind part of _persist_cart, see CartService._stage_cart"""
+        cart_key = self._get_cart_key(cart.user_id)
+        cart.version = await async_redis_client.next_version(self.version_key)
+        written = 0
+        if previous_version is not None:
+            written = await async_redis_client.update_versioned_hash(
+                cart_key,
+                self._cart_to_hash(changed),
+                [str(product_id) for product_id in removed] + [EMPTY_CART_FIELD],
+                previous_version, cart.version, self.cache_ttl
+            )
+        if written == 0:
+            written = await async_redis_client.set_versioned_hash(
+                cart_key, self._cart_to_hash(cart.items), cart.version, previous_version, self.cache_ttl
+            )
+        if written != 1:
+            raise CartVersionConflictError(cart.user_id)
+        try:
+            await async_redis_client.append_stream(self.changes_stream, {
+                'op': 'save',
+                'user_id': cart.user_id,
+                'version': cart.version,
+                'items': [item.to_record() for item in cart.items]
+            })
+        except redis.RedisError:
+            await self._drop_cached_cart(cart_key)
+            raise
+        await self._publish_cart_change(cart)
+
+    async def _drop_cached_cart(self, cart_key: str) -> None:
+        """Delete a cached cart now, or once Redis is back"""
+        local_cache.invalidate(cart_key)
+        try:
+            await async_redis_client.delete_data(cart_key)
+        except redis.RedisError:
+            redis_client.defer_delete(cart_key)
+
+    async def _read_latest_cart(self, user_id: str) -> Cart:
+        """The cart at its latest version, see CartService._read_latest_cart"""
+        if self.write_behind:
+            fields = await async_redis_client.get_master_hash(self._get_cart_key(user_id))
+            if fields:
+                await self.catalog.ensure_products(self._hash_quantities(fields))
+                return self._cart_from_hash(user_id, fields)
+            return await self._load_cart_from_db(user_id) or Cart(user_id=user_id, items=[])
+        return await self._read_cart_from_db(user_id) or Cart(user_id=user_id, items=[])
+
+    async def _modify_cart(self, user_id: str, change: Callable[[Cart], Optional[CartChange]],
+                           expected_version: Optional[int] = None) -> Optional[Cart]:
+        """Optimistic read-modify-write of a cart, see CartService._modify_cart"""
+        cart = await self.get_cart(user_id)
+        if expected_version is not None and cart.version != expected_version:
+            cart = await self._read_latest_cart(user_id)
+        for attempt in range(self.write_retries + 1):
+            if expected_version is not None and cart.version != expected_version:
+                raise CartVersionConflictError(user_id, cart.version)
+            previous_version, was_empty = cart.version, cart.line_count == 0
+            result = change(cart)
+            if result is None:
+                return None
+            changed, removed, deltas = result
+            try:
+                await self._persist_cart(cart, previous_version, was_empty, changed, removed)
+            except CartVersionConflictError:
+                if attempt == self.write_retries:
+                    cart_write_conflicts.inc(result='failed')
+                    raise
+                cart_write_conflicts.inc(result='retried')
+                cart = await self._read_latest_cart(user_id)
+                continue
+            self.product_stats.record(deltas)
+            return cart
+
+    async def sync_version_counter(self) -> None:
+        """Raise the write-behind version counter past every version in the database"""
+        async with AsyncSessionLocal() as session:
+            last_version = (await session.execute(text('SELECT last_value FROM cart_version_seq'))).scalar_one()
+        await async_redis_client.raise_version(self.version_key, last_version)
+
+    async def add_item(self, user_id: str, item_data: dict, expected_version: Optional[int] = None) -> Optional[Cart]:
+        """Add a catalog product to the cart, None if the product does not exist"""
+        product = await self.catalog.get_product(item_data['product_id'])
+        if product is None:
+            return None
+        return await self._modify_cart(user_id, self._add_change(product, item_data['quantity']), expected_version)
+
+    async def remove_item(self, user_id: str, product_id: int, expected_version: Optional[int] = None) -> Cart:
+        return await self._modify_cart(user_id, self._remove_change(product_id), expected_version)
+
+    async def update_quantity(self, user_id: str, product_id: int, quantity: int,
+                              expected_version: Optional[int] = None) -> Optional[Cart]:
+        return await self._modify_cart(user_id, self._update_change(product_id, quantity), expected_version)
+
+    async def apply_operations(self, user_id: str, operations: List[Dict[str, Any]],
+                               expected_version: Optional[int] = None) -> Cart:
+        """Apply several operations at once, see CartService.apply_operations"""
+        await self.catalog.ensure_products(
+            operation['product_id'] for operation in operations if operation['op'] == 'add'
+        )
+        products = self.catalog.snapshot.products
+        return await self._modify_cart(
+            user_id, lambda cart: self._apply_operations_to_cart(cart, operations, products), expected_version
+        )
+
+    async def clear_cart(self, user_id: str, expected_version: Optional[int] = None) -> int:
+        """Empty a cart, returns the version of the clear, see CartService.clear_cart"""
+        cart_key = self._get_cart_key(user_id)
+        if self.write_behind:
+            version = await self._stage_clear(user_id, expected_version)
+        else:
+            async with AsyncSessionLocal() as session, session.begin():
+                if expected_version is not None:
+                    state = (await session.execute(self._cart_state_statement(user_id))).first()
+                    if state is not None and state[0] != expected_version and state[1]:
+                        raise CartVersionConflictError(user_id, state[0])
+                version = (await session.execute(self._next_version_statement())).scalar_one()
+                for stmt in self._cart_delete_statements(user_id):
+                    await session.execute(stmt)
+
+            empty = self._empty_cart_mappings([user_id])
+            try:
+                if empty:
+                    await async_redis_client.set_versioned_hash(
+                        cart_key, empty[cart_key], version, expiry=self.empty_cart_ttl
+                    )
+                else:
+                    await async_redis_client.delete_data(cart_key)
+            except redis.RedisError as e:
+                self._skip_cache_write(cart_key, e)
+                return version
+        await self._publish_invalidation(cart_key)
+        if self.cart_filter.enabled:
+            try:
+                await async_redis_client.count_filter_removal(self.cart_filter.meta_key)
+            except redis.RedisError as e:
+                logger.warning(f"Cart filter removal not counted: {e}")
+        return version
+
+    async def _stage_clear(self, user_id: str, expected_version: Optional[int]) -> int:
+        """Write-behind clear, see CartService._stage_clear"""
+        cart_key = self._get_cart_key(user_id)
+        current_version = None
+        if expected_version is not None:
+            latest = await self._read_latest_cart(user_id)
+            if latest.version != expected_version and latest.line_count:
+                raise CartVersionConflictError(user_id, latest.version)
+            current_version = latest.version
+        version = await async_redis_client.next_version(self.version_key)
+        written = await async_redis_client.set_versioned_hash(
+            cart_key, {EMPTY_CART_FIELD: 1}, version, current_version, self.empty_cart_ttl or self.cache_ttl
+        )
+        if written != 1:
+            raise CartVersionConflictError(user_id)
+        try:
+            await async_redis_client.append_stream(
+                self.changes_stream, {'op': 'clear', 'user_id': user_id, 'version': version}
+            )
+        except redis.RedisError:
+            await self._drop_cached_cart(cart_key)
+            raise
+        return version
+
+    async def get_top_products(self, count: int = 10, offset: int = 0, window: str = 'all') -> List[Dict[str, Any]]:
+        """Get top products by purchase frequency over a window of STATS_WINDOWS"""
+        if window == 'all':
+            return await async_redis_client.get_top_values(self.product_stats.key, count, offset)
+        return await async_redis_client.get_top_union(
+            self.product_stats.window_key(window),
+            self.product_stats.window_sources(window, datetime.now(timezone.utc)),
+            self.product_stats.window_cache_ttl, count, offset
+        )
+
+    async def get_cart_filter_stats(self) -> Dict[str, Any]:
+        """Get the state of the Bloom filter of users with a cart"""
+        meta = await async_redis_client.get_filter_meta(self.cart_filter.meta_key) if self.cart_filter.enabled else {}
+        return self.cart_filter.stats_from_meta(meta)
+
+    async def get_write_behind_stats(self) -> Dict[str, Any]:
+        """Get the backlog of cart changes still waiting to reach the database"""
+        stats = await async_redis_client.get_stream_lag(self.changes_stream, Config.CART_FLUSHER_GROUP)
+        stats['mode'] = Config.PERSISTENCE_MODE
+        return stats
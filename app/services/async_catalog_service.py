@@ -0,0 +1,78 @@
+from app.models.cart import Product
+from app.models.async_database import AsyncSessionLocal
+from app.cache.redis_client import redis_client
+from app.cache.async_redis_client import async_redis_client
+from app.services.catalog_service import CatalogService, CatalogSnapshot
+from datetime import datetime, timezone
+from typing import Optional, List, Iterable, Mapping
+import asyncio
+import logging
+import redis
+import time
+
+logger = logging.getLogger(__name__)
+
+class AsyncCatalogService(CatalogService):
+    """
+    asyncio version of CatalogService. Lookups never block: callers await
+    refresh() or ensure_products() first, and get_products() then only reads
+    the in-memory snapshot.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._async_refresh_lock = asyncio.Lock()
+
+    async def refresh(self, force: bool = False) -> CatalogSnapshot:
+        """Current snapshot, see CatalogService.refresh"""
+        if not force and (not self._refresh_due() or self._async_refresh_lock.locked()):
+            return self.snapshot
+        async with self._async_refresh_lock:
+            self._checked_at = time.monotonic()
+            if not force:
+                try:
+                    remote_version = await async_redis_client.get_version(self.version_key)
+                except redis.RedisError:
+                    remote_version = None
+                if self._skip_remote_check(remote_version):
+                    return self.snapshot
+            async with AsyncSessionLocal() as session:
+                rows = (await session.execute(self._changes_statement(self.snapshot.version))).all()
+            return self._apply_changes(rows)
+
+    async def ensure_products(self, product_ids: Iterable[int]) -> None:
+        """Refresh the snapshot if it is due or lacks any of the products"""
+        snapshot = await self.refresh()
+        if any(product_id not in snapshot.products for product_id in product_ids):
+            await self.refresh(force=True)
+
+    def get_products(self, product_ids: Iterable[int]) -> Mapping[int, Product]:
+        """Products of the snapshot as it is (see ensure_products)"""
+        return self.snapshot.products
+
+    async def list_products(self) -> List[Product]:
+        """Every product, ordered by id"""
+        products = (await self.refresh()).products
+        return [products[product_id] for product_id in sorted(products)]
+
+    async def get_product(self, product_id: int) -> Optional[Product]:
+        await self.ensure_products([product_id])
+        return self.snapshot.products.get(product_id)
+
+    async def save_products(self, products: List[Product]) -> int:
+        """Create or update products and publish the new version, see CatalogService.save_products"""
+        # asyncpg does not convert aware datetimes for TIMESTAMP WITHOUT TIME ZONE columns
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        async with AsyncSessionLocal() as session, session.begin():
+            await session.execute(self._lock_statement())
+            version = max((await session.execute(self._upsert_statement(products, now))).scalars())
+        try:
+            await async_redis_client.raise_version(self.version_key, version)
+        except redis.RedisError as e:
+            logger.warning(f"Catalog version {version} deferred: {e}")
+            redis_client.defer_raise_version(self.version_key, version)
+        await self.refresh(force=True)
+        return version
+
+# Global async catalog instance
+async_catalog = AsyncCatalogService()
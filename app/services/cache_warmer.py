@@ -0,0 +1,112 @@
+from app.models.cart import CartItem
+from app.models.database import db, DBCart, DBCartItem
+from app.cache.redis_client import redis_client
+from app.services.cart_service import CartService, VERSION_FIELD
+from app.config import Config
+from sqlalchemy import select
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, List, Any
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class CacheWarmer:
+    """
+    Preloads recently updated carts from PostgreSQL into Redis.
+
+    Carts are streamed newest first through a server-side cursor and handled
+    one chunk at a time: one IN query for the chunk's items and one pipeline
+    to Redis. Memory use depends on the chunk size, not on the table size.
+    Keys that already exist are left alone, so warming never overwrites a
+    fresher entry written by a request.
+    """
+
+    def __init__(self, max_carts: Optional[int] = None, since_hours: Optional[float] = None,
+                 chunk_size: Optional[int] = None, rate_limit: Optional[float] = None):
+        self.max_carts = Config.CACHE_WARM_MAX_CARTS if max_carts is None else max_carts
+        self.since_hours = Config.CACHE_WARM_SINCE_HOURS if since_hours is None else since_hours
+        self.chunk_size = chunk_size or Config.CACHE_WARM_CHUNK_SIZE
+        self.rate_limit = Config.CACHE_WARM_RATE_LIMIT if rate_limit is None else rate_limit
+        self.cart_service = CartService()
+
+    def _carts_statement(self):
+        stmt = select(DBCart.id, DBCart.user_id, DBCart.version).order_by(DBCart.updated_at.desc())
+        if self.since_hours:
+            stmt = stmt.where(DBCart.updated_at >= datetime.now(timezone.utc) - timedelta(hours=self.since_hours))
+        if self.max_carts:
+            stmt = stmt.limit(self.max_carts)
+        return stmt
+
+    def _load_items(self, cart_ids: List[int]) -> Dict[int, List[CartItem]]:
+        """Items of every cart in the chunk with a single query"""
+        rows = db.session.execute(
+            select(DBCartItem.cart_id, DBCartItem.product_id, DBCartItem.quantity)
+            .where(DBCartItem.cart_id.in_(cart_ids))
+            .order_by(DBCartItem.cart_id, DBCartItem.id)
+        )
+        items: Dict[int, List[CartItem]] = {}
+        for row in rows:
+            items.setdefault(row.cart_id, []).append(
+                CartItem(product_id=row.product_id, quantity=row.quantity)
+            )
+        return items
+
+    def _throttle(self, started: float, carts: int) -> None:
+        """Sleep as long as needed to stay under the rate limit"""
+        if self.rate_limit > 0:
+            ahead = carts / self.rate_limit - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def run(self) -> Dict[str, Any]:
+        """Warm the cache and return how many carts were read and written"""
+        started = time.monotonic()
+        scanned = 0
+        written = 0
+        logger.info(
+            f"Cache warming: up to {self.max_carts or 'all'} carts updated in the last "
+            f"{self.since_hours or 'any number of'} hours, chunks of {self.chunk_size}"
+        )
+        try:
+            result = db.session.execute(
+                self._carts_statement(),
+                execution_options={'stream_results': True, 'yield_per': self.chunk_size}
+            )
+            for chunk in result.partitions():
+                items = self._load_items([row.id for row in chunk])
+                mappings = {
+                    self.cart_service._get_cart_key(row.user_id): {
+                        **self.cart_service._cart_to_hash(items[row.id]), VERSION_FIELD: row.version
+                    }
+                    for row in chunk if row.id in items
+                }
+                written += redis_client.fill_hashes(mappings, self.cart_service.cache_ttl)
+                scanned += len(chunk)
+                elapsed = time.monotonic() - started
+                logger.info(
+                    f"Cache warming: {scanned} carts read, {written} written "
+                    f"({scanned / elapsed if elapsed else 0:.0f} carts/s)"
+                )
+                self._throttle(started, scanned)
+        finally:
+            # Close the server-side cursor and its transaction
+            db.session.rollback()
+
+        stats = {'scanned': scanned, 'written': written, 'seconds': round(time.monotonic() - started, 3)}
+        logger.info(f"Cache warming finished: {stats}")
+        return stats
+
+def start_background_warming(app) -> threading.Thread:
+    """Warm the cache in a daemon thread so startup is not delayed"""
+    def warm():
+        with app.app_context():
+            try:
+                CacheWarmer().run()
+            except Exception as e:
+                logger.error(f"Cache warming failed: {e}")
+
+    thread = threading.Thread(target=warm, name='cache-warmer', daemon=True)
+    thread.start()
+    return thread
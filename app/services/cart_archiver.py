@@ -0,0 +1,193 @@
+from app.models.database import db
+from app.cache.redis_client import redis_client
+from app.cache.local_cache import local_cache
+from app.services.cart_service import CartService
+from app.services.cart_filter import cart_filter
+from app.metrics import metrics
+from app.config import Config
+from sqlalchemy import text
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, List, Any, Tuple
+import logging
+import redis
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+carts_archived = metrics.counter('carts_archived_total', 'Abandoned carts moved to cart_archive')
+
+# One batch in one statement: lock the oldest abandoned carts (skipping the
+# ones a request is writing), delete their items, write the archive rows and
+# delete the carts, returning what the cache needs to forget
+ARCHIVE_BATCH_SQL = """
+WITH abandoned AS (
+    SELECT id, user_id, version, created_at, updated_at FROM carts
+    WHERE updated_at < :cutoff
+    ORDER BY updated_at
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+), items AS (
+    DELETE FROM cart_items USING abandoned
+    WHERE cart_items.cart_id = abandoned.id
+    RETURNING cart_items.cart_id, cart_items.product_id, cart_items.quantity
+), archived AS (
+    INSERT INTO cart_archive (user_id, version, items, created_at, updated_at, archived_at)
+    SELECT abandoned.user_id, abandoned.version,
+           COALESCE(jsonb_agg(jsonb_build_array(items.product_id, items.quantity) ORDER BY items.product_id)
+                    FILTER (WHERE items.cart_id IS NOT NULL), '[]'::jsonb),
+           abandoned.created_at, abandoned.updated_at, :now
+    FROM abandoned LEFT JOIN items ON items.cart_id = abandoned.id
+    GROUP BY abandoned.id, abandoned.user_id, abandoned.version, abandoned.created_at, abandoned.updated_at
+)
+DELETE FROM carts USING abandoned
+WHERE carts.id = abandoned.id
+RETURNING carts.user_id, carts.version
+"""
+
+def month_start(moment: datetime, months_ago: int = 0) -> datetime:
+    """First instant of the month months_ago months before moment's (negative for later months)"""
+    index = moment.year * 12 + moment.month - 1 - months_ago
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(start: datetime) -> str:
+    return f"cart_archive_{start:%Y%m}"
+
+class CartArchiver:
+    """
+    Moves abandoned carts (not updated for after_days days) from carts and
+    cart_items to cart_archive. Each batch is its own short transaction
+    that locks at most batch_size carts with SKIP LOCKED, so requests never
+    wait behind the archiver and several archivers can run at once.
+
+    After the commit the carts' Redis keys are deleted, except the ones that
+    hold a newer version (a write-behind change not flushed yet, which
+    brings the cart back when the flusher applies it).
+    """
+
+    def __init__(self, after_days: Optional[float] = None, batch_size: Optional[int] = None,
+                 max_batches: Optional[int] = None, retention_months: Optional[int] = None):
+        self.after_days = Config.CART_ARCHIVE_AFTER_DAYS if after_days is None else after_days
+        self.batch_size = batch_size or Config.CART_ARCHIVE_BATCH_SIZE
+        self.max_batches = Config.CART_ARCHIVE_MAX_BATCHES if max_batches is None else max_batches
+        self.retention_months = Config.CART_ARCHIVE_RETENTION_MONTHS if retention_months is None else retention_months
+        self.cart_service = CartService()
+
+    def cutoff(self, now: datetime) -> datetime:
+        """Carts last updated before this are abandoned"""
+        return now - timedelta(days=self.after_days)
+
+    def count_abandoned(self, now: datetime) -> int:
+        count = db.session.execute(
+            text('SELECT count(*) FROM carts WHERE updated_at < :cutoff'), {'cutoff': self.cutoff(now)}
+        ).scalar_one()
+        db.session.rollback()
+        return count
+
+    def _partitions(self) -> List[str]:
+        rows = db.session.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "WHERE parent.relname = 'cart_archive'"
+        ))
+        return [row.relname for row in rows]
+
+    def ensure_partitions(self, now: datetime) -> None:
+        """Create this month's and next month's archive partitions if they are missing"""
+        existing = set(self._partitions())
+        for months_ago in (0, -1):
+            start = month_start(now, months_ago)
+            if partition_name(start) not in existing:
+                db.session.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF cart_archive "
+                    f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{month_start(start, -1):%Y-%m-%d}')"
+                ))
+        db.session.commit()
+
+    def drop_expired_partitions(self, now: datetime) -> List[str]:
+        """Drop the archive partitions of months older than the retention"""
+        if not self.retention_months:
+            return []
+        oldest_kept = partition_name(month_start(now, self.retention_months))
+        expired = sorted(name for name in self._partitions() if name < oldest_kept)
+        for name in expired:
+            db.session.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        db.session.commit()
+        if expired:
+            logger.info(f"Dropped expired cart archive partitions: {', '.join(expired)}")
+        return expired
+
+    def archive_batch(self, now: datetime) -> List[Tuple[str, int]]:
+        """Archive one batch in its own transaction, returns the (user_id, version) archived"""
+        try:
+            rows = db.session.execute(text(ARCHIVE_BATCH_SQL), {
+                'cutoff': self.cutoff(now), 'batch_size': self.batch_size, 'now': now
+            }).all()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return [(row.user_id, row.version) for row in rows]
+
+    def _forget_cached(self, archived: List[Tuple[str, int]]) -> None:
+        """Delete the archived carts from Redis and from every worker's L1"""
+        versions = {self.cart_service._get_cart_key(user_id): version for user_id, version in archived}
+        try:
+            redis_client.delete_versioned_hashes(versions)
+        except redis.RedisError as e:
+            logger.warning(f"Deletion of {len(versions)} archived carts from Redis deferred: {e}")
+            for key in versions:
+                redis_client.defer_delete(key)
+        for key in versions:
+            local_cache.publish_invalidation(redis_client, self.cart_service.invalidation_channel, key)
+        # Bloom filters cannot delete, the archived users stay until the next rebuild
+        cart_filter.record_removal(len(archived))
+
+    def run_once(self) -> Dict[str, Any]:
+        """One archiving pass, returns how many carts were archived"""
+        started = time.monotonic()
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.ensure_partitions(now)
+        archived = 0
+        batches = 0
+        while not self.max_batches or batches < self.max_batches:
+            batch = self.archive_batch(now)
+            if not batch:
+                break
+            self._forget_cached(batch)
+            carts_archived.inc(len(batch))
+            archived += len(batch)
+            batches += 1
+        dropped = self.drop_expired_partitions(now)
+
+        stats = {
+            'archived': archived,
+            'batches': batches,
+            'dropped_partitions': len(dropped),
+            'seconds': round(time.monotonic() - started, 3)
+        }
+        logger.info(f"Cart archiving finished: {stats}")
+        return stats
+
+    def run(self, interval: Optional[float] = None) -> None:
+        """Archive every interval seconds, forever"""
+        interval = Config.CART_ARCHIVE_INTERVAL if interval is None else interval
+        logger.info(f"Cart archiver: carts idle for {self.after_days} days, every {interval}s")
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                # The next pass picks up whatever this one left
+                logger.error(f"Cart archiving failed: {e}")
+            time.sleep(interval)
+
+def start_background_archiving(app) -> threading.Thread:
+    """Run the archiver in a daemon thread of a worker process"""
+    def archive():
+        with app.app_context():
+            CartArchiver().run()
+
+    thread = threading.Thread(target=archive, name='cart-archiver', daemon=True)
+    thread.start()
+    return thread
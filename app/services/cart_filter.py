@@ -0,0 +1,143 @@
+from app.models.database import db, DBCart
+from app.cache.redis_client import redis_client
+from app.cache.bloom import bloom_size, bloom_offsets
+from app.metrics import metrics
+from app.config import Config
+from sqlalchemy import select
+from datetime import datetime, timezone
+from typing import Optional, Dict, List, Any
+import logging
+import redis
+import time
+
+logger = logging.getLogger(__name__)
+
+filter_checks = metrics.counter(
+    'cart_filter_checks_total', 'Cache misses checked against the cart filter, by answer', ('result',)
+)
+
+class CartFilter:
+    """
+    Bloom filter, in Redis, of the users that have a cart. A cache miss for
+    a user the filter has never seen is an empty cart without asking
+    PostgreSQL; a positive answer may be wrong (CART_FILTER_ERROR_RATE) and
+    goes to the database as before. Writes add the user before persisting,
+    so the filter has no false negatives once built. It is only trusted
+    after rebuild() has loaded every existing cart and while its layout
+    (bits and hashes) matches this process's settings.
+    """
+
+    def __init__(self, enabled: bool, capacity: int, error_rate: float):
+        self.enabled = enabled
+        self.key = Config.CART_FILTER_KEY
+        self.rebuild_key = f"{self.key}:rebuild"
+        self.meta_key = f"{self.key}:meta"
+        self.bits, self.hashes = bloom_size(capacity, error_rate)
+        self.layout = f"{self.bits}:{self.hashes}"
+
+    def offsets(self, user_id: str) -> List[int]:
+        return bloom_offsets(user_id, self.bits, self.hashes)
+
+    def add(self, user_id: str) -> None:
+        """Record that a user has a cart (once Redis is back, if it is unavailable)"""
+        if not self.enabled:
+            return
+        offsets = self.offsets(user_id)
+        try:
+            redis_client.add_to_filter(self.key, self.rebuild_key, offsets)
+        except redis.RedisError as e:
+            logger.warning(f"Cart filter add of {user_id} deferred: {e}")
+            redis_client.defer_filter_add(self.key, offsets)
+
+    def record_removal(self, count: int = 1) -> None:
+        """Count cleared (or archived) carts, which stay in the filter until the next rebuild"""
+        if not self.enabled:
+            return
+        try:
+            redis_client.count_filter_removal(self.meta_key, count)
+        except redis.RedisError as e:
+            # Only the staleness figure of get_stats() is affected
+            logger.warning(f"Cart filter removal not counted: {e}")
+
+    def answers(self, layout: Optional[str], hits: List[bool]) -> List[bool]:
+        """Whether each user may have a cart, given the filter's state (everyone may while it is not ready)"""
+        if layout != self.layout:
+            filter_checks.inc(len(hits), result='not_ready')
+            return [True] * len(hits)
+        absent = hits.count(False)
+        filter_checks.inc(absent, result='absent')
+        filter_checks.inc(len(hits) - absent, result='maybe')
+        return hits
+
+    def might_have_carts(self, user_ids: List[str]) -> List[bool]:
+        """Whether each user may have a cart, with one round trip"""
+        if not self.enabled or not user_ids:
+            return [True] * len(user_ids)
+        try:
+            layout, hits = redis_client.check_filter(self.key, self.meta_key, [self.offsets(user_id) for user_id in user_ids])
+        except redis.RedisError as e:
+            logger.warning(f"Cart filter unavailable: {e}")
+            layout, hits = None, [True] * len(user_ids)
+        return self.answers(layout, hits)
+
+    def might_have_cart(self, user_id: str) -> bool:
+        return self.might_have_carts([user_id])[0]
+
+    def rebuild(self, chunk_size: int = 5000, expiry: int = 3600) -> Dict[str, Any]:
+        """
+        Build a fresh filter from every cart in PostgreSQL and swap it in.
+        Carts written meanwhile are added to both filters, so none is lost.
+        Needs an app context. In write-behind mode run it while the flusher
+        is caught up: carts still only in the stream are not read here.
+        """
+        started = time.monotonic()
+        redis_client.start_filter_rebuild(self.rebuild_key, self.bits, expiry)
+        carts = 0
+        try:
+            result = db.session.execute(
+                select(DBCart.user_id),
+                execution_options={'stream_results': True, 'yield_per': chunk_size}
+            )
+            for chunk in result.partitions():
+                redis_client.set_bits(
+                    self.rebuild_key,
+                    [offset for row in chunk for offset in self.offsets(row.user_id)],
+                    expiry
+                )
+                carts += len(chunk)
+        finally:
+            # Close the server-side cursor and its transaction
+            db.session.rollback()
+        redis_client.finish_filter_rebuild(self.rebuild_key, self.key, self.meta_key, {
+            'layout': self.layout,
+            'carts': carts,
+            'built_at': datetime.now(timezone.utc).isoformat(),
+            'removed': 0
+        })
+        stats = {'carts': carts, 'bits': self.bits, 'hashes': self.hashes,
+                 'seconds': round(time.monotonic() - started, 3)}
+        logger.info(f"Cart filter rebuilt: {stats}")
+        return stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Settings and state of the filter: whether it is used, its size and staleness"""
+        return self.stats_from_meta(redis_client.get_filter_meta(self.meta_key) if self.enabled else {})
+
+    def stats_from_meta(self, meta: Dict[str, str]) -> Dict[str, Any]:
+        """get_stats for the filter's meta hash, already read"""
+        return {
+            'enabled': self.enabled,
+            'ready': meta.get('layout') == self.layout,
+            'bits': self.bits,
+            'hashes': self.hashes,
+            'carts_at_build': int(meta.get('carts', 0)),
+            'removed_since_build': int(meta.get('removed', 0)),
+            'built_at': meta.get('built_at')
+        }
+
+# Global cart filter instance
+cart_filter = CartFilter(
+    enabled=Config.CART_FILTER_ENABLED,
+    capacity=Config.CART_FILTER_CAPACITY,
+    error_rate=Config.CART_FILTER_ERROR_RATE
+)
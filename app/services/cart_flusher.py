@@ -0,0 +1,139 @@
+from app.models.cart import Cart, CartItem
+from app.models.database import db
+from app.cache.redis_client import redis_client
+from app.services.cart_service import CartService
+from app.config import Config
+from typing import Optional, Dict, Any
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+class CartFlusher:
+    """
+    Write-behind worker: consumes the cart change stream with a consumer group,
+    keeps only the latest change per user and flushes each batch to PostgreSQL
+    in a single transaction.
+
+    Entries are acknowledged only after the commit, so a crash means they are
+    delivered again (at-least-once). Every change carries the version Redis
+    gave it and is only applied over an older one: a replayed save never
+    replaces a newer cart and a replayed clear never deletes one. Run a
+    single active flusher per stream; extra instances only take over entries
+    abandoned by a dead consumer.
+    """
+
+    def __init__(self, consumer_name: Optional[str] = None):
+        self.stream = Config.CART_CHANGES_STREAM
+        self.group = Config.CART_FLUSHER_GROUP
+        self.consumer = consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = Config.FLUSHER_BATCH_SIZE
+        self.block_ms = Config.FLUSHER_BLOCK_MS
+        if Config.REDIS_SOCKET_TIMEOUT:
+            # A blocking read longer than the socket timeout would fail as a timeout
+            self.block_ms = min(self.block_ms, int(Config.REDIS_SOCKET_TIMEOUT * 1000 / 2))
+        self.claim_idle_ms = Config.FLUSHER_CLAIM_IDLE_MS
+        self.cart_service = CartService()
+        self.flushed_entries = 0
+        self.flushed_carts = 0
+        self.batches = 0
+
+    def _apply(self, changes: Dict[str, Dict[str, Any]]) -> None:
+        """Write the coalesced changes in one transaction"""
+        try:
+            newest_version = 0
+            for user_id, change in changes.items():
+                # Changes queued before carts had versions carry none
+                version = change.get('version') or 0
+                newest_version = max(newest_version, version)
+                if change['op'] == 'clear':
+                    self.cart_service.delete_cart_from_db(user_id, version or None)
+                else:
+                    items = [
+                        CartItem(product_id=item['product_id'], quantity=item['quantity'])
+                        for item in change['items']
+                    ]
+                    cart = Cart(user_id=user_id, items=items, version=version)
+                    self.cart_service.write_cart_to_db(cart, assign_version=not version)
+            if newest_version:
+                # Versions taken by write-through writes must stay above these
+                self.cart_service.advance_versions(newest_version)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def flush_once(self) -> int:
+        """Flush one batch and return the number of stream entries processed"""
+        # Older changes always go first: this consumer's own unacknowledged
+        # entries (a batch that failed), then entries abandoned by a crashed
+        # consumer, and new ones only once no other consumer holds any, so a
+        # redelivered change is never applied after a newer one
+        entries = redis_client.read_stream_group(
+            self.stream, self.group, self.consumer, self.batch_size, self.block_ms, pending=True
+        )
+        if not entries:
+            entries = redis_client.claim_stale_entries(
+                self.stream, self.group, self.consumer, self.claim_idle_ms, self.batch_size
+            )
+        if not entries:
+            if redis_client.count_pending_entries(self.stream, self.group):
+                # Still owned by another consumer, claimable once idle for claim_idle_ms
+                time.sleep(self.block_ms / 1000)
+                return 0
+            entries = redis_client.read_stream_group(
+                self.stream, self.group, self.consumer, self.batch_size, self.block_ms
+            )
+        if not entries:
+            return 0
+
+        changes: Dict[str, Dict[str, Any]] = {}
+        for _, change in entries:
+            if change is None:
+                continue
+            # The newest version per user wins (stream order for changes without one)
+            previous = changes.get(change['user_id'])
+            if previous is None or (change.get('version') or 0) >= (previous.get('version') or 0):
+                changes[change['user_id']] = change
+
+        if changes:
+            self._apply(changes)
+        redis_client.ack_stream_entries(self.stream, self.group, [entry_id for entry_id, _ in entries])
+
+        self.batches += 1
+        self.flushed_entries += len(entries)
+        self.flushed_carts += len(changes)
+        return len(entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Throughput counters of this flusher plus the current stream lag"""
+        stats = redis_client.get_stream_lag(self.stream, self.group)
+        stats.update({
+            'consumer': self.consumer,
+            'batches': self.batches,
+            'flushed_entries': self.flushed_entries,
+            'flushed_carts': self.flushed_carts
+        })
+        return stats
+
+    def run(self) -> None:
+        """Flush forever, logging lag metrics periodically"""
+        redis_client.ensure_consumer_group(self.stream, self.group)
+        logger.info(f"Cart flusher {self.consumer} consuming {self.stream} as group {self.group}")
+        last_report = time.monotonic()
+        while True:
+            try:
+                self.flush_once()
+            except Exception as e:
+                # Unacknowledged entries stay pending and are retried
+                logger.error(f"Cart flush failed: {e}")
+                time.sleep(1)
+
+            if time.monotonic() - last_report >= Config.FLUSHER_STATS_INTERVAL:
+                last_report = time.monotonic()
+                try:
+                    logger.info(f"Cart flusher stats: {self.get_stats()}")
+                except Exception as e:
+                    logger.error(f"Cart flusher stats unavailable: {e}")
@@ -1,173 +1,949 @@
-from app.models.cart import Cart, CartItem
-from app.models.database import db, DBCart, DBCartItem
+from app.models.cart import Cart, CartItem, Product
+from app.models.database import db, DBCart, DBCartItem, CART_VERSION_SEQ
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import joinedload
+from datetime import datetime, timezone
 from app.cache.redis_client import redis_client
+from app.cache.local_cache import local_cache
+from app.cache.codec import cart_body, loads
+from app.services.catalog_service import catalog
+from app.services.product_stats import product_stats
+from app.services.cart_filter import cart_filter
+from app.metrics import cache_lookups, metrics, stage
 from app.config import Config
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Tuple, Mapping, Callable
 import logging
+import math
+import random
+import redis
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+cart_write_conflicts = metrics.counter(
+    'cart_write_conflicts_total', 'Cart writes that lost the version compare-and-set, by outcome', ('result',)
+)
+
+# Only field of a cached empty cart (negative caching)
+EMPTY_CART_FIELD = '_empty'
+# Version of a cached cart (see the versioned hash scripts of the Redis client)
+VERSION_FIELD = '_version'
+
+# What a change to a cart returns: lines to write and products to delete in
+# the cache, and the stats delta per product
+CartChange = Tuple[List[CartItem], List[int], Dict[str, int]]
+
+def cart_etag(version: int, catalog_version: int) -> str:
+    """
+    ETag of a cart response: the body depends on the cart's version and on
+    the catalog it was joined with (names and prices)
+    """
+    return f"{version}.{catalog_version}"
+
+def etag_version(etag: str) -> Optional[int]:
+    """Cart version of an ETag built by cart_etag (None if it is not one)"""
+    try:
+        return int(etag.split('.', 1)[0])
+    except ValueError:
+        return None
+
+class CartOperationError(Exception):
+    """An operation of a batch that cannot be applied (nothing was applied)"""
+    
+    def __init__(self, index: int, message: str):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+class CartVersionConflictError(Exception):
+    """A cart is not at the version a write expected (If-Match, or another write got there first)"""
+    
+    def __init__(self, user_id: str, version: Optional[int] = None):
+        super().__init__(f"Cart {user_id} is not at the expected version")
+        self.user_id = user_id
+        # Current version, when known
+        self.version = version
+
 class CartService:
     def __init__(self):
         self.cart_key_prefix = Config.CART_KEY_PREFIX
-        self.product_stats_key = Config.PRODUCT_STATS_KEY
+        self.product_stats = product_stats
         self.cache_ttl = Config.CACHE_TTL
+        self.invalidation_channel = Config.CACHE_INVALIDATION_CHANNEL
+        self.write_behind = Config.PERSISTENCE_MODE == 'write_behind'
+        self.changes_stream = Config.CART_CHANGES_STREAM
+        self.lock_prefix = Config.CACHE_LOCK_PREFIX
+        self.lock_ttl_ms = Config.CACHE_LOCK_TTL_MS
+        self.lock_wait_ms = Config.CACHE_LOCK_WAIT_MS
+        self.lock_poll_ms = Config.CACHE_LOCK_POLL_MS
+        self.xfetch_beta = Config.CACHE_XFETCH_BETA
+        self.empty_cart_ttl = Config.CACHE_EMPTY_TTL
+        self.write_retries = Config.CART_WRITE_RETRIES
+        self.version_key = Config.CART_VERSION_KEY
+        self.cart_filter = cart_filter
+        self.catalog = catalog
 
     def _get_cart_key(self, user_id: str) -> str:
-        """Generate Redis key for cart data"""
-        return f"{self.cart_key_prefix}{user_id}"
+        """
+        Generate Redis key for cart data. The user id is the hash tag, so the
+        cart and its lock always live on the same shard.
+        """
+        return f"{self.cart_key_prefix}{{{user_id}}}"
+
+    def _cart_to_hash(self, items: List[CartItem]) -> Dict[str, int]:
+        """One hash field per product, keyed by product_id, holding the quantity"""
+        return {str(item.product_id): item.quantity for item in items}
+
+    def _hash_quantities(self, fields: Dict[str, Any]) -> Dict[int, int]:
+        """Quantity per product of a cached cart hash, skipping metadata fields ('_' prefix)"""
+        return {
+            # Entries cached before the catalog hold whole item objects
+            int(field): value['quantity'] if isinstance(value, dict) else value
+            for field, value in fields.items() if not field.startswith('_')
+        }
+
+    def _hash_version(self, fields: Dict[str, Any]) -> int:
+        """Version of a cached cart hash (0 for entries cached before carts had versions)"""
+        return int(fields.get(VERSION_FIELD) or 0)
+
+    def _hash_to_body(self, user_id: str, fields: Dict[str, Any]) -> str:
+        """Response body of a cached cart hash, joined with the catalog"""
+        return cart_body(
+            user_id, self.catalog.join_item_dicts(self._hash_quantities(fields)), self._hash_version(fields)
+        )
+
+    def _cart_from_hash(self, user_id: str, fields: Dict[str, Any]) -> Cart:
+        """Convert a cached cart hash to a Cart object joined with the catalog"""
+        return Cart(
+            user_id=user_id,
+            items=self.catalog.join_items(self._hash_quantities(fields)),
+            version=self._hash_version(fields)
+        )
+
+    def _cart_body(self, cart: Cart) -> str:
+        """Response body of a cart; the in-process cache keeps it with the cart's version"""
+        return cart_body(cart.user_id, [item.to_dict() for item in cart.items], cart.version)
+
+    def _should_refresh_early(self, fields: Dict[str, Any], ttl_ms: int) -> bool:
+        """
+        XFetch: recompute before expiry with a probability that grows as the
+        TTL runs out, scaled by how long the last recomputation took (_delta)
+        """
+        delta_ms = fields.get('_delta')
+        if not delta_ms or ttl_ms < 0 or self.xfetch_beta <= 0 or self.write_behind:
+            # In write-behind mode the cache is newer than the database
+            return False
+        return -delta_ms * self.xfetch_beta * math.log(1.0 - random.random()) >= ttl_ms
+
+    def _cache_mapping(self, cart: Cart, delta_ms: Optional[int] = None) -> Dict[str, Any]:
+        """Hash fields for a cart loaded from the database"""
+        mapping = self._cart_to_hash(cart.items)
+        if mapping and delta_ms is not None:
+            # Recomputation cost, used by XFetch to decide on early refreshes
+            mapping['_delta'] = delta_ms
+        return mapping
+
+    def _empty_cart_mappings(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Negative cache entries for users without a cart (none if CACHE_EMPTY_TTL is 0)"""
+        if self.empty_cart_ttl <= 0:
+            return {}
+        return {self._get_cart_key(user_id): {EMPTY_CART_FIELD: 1} for user_id in user_ids}
+
+    def _skip_cache_write(self, cart_key: str, error: Exception) -> None:
+        """
+        A cache write failed (Redis down or its circuit open): forget the
+        local copy and delete the Redis entry once Redis is back, so it
+        cannot serve the cart as it was before this change
+        """
+        logger.warning(f"Cache write skipped for {cart_key}: {error}")
+        local_cache.invalidate(cart_key)
+        redis_client.defer_delete(cart_key)
+
+    def _set_cached_cart(self, cart: Cart, delta_ms: Optional[int] = None) -> None:
+        """
+        Write the whole cart to Redis, unless it already holds a newer
+        version, and keep the in-process copy in sync
+        """
+        cart_key = self._get_cart_key(cart.user_id)
+        try:
+            written = redis_client.set_versioned_hash(
+                cart_key, self._cache_mapping(cart, delta_ms), cart.version, expiry=self.cache_ttl
+            )
+        except redis.RedisError as e:
+            self._skip_cache_write(cart_key, e)
+            return
+        if written == 1:
+            local_cache.set(cart_key, (cart.version, self._cart_body(cart)))
+
+    def _publish_cart_change(self, cart: Cart, latest: bool = True) -> None:
+        """
+        Invalidate other workers' L1 copies and store the new local one
+        (dropped instead if the cache already holds a newer version)
+        """
+        cart_key = self._get_cart_key(cart.user_id)
+        local_cache.publish_invalidation(redis_client, self.invalidation_channel, cart_key)
+        if latest:
+            local_cache.set(cart_key, (cart.version, self._cart_body(cart)))
+        else:
+            local_cache.invalidate(cart_key)
+
+    def _write_cart_delta(self, cart: Cart, changed: List[CartItem], removed: List[int],
+                          previous_version: Optional[int]) -> None:
+        """
+        Write only the changed product fields of a cached cart, if it is
+        still at previous_version (the version the change was made on)
+        """
+        cart_key = self._get_cart_key(cart.user_id)
+        try:
+            written = 0
+            if previous_version is not None:
+                written = redis_client.update_versioned_hash(
+                    cart_key,
+                    self._cart_to_hash(changed),
+                    # Also drops the marker of a negatively cached cart
+                    [str(product_id) for product_id in removed] + [EMPTY_CART_FIELD],
+                    previous_version, cart.version, self.cache_ttl
+                )
+            if written != 1:
+                # Cached cart expired or at another version: rewrite it in full,
+                # unless it already holds a newer one
+                written = redis_client.set_versioned_hash(
+                    cart_key, self._cart_to_hash(cart.items), cart.version, expiry=self.cache_ttl
+                )
+            self._publish_cart_change(cart, latest=written == 1)
+        except redis.RedisError as e:
+            self._skip_cache_write(cart_key, e)
+
+    def _cart_from_body(self, body: str) -> Cart:
+        """Convert a cached response body to a Cart object"""
+        data = loads(body)
+        return Cart(
+            user_id=data['user_id'],
+            items=[CartItem(**item) for item in data['items']],
+            version=data.get('version', 0)
+        )
+
+    def _cart_from_db(self, db_cart: DBCart) -> Cart:
+        """Convert a database cart (with its items) to a Cart object joined with the catalog"""
+        items = self.catalog.join_items({item.product_id: item.quantity for item in db_cart.items})
+        return Cart(user_id=db_cart.user_id, items=items, version=db_cart.version)
 
     def get_cart(self, user_id: str) -> Cart:
         """
         Implementación del patrón Cache-Aside:
-        1. Intenta obtener del cache
-        2. Si no está en cache, obtiene de la BD
+        1. Intenta obtener del cache (local y luego Redis)
+        2. Si no está en cache, un solo worker obtiene de la BD y los demás esperan
         3. Actualiza el cache con los datos de la BD
         """
+        cached, cart = self._lookup_cart(user_id, as_body=False)
+        return cart if cart is not None else self._cart_from_body(cached[1])
+    
+    def get_cart_body(self, user_id: str) -> Tuple[str, str]:
+        """
+        Same lookup as get_cart, returning the ETag and the JSON response body.
+        A cache hit goes straight from the cached data to the body without
+        model objects.
+        """
+        # Taken first: a body joined with a newer catalog only makes the ETag stale
+        catalog_version = self.catalog.refresh().version
+        cached, cart = self._lookup_cart(user_id)
+        version, body = cached if cached is not None else (cart.version, self._cart_body(cart))
+        return cart_etag(version, catalog_version), body
+    
+    def get_cart_etag(self, user_id: str) -> Optional[str]:
+        """
+        ETag of a cached cart from its version alone, without reading or
+        joining its items, for conditional GETs (None if it is not cached)
+        """
+        catalog_version = self.catalog.refresh().version
+        cart_key = self._get_cart_key(user_id)
+        cached = local_cache.get(cart_key)
+        if cached is not None:
+            cache_lookups.inc(operation='get_cart_etag', result='l1_hit')
+            return cart_etag(cached[0], catalog_version)
+        try:
+            version = redis_client.get_hash_field(cart_key, VERSION_FIELD)
+        except redis.RedisError:
+            version = None
+        cache_lookups.inc(operation='get_cart_etag', result='miss' if version is None else 'redis_hit')
+        return cart_etag(version, catalog_version) if version is not None else None
+    
+    def etag(self, version: int) -> str:
+        """ETag of a cart just written, at the given version"""
+        return cart_etag(version, self.catalog.snapshot.version)
+    
+    def get_cart_page(self, user_id: str, offset: int, limit: int) -> Dict[str, Any]:
+        """One page of cart lines ordered by product_id, with the totals of the whole cart"""
+        return self.get_cart(user_id).page_to_dict(offset, limit)
+    
+    def _lookup_cart(self, user_id: str, as_body: bool = True) -> Tuple[Optional[Tuple[int, str]], Optional[Cart]]:
+        """
+        Cache-Aside lookup: ((version, body), None) on a cache hit, (None, cart)
+        when loaded from the database. With as_body=False a Redis hit is returned
+        as a Cart built from the hash, skipping the JSON body (and the L1 fill).
+        """
         # Try to get cart from cache first
         cart_key = self._get_cart_key(user_id)
-        cached_cart = redis_client.get_data(cart_key)
+        cached = local_cache.get(cart_key)
+        if cached is not None:
+            logger.info(f"Cache HIT for cart: {user_id}")
+            cache_lookups.inc(operation='get_cart', result='l1_hit')
+            return cached, None
         
-        if cached_cart:
+        try:
+            return self._lookup_redis(user_id, as_body)
+        except redis.RedisError as e:
+            # Redis down or its circuit open: straight to the database, nothing is cached
+            logger.warning(f"Cache bypassed for cart {user_id}: {e}")
+            cache_lookups.inc(operation='get_cart', result='bypass')
+            return None, self._read_cart_from_db(user_id) or Cart(user_id=user_id, items=[])
+    
+    def _lookup_redis(self, user_id: str, as_body: bool) -> Tuple[Optional[Tuple[int, str]], Optional[Cart]]:
+        """Redis part of _lookup_cart, including the single-flight load on a miss"""
+        cart_key = self._get_cart_key(user_id)
+        fields, ttl_ms = redis_client.get_hash_with_ttl(cart_key)
+        if fields:
             logger.info(f"Cache HIT for cart: {user_id}")
-            # Convert cached data to Cart object
-            items = [
-                CartItem(
-                    product_id=item["product_id"],
-                    name=item["name"],
-                    price=item["price"],
-                    quantity=item["quantity"]
-                ) for item in cached_cart.get("items", [])
-            ]
-            return Cart(user_id=user_id, items=items)
+            cache_lookups.inc(operation='get_cart', result='redis_hit')
+            if self._should_refresh_early(fields, ttl_ms):
+                cart = self._refresh_cart(user_id)
+                if cart is not None:
+                    return None, cart
+            return self._from_hash(user_id, fields, as_body)
         
-        # If not in cache, get from database
+        # If not in cache, get from database (unless the user never had a cart)
         logger.info(f"Cache MISS for cart: {user_id}")
+        cache_lookups.inc(operation='get_cart', result='miss')
+        if not self.cart_filter.might_have_cart(user_id):
+            return None, Cart(user_id=user_id, items=[])
+        return self._load_cart(user_id, as_body)
+    
+    def _from_hash(self, user_id: str, fields: Dict[str, Any],
+                   as_body: bool) -> Tuple[Optional[Tuple[int, str]], Optional[Cart]]:
+        """Lookup result for a cached hash, as a versioned body (also stored in L1) or as a Cart"""
+        if not as_body:
+            return None, self._cart_from_hash(user_id, fields)
+        cached = (self._hash_version(fields), self._hash_to_body(user_id, fields))
+        local_cache.set(self._get_cart_key(user_id), cached)
+        return cached, None
+    
+    def _read_cart_from_db(self, user_id: str) -> Optional[Cart]:
+        """Get the cart from the database, None if the user has none"""
         db_cart = DBCart.query.filter_by(user_id=user_id).first()
+        if not db_cart:
+            return None
+        with stage('cart_build'):
+            # Includes the lazy load of db_cart.items
+            return self._cart_from_db(db_cart)
+    
+    def _load_cart_from_db(self, user_id: str) -> Optional[Cart]:
+        """
+        Get the cart from the database and update the cache. A missing cart
+        is cached as empty, unless a write cached the cart in the meantime.
+        """
+        start = time.monotonic()
+        cart = self._read_cart_from_db(user_id)
+        if cart is None:
+            try:
+                redis_client.fill_hashes(self._empty_cart_mappings([user_id]), self.empty_cart_ttl)
+            except redis.RedisError as e:
+                logger.warning(f"Empty cart of {user_id} not cached: {e}")
+            return None
+        self._set_cached_cart(cart, delta_ms=int((time.monotonic() - start) * 1000))
+        return cart
+    
+    def _load_cart(self, user_id: str, as_body: bool = True) -> Tuple[Optional[Tuple[int, str]], Optional[Cart]]:
+        """
+        Single-flight cache miss: the worker holding the lock loads the cart
+        from the database, the others poll until it shows up in the cache
+        """
+        cart_key = self._get_cart_key(user_id)
+        lock_key = f"{self.lock_prefix}{cart_key}"
+        token = redis_client.acquire_lock(lock_key, self.lock_ttl_ms)
+        if token is None:
+            deadline = time.monotonic() + self.lock_wait_ms / 1000
+            while time.monotonic() < deadline:
+                time.sleep(self.lock_poll_ms / 1000)
+                fields, locked = redis_client.get_hash_and_lock_state(cart_key, lock_key)
+                if fields:
+                    return self._from_hash(user_id, fields, as_body)
+                if not locked:
+                    # The loader finished without caching anything (no cart in the database)
+                    break
+            return None, self._load_cart_from_db(user_id) or Cart(user_id=user_id, items=[])
         
-        if db_cart:
-            items = [
-                CartItem(
-                    product_id=item.product_id,
-                    name=item.name,
-                    price=item.price,
-                    quantity=item.quantity
-                ) for item in db_cart.items
-            ]
-            cart = Cart(user_id=user_id, items=items)
-            
-            # Update cache
-            redis_client.set_data(cart_key, cart.to_dict(), self.cache_ttl)
+        try:
+            # No cart found means an empty cart
+            return None, self._load_cart_from_db(user_id) or Cart(user_id=user_id, items=[])
+        finally:
+            redis_client.release_lock(lock_key, token)
+    
+    def _refresh_cart(self, user_id: str) -> Optional[Cart]:
+        """Early refresh of a cached cart, skipped if another worker is already on it"""
+        cart_key = self._get_cart_key(user_id)
+        lock_key = f"{self.lock_prefix}{cart_key}"
+        token = redis_client.acquire_lock(lock_key, self.lock_ttl_ms)
+        if token is None:
+            return None
+        try:
+            logger.info(f"Early refresh for cart: {user_id}")
+            cart = self._load_cart_from_db(user_id)
+            if cart is None:
+                # The cart is gone from the database, drop the stale entry
+                redis_client.delete_data(cart_key)
+                local_cache.invalidate(cart_key)
+                return Cart(user_id=user_id, items=[])
             return cart
-            
-        # No cart found, return empty cart
-        return Cart(user_id=user_id, items=[])
+        finally:
+            redis_client.release_lock(lock_key, token)
     
-    def save_cart(self, cart: Cart) -> None:
-        """Save cart to both database and cache"""
-        # Save to database
-        db_cart = DBCart.query.filter_by(user_id=cart.user_id).first()
-        if not db_cart:
-            db_cart = DBCart(user_id=cart.user_id)
-            db.session.add(db_cart)
-            db.session.flush()
+    def get_carts(self, user_ids: List[str]) -> Dict[str, Cart]:
+        """Batch version of get_cart, see get_cart_bodies"""
+        return {user_id: self._cart_from_body(body) for user_id, body in self.get_cart_bodies(user_ids).items()}
+    
+    def get_cart_bodies(self, user_ids: List[str]) -> Dict[str, str]:
+        """
+        Cache-Aside para varios usuarios a la vez:
+        1. Busca todos en la caché local y luego en Redis (un solo pipeline)
+        2. Carga todos los fallos de la BD con una sola consulta IN
+        3. Actualiza la caché con un solo pipeline
+        Devuelve el cuerpo JSON de cada carrito.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        bodies: Dict[str, str] = {}
         
-        # Create dictionary of existing items for quick lookup
-        existing_items = {item.product_id: item for item in db_cart.items}
-        new_items = {item.product_id: item for item in cart.items}
+        # In-process cache first
+        pending = []
+        for user_id in user_ids:
+            cached = local_cache.get(self._get_cart_key(user_id))
+            if cached is not None:
+                bodies[user_id] = cached[1]
+            else:
+                pending.append(user_id)
         
-        # Update or insert items
-        for product_id, cart_item in new_items.items():
-            if product_id in existing_items:
-                db_item = existing_items[product_id]
-                db_item.name = cart_item.name
-                db_item.price = cart_item.price
-                db_item.quantity = cart_item.quantity
+        # Then Redis, one pipelined round trip for every remaining cart
+        misses = []
+        try:
+            cached_hashes = redis_client.get_hashes([self._get_cart_key(user_id) for user_id in pending])
+        except redis.RedisError as e:
+            logger.warning(f"Cache bypassed for a batch of {len(pending)} carts: {e}")
+            cached_hashes = [None] * len(pending)
+        for user_id, fields in zip(pending, cached_hashes):
+            if fields:
+                bodies[user_id] = self._hash_to_body(user_id, fields)
+                local_cache.set(self._get_cart_key(user_id), (self._hash_version(fields), bodies[user_id]))
             else:
-                db_item = DBCartItem(
-                    cart_id=db_cart.id,
-                    product_id=cart_item.product_id,
-                    name=cart_item.name,
-                    price=cart_item.price,
-                    quantity=cart_item.quantity
-                )
-                db.session.add(db_item)
-                
-                # Update product statistics for new items
-                self._update_product_stats(str(cart_item.product_id), cart_item.quantity)
+                misses.append(user_id)
         
-        # Remove items that are no longer in the cart
-        for product_id, db_item in existing_items.items():
-            if product_id not in new_items:
-                db.session.delete(db_item)
+        logger.info(f"Batch cart read: {len(user_ids) - len(misses)} HIT, {len(misses)} MISS")
+        cache_lookups.inc(len(user_ids) - len(pending), operation='get_carts', result='l1_hit')
+        cache_lookups.inc(len(pending) - len(misses), operation='get_carts', result='redis_hit')
+        cache_lookups.inc(len(misses), operation='get_carts', result='miss')
+        # Users the filter has never seen have no cart
+        misses = [
+            user_id for user_id, maybe in zip(misses, self.cart_filter.might_have_carts(misses)) if maybe
+        ]
+        if misses:
+            # Single query for every miss, items eagerly loaded in the same round trip
+            db_carts = DBCart.query.options(joinedload(DBCart.items)).filter(DBCart.user_id.in_(misses)).all()
+            backfill = {}
+            for db_cart in db_carts:
+                cart = self._cart_from_db(db_cart)
+                bodies[cart.user_id] = self._cart_body(cart)
+                backfill[self._get_cart_key(cart.user_id)] = (cart.version, self._cart_to_hash(cart.items))
+            
+            try:
+                # Carts a write cached meanwhile at a newer version are left alone
+                written = set(redis_client.set_versioned_hashes(backfill, self.cache_ttl))
+                redis_client.fill_hashes(
+                    self._empty_cart_mappings([user_id for user_id in misses if user_id not in bodies]),
+                    self.empty_cart_ttl
+                )
+            except redis.RedisError as e:
+                logger.warning(f"Batch of {len(misses)} carts not cached: {e}")
+            else:
+                for db_cart in db_carts:
+                    cart_key = self._get_cart_key(db_cart.user_id)
+                    if cart_key in written:
+                        local_cache.set(cart_key, (db_cart.version, bodies[db_cart.user_id]))
         
-        db.session.commit()
+        # Users without a cart get an empty one
+        return {user_id: bodies.get(user_id) or cart_body(user_id, []) for user_id in user_ids}
+    
+    def save_cart(self, cart: Cart) -> None:
+        """
+        Save cart to both database and cache, whatever version it is at (it
+        gets a new one). Product stats are not touched: the callers that
+        change items record their own deltas.
+        """
+        self._persist_cart(cart)
+    
+    def _persist_cart(self, cart: Cart, previous_version: Optional[int] = None, was_empty: bool = False,
+                      changed: Optional[List[CartItem]] = None, removed: Optional[List[int]] = None) -> None:
+        """
+        Persist a cart at a new version (set in cart.version) and update the
+        cache. With previous_version, the version the change was made on, it
+        is a compare-and-set that raises CartVersionConflictError if the cart
+        moved on meanwhile (was_empty: the cart was read empty, which also
+        matches a cart that is gone), and only the changed and removed lines
+        are written to the cached copy.
+        Write-through commits the cart to the database; write-behind applies
+        it to the cached cart, the latest copy, and appends it to the change
+        stream for the flusher worker, which fails while Redis is unavailable.
+        The user goes into the cart filter first, so it never misses a saved cart.
+        """
+        self.cart_filter.add(cart.user_id)
+        if self.write_behind:
+            self._stage_cart(cart, previous_version, changed or [], removed or [])
+            return
         
-        # Update cache
+        try:
+            self.write_cart_to_db(cart, previous_version, was_empty)
+            with stage('db_commit'):
+                db.session.commit()
+        except CartVersionConflictError:
+            db.session.rollback()
+            raise
+        self._write_cart_delta(cart, changed or [], removed or [], previous_version)
+    
+    def _stage_cart(self, cart: Cart, previous_version: Optional[int], changed: List[CartItem],
+                    removed: List[int]) -> None:
+        """Write-behind part of _persist_cart: compare-and-set on the cached cart, then queue it"""
         cart_key = self._get_cart_key(cart.user_id)
-        redis_client.set_data(cart_key, cart.to_dict(), self.cache_ttl)
+        cart.version = redis_client.next_version(self.version_key)
+        written = 0
+        if previous_version is not None:
+            written = redis_client.update_versioned_hash(
+                cart_key,
+                self._cart_to_hash(changed),
+                [str(product_id) for product_id in removed] + [EMPTY_CART_FIELD],
+                previous_version, cart.version, self.cache_ttl
+            )
+        if written == 0:
+            # Not cached (a missing key counts as version 0) or a full write
+            written = redis_client.set_versioned_hash(
+                cart_key, self._cart_to_hash(cart.items), cart.version, previous_version, self.cache_ttl
+            )
+        if written != 1:
+            raise CartVersionConflictError(cart.user_id)
+        try:
+            redis_client.append_stream(self.changes_stream, {
+                'op': 'save',
+                'user_id': cart.user_id,
+                'version': cart.version,
+                'items': [item.to_record() for item in cart.items]
+            })
+        except redis.RedisError:
+            # Never queued for the database: the cached change must not outlive it
+            self._drop_cached_cart(cart_key)
+            raise
+        self._publish_cart_change(cart)
     
-    def _update_product_stats(self, product_id: str, quantity: int) -> None:
-        """Update product statistics in Redis"""
-        redis_client.increment_counter(self.product_stats_key, product_id, quantity)
+    def _drop_cached_cart(self, cart_key: str) -> None:
+        """Delete a cached cart now, or once Redis is back"""
+        local_cache.invalidate(cart_key)
+        try:
+            redis_client.delete_data(cart_key)
+        except redis.RedisError:
+            redis_client.defer_delete(cart_key)
     
-    def add_item(self, user_id: str, item_data: dict) -> Cart:
+    def _read_latest_cart(self, user_id: str) -> Cart:
+        """
+        The cart at its latest version, skipping the copies that may lag
+        behind it (in-process cache, replicas), e.g. after a version conflict
+        """
+        if self.write_behind:
+            # The cached cart is the latest copy, the database may not have it yet
+            fields = redis_client.get_master_hash(self._get_cart_key(user_id))
+            if fields:
+                return self._cart_from_hash(user_id, fields)
+            return self._load_cart_from_db(user_id) or Cart(user_id=user_id, items=[])
+        # Rows loaded earlier in the session would not be read again
+        db.session.expire_all()
+        return self._read_cart_from_db(user_id) or Cart(user_id=user_id, items=[])
+    
+    def _modify_cart(self, user_id: str, change: Callable[[Cart], Optional[CartChange]],
+                     expected_version: Optional[int] = None) -> Optional[Cart]:
+        """
+        Optimistic read-modify-write of a cart. change(cart) edits the cart in
+        place and returns a CartChange, or None to leave it alone (then None
+        is returned). The save is a compare-and-set on the version the cart
+        was read at: when another write got there first the change is made
+        again on the latest copy, up to CART_WRITE_RETRIES times. With
+        expected_version (If-Match) the cart must be at that version instead.
+        Both raise CartVersionConflictError; stats deltas are only recorded
+        once the change is saved.
+        """
         cart = self.get_cart(user_id)
-        new_item = CartItem(**item_data)
-        cart.add_item(new_item)
-        self.save_cart(cart)
+        if expected_version is not None and cart.version != expected_version:
+            # The cached copy may lag behind
+            cart = self._read_latest_cart(user_id)
+        for attempt in range(self.write_retries + 1):
+            if expected_version is not None and cart.version != expected_version:
+                raise CartVersionConflictError(user_id, cart.version)
+            previous_version, was_empty = cart.version, cart.line_count == 0
+            result = change(cart)
+            if result is None:
+                return None
+            changed, removed, deltas = result
+            try:
+                self._persist_cart(cart, previous_version, was_empty, changed, removed)
+            except CartVersionConflictError:
+                if attempt == self.write_retries:
+                    cart_write_conflicts.inc(result='failed')
+                    raise
+                cart_write_conflicts.inc(result='retried')
+                cart = self._read_latest_cart(user_id)
+                continue
+            self.product_stats.record(deltas)
+            return cart
+    
+    def _cart_upsert_statement(self, user_id: str, now: datetime, version: Optional[int] = None):
+        """
+        INSERT ... ON CONFLICT for the cart row, returning its id and version.
+        The row takes a new version, or the given one unless it already has
+        a newer version (then nothing is returned).
+        """
+        values = {'user_id': user_id, 'created_at': now, 'updated_at': now}
+        if version is not None:
+            values['version'] = version
+        stmt = insert(DBCart).values(**values)
+        return stmt.on_conflict_do_update(
+            index_elements=[DBCart.user_id],
+            # The excluded row already drew its version from the sequence default
+            set_={'updated_at': now, 'version': stmt.excluded.version},
+            where=DBCart.version < stmt.excluded.version if version is not None else None
+        ).returning(DBCart.id, DBCart.version)
+    
+    def _cart_version_update_statement(self, user_id: str, expected_version: int, now: datetime):
+        """UPDATE giving the cart row a new version only if it is still at expected_version"""
+        return (
+            update(DBCart)
+            .where(DBCart.user_id == user_id, DBCart.version == expected_version)
+            .values(version=CART_VERSION_SEQ.next_value(), updated_at=now)
+            .returning(DBCart.id, DBCart.version)
+        )
+    
+    def _cart_insert_statement(self, user_id: str, now: datetime):
+        """INSERT of a new cart row, returning nothing if the user already has one"""
+        return (
+            insert(DBCart)
+            .values(user_id=user_id, created_at=now, updated_at=now)
+            .on_conflict_do_nothing(index_elements=[DBCart.user_id])
+            .returning(DBCart.id, DBCart.version)
+        )
+    
+    def _cart_state_statement(self, user_id: str):
+        """Version of the cart row and whether it has items, locking the row"""
+        has_items = select(DBCartItem.id).where(DBCartItem.cart_id == DBCart.id).exists()
+        return select(DBCart.version, has_items).where(DBCart.user_id == user_id).with_for_update(of=DBCart)
+    
+    def _next_version_statement(self):
+        return select(CART_VERSION_SEQ.next_value())
+    
+    def _advance_versions_statement(self, version: int):
+        """Move the version sequence past a version assigned elsewhere (write-behind)"""
+        return text(
+            "SELECT setval('cart_version_seq', GREATEST(:version, last_value)) FROM cart_version_seq"
+        ).bindparams(version=version)
+    
+    def _items_upsert_statement(self, cart_id: int, items: List[CartItem], now: datetime):
+        """Single INSERT ... ON CONFLICT for every item"""
+        stmt = insert(DBCartItem).values([
+            {
+                'cart_id': cart_id,
+                'product_id': item.product_id,
+                'quantity': item.quantity,
+                'created_at': now,
+                'updated_at': now
+            } for item in items
+        ])
+        return stmt.on_conflict_do_update(
+            index_elements=[DBCartItem.cart_id, DBCartItem.product_id],
+            set_={
+                'quantity': stmt.excluded.quantity,
+                'updated_at': now
+            },
+            # Leave unchanged rows alone
+            where=DBCartItem.quantity != stmt.excluded.quantity
+        )
+    
+    def _items_prune_statement(self, cart_id: int, items: List[CartItem]):
+        """Bulk DELETE of the items that are no longer in the cart"""
+        return delete(DBCartItem).where(
+            DBCartItem.cart_id == cart_id,
+            DBCartItem.product_id.notin_([item.product_id for item in items])
+        )
+    
+    def _cart_delete_statements(self, user_id: str, version: Optional[int] = None) -> List[Any]:
+        """
+        DELETEs for a cart and its items that do not load them first. With a
+        version (a write-behind clear) only a cart at that version or older
+        is deleted.
+        """
+        if version is not None:
+            # The flusher is the only writer of the table in write-behind mode
+            stored = (DBCart.user_id == user_id, DBCart.version <= version)
+            cart_ids = select(DBCart.id).where(*stored).scalar_subquery()
+            return [
+                delete(DBCartItem).where(DBCartItem.cart_id.in_(cart_ids)),
+                delete(DBCart).where(*stored)
+            ]
+        cart_ids = select(DBCart.id).where(DBCart.user_id == user_id).scalar_subquery()
+        # Upserting the cart row first takes the same row lock as write_cart_to_db,
+        # even when the cart does not exist yet, so a concurrent clear and save
+        # serialize instead of deadlocking or racing on a newly created cart
+        lock_cart = (
+            insert(DBCart)
+            .values(user_id=user_id, created_at=func.now(), updated_at=func.now())
+            .on_conflict_do_update(index_elements=[DBCart.user_id], set_={'updated_at': func.now()})
+        )
+        return [
+            lock_cart,
+            delete(DBCartItem).where(DBCartItem.cart_id.in_(cart_ids)),
+            delete(DBCart).where(DBCart.user_id == user_id)
+        ]
+    
+    def write_cart_to_db(self, cart: Cart, expected_version: Optional[int] = None, was_empty: bool = False,
+                         assign_version: bool = True) -> bool:
+        """
+        Write cart to the database with set-based statements, so the number of
+        round trips does not depend on the number of items:
+        1. Upsert the cart row, giving it a new version, and get its id
+        2. Upsert every item in a single INSERT ... ON CONFLICT DO UPDATE
+        3. Delete the items that are no longer in the cart in one statement
+        The new version is set in cart.version. With expected_version step 1
+        is a compare-and-set, see _persist_cart. assign_version=False keeps
+        cart.version (write-behind, where Redis assigned it) and skips the
+        write if the database already has a newer version, returning False.
+        """
+        now = datetime.now(timezone.utc)
+        if not assign_version:
+            row = db.session.execute(self._cart_upsert_statement(cart.user_id, now, cart.version)).first()
+            if row is None:
+                return False
+        elif expected_version is None:
+            row = db.session.execute(self._cart_upsert_statement(cart.user_id, now)).one()
+        else:
+            # No row is ever at version 0, the version of a cart never saved
+            row = db.session.execute(
+                self._cart_version_update_statement(cart.user_id, expected_version, now)
+            ).first() if expected_version else None
+            if row is None and was_empty:
+                # An empty cart also matches a missing row (never saved, or cleared since)
+                row = db.session.execute(self._cart_insert_statement(cart.user_id, now)).first()
+            if row is None:
+                raise CartVersionConflictError(cart.user_id)
+        cart_id, cart.version = row
         
-        # Update product stats when adding items
-        self._update_product_stats(str(new_item.product_id), new_item.quantity)
+        if cart.items:
+            db.session.execute(self._items_upsert_statement(cart_id, cart.items, now))
         
-        return cart
+        # Remove items that are no longer in the cart (the caller commits)
+        db.session.execute(self._items_prune_statement(cart_id, cart.items))
+        return True
     
-    def remove_item(self, user_id: str, product_id: int) -> Cart:
-        cart = self.get_cart(user_id)
-        # Find the item to get its quantity before removing
-        for item in cart.items:
-            if item.product_id == product_id:
-                # Update product stats in the negative direction
-                self._update_product_stats(str(product_id), -item.quantity)
-                break
-                
-        cart.remove_item(product_id)
-        self.save_cart(cart)
-        return cart
+    def advance_versions(self, version: int) -> None:
+        """Keep the version sequence ahead of versions assigned in Redis (the caller commits)"""
+        db.session.execute(self._advance_versions_statement(version))
     
-    def update_quantity(self, user_id: str, product_id: int, quantity: int) -> Optional[Cart]:
-        cart = self.get_cart(user_id)
+    def sync_version_counter(self) -> None:
+        """Raise the write-behind version counter past every version in the database"""
+        last_version = db.session.execute(text('SELECT last_value FROM cart_version_seq')).scalar_one()
+        db.session.rollback()
+        redis_client.raise_version(self.version_key, last_version)
+    
+    def _add_change(self, product: Product, quantity: int) -> Callable[[Cart], CartChange]:
+        def change(cart: Cart) -> CartChange:
+            merged_item = cart.add_item(CartItem(
+                product_id=product.product_id,
+                quantity=quantity,
+                name=product.name,
+                price=product.price
+            ))
+            # Only the added (or merged) product field changes in the cache
+            return [merged_item], [], {str(product.product_id): quantity}
+        return change
+    
+    def _remove_change(self, product_id: int) -> Callable[[Cart], CartChange]:
+        def change(cart: Cart) -> CartChange:
+            removed_item = cart.remove_item(product_id)
+            # Update product stats in the negative direction
+            delta = -removed_item.quantity if removed_item is not None else 0
+            return [], [product_id], {str(product_id): delta}
+        return change
+    
+    def _update_change(self, product_id: int, quantity: int) -> Callable[[Cart], Optional[CartChange]]:
+        def change(cart: Cart) -> Optional[CartChange]:
+            item = cart.get_item(product_id)
+            if item is None:
+                return None
+            # Stats get the difference in quantity
+            delta = quantity - item.quantity
+            return [cart.update_quantity(product_id, quantity)], [], {str(product_id): delta}
+        return change
+    
+    def add_item(self, user_id: str, item_data: dict, expected_version: Optional[int] = None) -> Optional[Cart]:
+        """Add a catalog product to the cart, None if the product does not exist"""
+        product = self.catalog.get_product(item_data['product_id'])
+        if product is None:
+            return None
+        return self._modify_cart(user_id, self._add_change(product, item_data['quantity']), expected_version)
+    
+    def remove_item(self, user_id: str, product_id: int, expected_version: Optional[int] = None) -> Cart:
+        return self._modify_cart(user_id, self._remove_change(product_id), expected_version)
+    
+    def update_quantity(self, user_id: str, product_id: int, quantity: int,
+                        expected_version: Optional[int] = None) -> Optional[Cart]:
+        """Set the quantity of a product in the cart, None if it is not in the cart"""
+        return self._modify_cart(user_id, self._update_change(product_id, quantity), expected_version)
+    
+    def _apply_operations_to_cart(self, cart: Cart, operations: List[Dict[str, Any]],
+                                  products: Mapping[int, Product]) -> CartChange:
+        """
+        Apply add/update/remove operations in order to a loaded cart. Returns
+        the lines to write and the products to delete in the cache, and the
+        net stats delta per product. Raises CartOperationError at the first
+        operation that cannot be applied.
+        """
+        touched: Dict[int, None] = {}
+        deltas: Dict[str, int] = {}
+        for index, operation in enumerate(operations):
+            product_id = operation['product_id']
+            if operation['op'] == 'add':
+                product = products.get(product_id)
+                if product is None:
+                    raise CartOperationError(index, 'Producto no encontrado')
+                cart.add_item(CartItem(
+                    product_id=product_id,
+                    quantity=operation['quantity'],
+                    name=product.name,
+                    price=product.price
+                ))
+                delta = operation['quantity']
+            elif operation['op'] == 'update':
+                item = cart.get_item(product_id)
+                if item is None:
+                    raise CartOperationError(index, 'Producto no encontrado en el carrito')
+                delta = operation['quantity'] - item.quantity
+                cart.update_quantity(product_id, operation['quantity'])
+            else:
+                removed_item = cart.remove_item(product_id)
+                delta = -removed_item.quantity if removed_item is not None else 0
+            touched[product_id] = None
+            deltas[str(product_id)] = deltas.get(str(product_id), 0) + delta
         
-        # Find current quantity to calculate the difference
-        current_quantity = 0
-        for item in cart.items:
-            if item.product_id == product_id:
-                current_quantity = item.quantity
-                break
-                
-        if cart.update_quantity(product_id, quantity):
-            self.save_cart(cart)
-            
-            # Update product stats with the difference in quantity
-            quantity_difference = quantity - current_quantity
-            if quantity_difference != 0:
-                self._update_product_stats(str(product_id), quantity_difference)
-                
-            return cart
-        return None
+        changed = [cart.get_item(product_id) for product_id in touched if cart.get_item(product_id) is not None]
+        removed = [product_id for product_id in touched if cart.get_item(product_id) is None]
+        return changed, removed, {product_id: delta for product_id, delta in deltas.items() if delta}
     
-    def clear_cart(self, user_id: str) -> None:
-        # Clear from database
-        db_cart = DBCart.query.filter_by(user_id=user_id).first()
-        if db_cart:
-            db.session.delete(db_cart)
-            db.session.commit()
+    def apply_operations(self, user_id: str, operations: List[Dict[str, Any]],
+                         expected_version: Optional[int] = None) -> Cart:
+        """
+        Apply several add/update/remove operations to a cart at once: one load,
+        one transaction, one cache write and one batch of stats deltas.
+        All or nothing: raises CartOperationError, without changing anything,
+        if any operation cannot be applied.
+        """
+        products = self.catalog.get_products(
+            operation['product_id'] for operation in operations if operation['op'] == 'add'
+        )
+        return self._modify_cart(
+            user_id, lambda cart: self._apply_operations_to_cart(cart, operations, products), expected_version
+        )
+    
+    def clear_cart(self, user_id: str, expected_version: Optional[int] = None) -> int:
+        """
+        Empty a cart, returns the version of the clear. With expected_version
+        (If-Match) the cart must be at that version, or already empty;
+        CartVersionConflictError otherwise.
+        """
+        cart_key = self._get_cart_key(user_id)
+        if self.write_behind:
+            version = self._stage_clear(user_id, expected_version)
+        else:
+            if expected_version is not None:
+                state = db.session.execute(self._cart_state_statement(user_id)).first()
+                if state is not None and state[0] != expected_version and state[1]:
+                    db.session.rollback()
+                    raise CartVersionConflictError(user_id, state[0])
+            version = db.session.execute(self._next_version_statement()).scalar_one()
+            self.delete_cart_from_db(user_id)
+            with stage('db_commit'):
+                db.session.commit()
             
-        # Clear from cache
+            # Clear from cache: the next read knows the cart is empty
+            empty = self._empty_cart_mappings([user_id])
+            try:
+                if empty:
+                    redis_client.set_versioned_hash(cart_key, empty[cart_key], version, expiry=self.empty_cart_ttl)
+                else:
+                    redis_client.delete_data(cart_key)
+            except redis.RedisError as e:
+                self._skip_cache_write(cart_key, e)
+                return version
+        local_cache.publish_invalidation(redis_client, self.invalidation_channel, cart_key)
+        self.cart_filter.record_removal()
+        return version
+    
+    def _stage_clear(self, user_id: str, expected_version: Optional[int]) -> int:
+        """Write-behind clear: compare-and-set of the empty marker on the cached cart, then queue it"""
         cart_key = self._get_cart_key(user_id)
-        redis_client.delete_data(cart_key)
-        
-    def get_top_products(self, count: int = 10) -> List[Dict[str, Any]]:
-        """Get top products by purchase frequency"""
-        return redis_client.get_top_values(self.product_stats_key, count)
\ No newline at end of file
+        current_version = None
+        if expected_version is not None:
+            latest = self._read_latest_cart(user_id)
+            if latest.version != expected_version and latest.line_count:
+                raise CartVersionConflictError(user_id, latest.version)
+            current_version = latest.version
+        version = redis_client.next_version(self.version_key)
+        # The marker is the latest copy of the cart until the flusher deletes it
+        # from the database, so it is written even with CACHE_EMPTY_TTL 0
+        written = redis_client.set_versioned_hash(
+            cart_key, {EMPTY_CART_FIELD: 1}, version, current_version, self.empty_cart_ttl or self.cache_ttl
+        )
+        if written != 1:
+            raise CartVersionConflictError(user_id)
+        try:
+            redis_client.append_stream(self.changes_stream, {'op': 'clear', 'user_id': user_id, 'version': version})
+        except redis.RedisError:
+            self._drop_cached_cart(cart_key)
+            raise
+        return version
+    
+    def delete_cart_from_db(self, user_id: str, version: Optional[int] = None) -> None:
+        """
+        Delete a cart and its items without loading them, with a version only
+        if the stored cart is not newer (the caller commits)
+        """
+        for stmt in self._cart_delete_statements(user_id, version):
+            db.session.execute(stmt)
+    
+    def get_top_products(self, count: int = 10, offset: int = 0, window: str = 'all') -> List[Dict[str, Any]]:
+        """Get top products by purchase frequency over a window of STATS_WINDOWS"""
+        if window == 'all':
+            return redis_client.get_top_values(self.product_stats.key, count, offset)
+        return redis_client.get_top_union(
+            self.product_stats.window_key(window),
+            self.product_stats.window_sources(window, datetime.now(timezone.utc)),
+            self.product_stats.window_cache_ttl, count, offset
+        )
+
+    def get_local_cache_stats(self) -> Dict[str, Any]:
+        """Get hit, miss and eviction counters of the in-process cache"""
+        return local_cache.get_stats()
+
+    def get_replica_stats(self) -> List[Dict[str, Any]]:
+        """Get health, latency and lag of every Redis replica"""
+        return redis_client.get_replica_stats()
+
+    def get_cart_filter_stats(self) -> Dict[str, Any]:
+        """Get the state of the Bloom filter of users with a cart"""
+        return self.cart_filter.get_stats()
+
+    def get_write_behind_stats(self) -> Dict[str, Any]:
+        """Get the backlog of cart changes still waiting to reach the database"""
+        stats = redis_client.get_stream_lag(self.changes_stream, Config.CART_FLUSHER_GROUP)
+        stats['mode'] = Config.PERSISTENCE_MODE
+        return stats
\ No newline at end of file
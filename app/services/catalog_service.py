@@ -0,0 +1,191 @@
+from app.models.cart import Product, CartItem
+from app.models.database import db, DBProduct
+from app.cache.redis_client import redis_client
+from app.cache.local_cache import local_cache
+from app.config import Config
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Optional, Dict, List, Any, Iterable, Mapping
+import logging
+import redis
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock taken by catalog writers, so versions commit in increasing order
+CATALOG_LOCK_ID = 0x63617461
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Immutable view of the catalog as of a version"""
+    version: int
+    products: Mapping[int, Product]
+
+class CatalogService:
+    """
+    Product names and prices, kept in an immutable in-memory snapshot that
+    carts are joined with at read time. Every catalog change gets a version
+    from a PostgreSQL sequence and raises the Redis version key. Each process
+    checks the key at most every CATALOG_REFRESH_INTERVAL seconds and, when
+    it moved, loads only the products with a newer version and swaps in a new
+    snapshot, so readers never see a half-applied change.
+    """
+
+    def __init__(self):
+        self.version_key = Config.CATALOG_VERSION_KEY
+        self.refresh_interval = Config.CATALOG_REFRESH_INTERVAL
+        self.snapshot = CatalogSnapshot(version=0, products=MappingProxyType({}))
+        self._checked_at: Optional[float] = None
+        self._refresh_lock = threading.Lock()
+
+    def _refresh_due(self) -> bool:
+        return self._checked_at is None or time.monotonic() - self._checked_at >= self.refresh_interval
+
+    def _changes_statement(self, since_version: int):
+        """Products changed after the given catalog version"""
+        return select(DBProduct.id, DBProduct.name, DBProduct.price, DBProduct.version).where(
+            DBProduct.version > since_version
+        )
+
+    def _lock_statement(self):
+        """Serialize catalog writers until the end of the transaction"""
+        return select(func.pg_advisory_xact_lock(CATALOG_LOCK_ID))
+
+    def _upsert_statement(self, products: List[Product], now: datetime):
+        """INSERT ... ON CONFLICT for the products, each one taking a new version"""
+        stmt = insert(DBProduct).values([
+            {'id': product.product_id, 'name': product.name, 'price': product.price, 'updated_at': now}
+            for product in products
+        ])
+        return stmt.on_conflict_do_update(
+            index_elements=[DBProduct.id],
+            set_={
+                'name': stmt.excluded.name,
+                'price': stmt.excluded.price,
+                # The excluded row already drew its version from the sequence default
+                'version': stmt.excluded.version,
+                'updated_at': now
+            }
+        ).returning(DBProduct.version)
+
+    def _skip_remote_check(self, remote_version: Optional[int]) -> bool:
+        """Whether the version key shows nothing newer than the snapshot"""
+        # Without the key (Redis flushed or down) fall back to asking the database
+        return remote_version is not None and remote_version <= self.snapshot.version
+
+    def _apply_changes(self, rows: Iterable[Any]) -> CatalogSnapshot:
+        """Swap in a new snapshot with the changed products"""
+        rows = list(rows)
+        if not rows:
+            return self.snapshot
+        products = dict(self.snapshot.products)
+        for row in rows:
+            products[row.id] = Product(product_id=row.id, name=row.name, price=row.price)
+        self.snapshot = CatalogSnapshot(
+            version=max(self.snapshot.version, max(row.version for row in rows)),
+            products=MappingProxyType(products)
+        )
+        # Cached response bodies carry the previous names and prices
+        local_cache.clear()
+        logger.info(f"Catalog snapshot at version {self.snapshot.version}: {len(rows)} products changed")
+        return self.snapshot
+
+    def refresh(self, force: bool = False) -> CatalogSnapshot:
+        """
+        Current snapshot, first loading the products that changed since it if
+        the refresh interval elapsed and the version key moved (or always
+        with force). A refresh already running in another thread is not waited
+        for unless forced.
+        """
+        if not force and not self._refresh_due():
+            return self.snapshot
+        if not self._refresh_lock.acquire(blocking=force):
+            return self.snapshot
+        try:
+            self._checked_at = time.monotonic()
+            if not force:
+                try:
+                    remote_version = redis_client.get_version(self.version_key)
+                except redis.RedisError:
+                    remote_version = None
+                if self._skip_remote_check(remote_version):
+                    return self.snapshot
+            return self._apply_changes(db.session.execute(self._changes_statement(self.snapshot.version)))
+        finally:
+            self._refresh_lock.release()
+
+    def get_products(self, product_ids: Iterable[int]) -> Mapping[int, Product]:
+        """Products of the snapshot, refreshed first if any of the ids is unknown"""
+        snapshot = self.refresh()
+        if any(product_id not in snapshot.products for product_id in product_ids):
+            # Possibly created after the last refresh
+            snapshot = self.refresh(force=True)
+        return snapshot.products
+
+    def get_product(self, product_id: int) -> Optional[Product]:
+        return self.get_products([product_id]).get(product_id)
+
+    def list_products(self) -> List[Product]:
+        """Every product, ordered by id"""
+        products = self.refresh().products
+        return [products[product_id] for product_id in sorted(products)]
+
+    def join_items(self, quantities: Dict[int, int]) -> List[CartItem]:
+        """Cart items with the current name and price of each product"""
+        products = self.get_products(quantities)
+        items = []
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            if product is None:
+                items.append(CartItem(product_id=product_id, quantity=quantity))
+            else:
+                items.append(CartItem(product_id=product_id, quantity=quantity, name=product.name, price=product.price))
+        return items
+
+    def join_item_dicts(self, quantities: Dict[int, int]) -> List[Dict[str, Any]]:
+        """Same as join_items, as the dicts of a response body"""
+        products = self.get_products(quantities)
+        items = []
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            items.append({
+                'product_id': product_id,
+                'name': product.name if product is not None else None,
+                'price': product.price if product is not None else None,
+                'quantity': quantity
+            })
+        return items
+
+    def save_products(self, products: List[Product]) -> int:
+        """
+        Create or update products in one transaction and publish the new
+        catalog version. Carts are not touched: they pick up the new name
+        and price on their next read. Returns the new version.
+        """
+        now = datetime.now(timezone.utc)
+        db.session.execute(self._lock_statement())
+        version = max(db.session.execute(self._upsert_statement(products, now)).scalars())
+        db.session.commit()
+        self._publish_version(version)
+        self.refresh(force=True)
+        return version
+
+    def _publish_version(self, version: int) -> None:
+        try:
+            redis_client.raise_version(self.version_key, version)
+        except redis.RedisError as e:
+            # The products are committed: other processes see them once Redis is back
+            logger.warning(f"Catalog version {version} deferred: {e}")
+            redis_client.defer_raise_version(self.version_key, version)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Version and size of this process's snapshot"""
+        snapshot = self.snapshot
+        return {'version': snapshot.version, 'products': len(snapshot.products)}
+
+# Global catalog instance
+catalog = CatalogService()
@@ -0,0 +1,146 @@
+from app.cache.redis_client import redis_client
+from app.config import Config
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, List, Any, Tuple
+import atexit
+import logging
+import redis
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Windows answered by /stats/top-products: bucket size and number of buckets
+# covered by each sliding window ('all' reads the all-time sorted set)
+STATS_WINDOWS = {
+    'hour': ('hour', 1),
+    'day': ('hour', 24),
+    'week': ('day', 7),
+    'all': None
+}
+
+def hour_bucket_key(moment: datetime) -> str:
+    return f"{Config.PRODUCT_STATS_KEY}:hour:{moment:%Y%m%d%H}"
+
+def day_bucket_key(moment: datetime) -> str:
+    return f"{Config.PRODUCT_STATS_KEY}:day:{moment:%Y%m%d}"
+
+class ProductStats:
+    """
+    Top-product counters, buffered per process. Cart changes only add their
+    quantity deltas to an in-memory dict; a daemon thread flushes it every
+    STATS_FLUSH_INTERVAL seconds (or as soon as STATS_FLUSH_MAX_PRODUCTS
+    products are pending) with a single pipeline that increments the
+    all-time sorted set plus the current hour and day buckets (UTC). The
+    day bucket is the rollup of its hours, so windows of any length read a
+    handful of keys.
+    """
+
+    def __init__(self, flush_interval: float, max_pending: int):
+        self.key = Config.PRODUCT_STATS_KEY
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.hour_ttl = Config.STATS_HOUR_BUCKET_TTL
+        self.day_ttl = Config.STATS_DAY_BUCKET_TTL
+        self.window_cache_ttl = Config.STATS_WINDOW_CACHE_TTL
+        self._pending: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.flushed_products = 0
+        self.failed_flushes = 0
+
+    def record(self, deltas: Dict[Any, int]) -> None:
+        """Add quantity deltas by product id to the buffer"""
+        with self._lock:
+            for product_id, amount in deltas.items():
+                if amount:
+                    member = str(product_id)
+                    self._pending[member] = self._pending.get(member, 0) + amount
+            full = len(self._pending) >= self.max_pending
+        if self._thread is None or self.flush_interval <= 0:
+            # Not buffering (or no flusher thread in this process): write through
+            self.flush()
+        elif full:
+            self._wake.set()
+
+    def bucket_keys(self, now: datetime) -> Dict[str, Optional[int]]:
+        """Sorted sets a flush increments, with the expiry of each one"""
+        return {self.key: None, hour_bucket_key(now): self.hour_ttl, day_bucket_key(now): self.day_ttl}
+
+    def flush(self) -> int:
+        """Write the pending deltas in one pipeline, returns how many products were written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            pending = {member: amount for member, amount in pending.items() if amount}
+            if not pending:
+                return 0
+            try:
+                redis_client.increment_scores(self.bucket_keys(datetime.now(timezone.utc)), pending)
+            except redis.RedisError as e:
+                # Keep the deltas for the next flush
+                with self._lock:
+                    for member, amount in pending.items():
+                        self._pending[member] = self._pending.get(member, 0) + amount
+                self.failed_flushes += 1
+                logger.warning(f"Product stats flush failed, {len(pending)} products kept: {e}")
+                return 0
+            self.flushes += 1
+            self.flushed_products += len(pending)
+            return len(pending)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self) -> None:
+        """Flush the buffer in a daemon thread, and a last time at exit"""
+        if self.flush_interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='product-stats-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def window_key(self, window: str) -> str:
+        """Short-lived sorted set caching the merged buckets of a window"""
+        return f"{self.key}:window:{window}"
+
+    def window_sources(self, window: str, now: datetime) -> List[Tuple[str, float]]:
+        """
+        Buckets covering the sliding window that ends now, with their weight:
+        whole buckets count once and the oldest one, which only partly
+        overlaps the window, in proportion to the overlap
+        """
+        unit, count = STATS_WINDOWS[window]
+        if unit == 'hour':
+            step, bucket_key = timedelta(hours=1), hour_bucket_key
+            bucket_start = now.replace(minute=0, second=0, microsecond=0)
+        else:
+            step, bucket_key = timedelta(days=1), day_bucket_key
+            bucket_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        sources = [(bucket_key(now - i * step), 1.0) for i in range(count)]
+        overlap = 1 - (now - bucket_start) / step
+        if overlap > 0:
+            sources.append((bucket_key(now - count * step), round(overlap, 4)))
+        return sources
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Buffer size and flush counters of this process"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pending_products': pending,
+            'flushes': self.flushes,
+            'flushed_products': self.flushed_products,
+            'failed_flushes': self.failed_flushes
+        }
+
+# Global product stats instance
+product_stats = ProductStats(
+    flush_interval=Config.STATS_FLUSH_INTERVAL,
+    max_pending=Config.STATS_FLUSH_MAX_PRODUCTS
+)
@@ -0,0 +1,7 @@
+from app import create_asgi_app
+
+# Serve with an ASGI server, e.g. `hypercorn asgi:app --bind 0.0.0.0:5000`
+app = create_asgi_app()
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,48 @@
+# Production server: `gunicorn -c gunicorn.conf.py`
+# The app is loaded once in the master and forked into the workers, so each
+# worker must open its own connections and start its own threads (post_fork).
+from app.config import Config
+import multiprocessing
+import tempfile
+
+wsgi_app = 'wsgi:app'
+bind = Config.SERVER_BIND
+workers = Config.SERVER_WORKERS or multiprocessing.cpu_count() * 2 + 1
+worker_class = 'gthread'
+threads = Config.SERVER_THREADS
+timeout = Config.SERVER_TIMEOUT
+keepalive = Config.SERVER_KEEPALIVE
+preload_app = True
+
+# Each worker has its own metrics: they meet in this directory, so a scrape
+# of any worker reports all of them. Set before the app is preloaded, the
+# workers inherit it.
+if not Config.METRICS_MULTIPROC_DIR:
+    Config.METRICS_MULTIPROC_DIR = tempfile.mkdtemp(prefix='cart-metrics-')
+
+def on_starting(server):
+    from app.metrics import reset_shared_metrics
+    reset_shared_metrics(Config.METRICS_MULTIPROC_DIR)
+
+def post_fork(server, worker):
+    from wsgi import app
+    from app import init_worker
+    init_worker(app)
+    # Warm the cache once per server start, from its first worker: a thread
+    # started in the master before forking would only run in the master,
+    # with connections the workers then inherit
+    if Config.CACHE_WARM_ON_STARTUP and worker.age == 1:
+        from app.services.cache_warmer import start_background_warming
+        start_background_warming(app)
+
+def worker_exit(server, worker):
+    # Do not lose the stats deltas still buffered in this worker, nor its last metrics
+    from app.services.product_stats import product_stats
+    from app.metrics import metrics
+    product_stats.flush()
+    metrics.write_snapshot()
+
+def child_exit(server, worker):
+    # Its gauges are gone with it; its counters stay in the totals
+    from app.metrics import mark_process_dead
+    mark_process_dead(Config.METRICS_MULTIPROC_DIR, worker.pid)
@@ -1,6 +1,8 @@
 from app import create_app
+from app.config import Config
 
 app = create_app()
 
+# Development server; in production use `gunicorn -c gunicorn.conf.py`
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', debug=Config.DEV_SERVER_DEBUG)
\ No newline at end of file
@@ -0,0 +1,42 @@
+from app import create_app
+from app.services.cart_archiver import CartArchiver
+from app.config import Config
+from datetime import datetime, timezone
+import argparse
+
+def archive_carts():
+    parser = argparse.ArgumentParser(
+        description='Archiva en cart_archive los carritos abandonados y los borra de PostgreSQL y Redis'
+    )
+    parser.add_argument('--days', type=float, default=Config.CART_ARCHIVE_AFTER_DAYS,
+                        help='Carritos sin actualizar en los últimos N días')
+    parser.add_argument('--batch-size', type=int, default=Config.CART_ARCHIVE_BATCH_SIZE,
+                        help='Carritos por transacción')
+    parser.add_argument('--max-batches', type=int, default=0,
+                        help='Máximo de lotes (0 = hasta que no quede ninguno)')
+    parser.add_argument('--retention-months', type=int, default=Config.CART_ARCHIVE_RETENTION_MONTHS,
+                        help='Borrar las particiones del archivo de hace más de N meses (0 = conservarlas)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Solo contar los carritos abandonados')
+    args = parser.parse_args()
+    
+    app = create_app(start_workers=False)
+    with app.app_context():
+        archiver = CartArchiver(
+            after_days=args.days,
+            batch_size=args.batch_size,
+            max_batches=args.max_batches,
+            retention_months=args.retention_months
+        )
+        if args.dry_run:
+            count = archiver.count_abandoned(datetime.now(timezone.utc).replace(tzinfo=None))
+            print(f"✅ {count} carts not updated in the last {args.days} days")
+            return
+        stats = archiver.run_once()
+        print(
+            f"✅ Archived {stats['archived']} carts in {stats['batches']} batches, "
+            f"dropped {stats['dropped_partitions']} archive partitions in {stats['seconds']}s"
+        )
+
+if __name__ == '__main__':
+    archive_carts()
@@ -0,0 +1,169 @@
+from app import create_app
+from app.models.cart import CartItem
+from app.models.database import db
+from app.cache.redis_client import redis_client
+from app.services.cart_service import CartService
+from app.services.catalog_service import catalog
+from app.services.cart_filter import cart_filter
+from scripts.seed_data import build_catalog
+from scripts.workload import ZipfSampler
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Tuple
+import argparse
+import csv
+import io
+import random
+import time
+
+class DatasetGenerator:
+    """
+    Reproducible synthetic carts: the same seed always produces the same
+    users, items and quantities. Cart users are user1..userN, as in
+    scripts/workload.py, so user1 is also the hottest user of the benchmark.
+    Products are drawn with a Zipf distribution (product 1 is the most
+    popular) and cart sizes vary around items / users.
+    """
+
+    def __init__(self, users: int, items: int, products: int, zipf_s: float, days: float, seed: int):
+        self.users = users
+        self.products = products
+        self.mean_lines = items / users if users else 0
+        self.days = days
+        self.rng = random.Random(seed)
+        self.product_sampler = ZipfSampler(products, zipf_s, self.rng)
+        # Timestamps are offsets from the start of the run, so only they change between runs
+        self.now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def _line_count(self) -> int:
+        # Uniform between 1 and 2 * mean - 1, so the mean stays items / users
+        return min(round(self.rng.uniform(1, 2 * self.mean_lines - 1)), self.products)
+
+    def _product_ids(self, count: int) -> List[int]:
+        """count distinct products, Zipf-distributed"""
+        if count > self.products // 2:
+            return self.rng.sample(range(1, self.products + 1), count)
+        chosen = {}
+        while len(chosen) < count:
+            chosen.setdefault(self.product_sampler.sample(), None)
+        return list(chosen)
+
+    def carts(self, first: int, last: int) -> Iterable[Tuple[int, str, datetime, datetime, List[CartItem]]]:
+        """(cart id, user id, created_at, updated_at, items) of carts first..last"""
+        for cart_id in range(first, last + 1):
+            updated_at = self.now - timedelta(days=self.rng.random() * self.days)
+            created_at = updated_at - timedelta(days=self.rng.random() * self.days)
+            items = [
+                CartItem(product_id=product_id, quantity=self.rng.randint(1, 5))
+                for product_id in self._product_ids(self._line_count())
+            ]
+            yield cart_id, f"user{cart_id}", created_at, updated_at, items
+
+def copy_rows(cursor, table: str, columns: Tuple[str, ...], rows: Iterable[Tuple]) -> None:
+    """Send rows with COPY ... FROM STDIN in CSV format"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def generate_data():
+    parser = argparse.ArgumentParser(
+        description='Genera un conjunto de datos sintético de gran tamaño con COPY (reemplaza catálogo y carritos)'
+    )
+    parser.add_argument('--users', type=int, default=100000,
+                        help='Usuarios con carrito (user1..userN)')
+    parser.add_argument('--items', type=int, default=500000,
+                        help='Ítems en total (aproximado; el tamaño de cada carrito varía alrededor de items / users)')
+    parser.add_argument('--products', type=int, default=10000,
+                        help='Tamaño del catálogo')
+    parser.add_argument('--zipf-s', type=float, default=1.1,
+                        help='Sesgo de la distribución Zipf de los productos (0 = uniforme)')
+    parser.add_argument('--days', type=float, default=30,
+                        help='Los carritos se actualizaron en los últimos N días')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Semilla; la misma semilla genera los mismos datos')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='Carritos por COPY y por pipeline')
+    parser.add_argument('--redis', action='store_true',
+                        help='Precargar también los carritos en Redis')
+    parser.add_argument('--redis-max-carts', type=int, default=0,
+                        help='Precargar solo los N usuarios más activos (0 = todos)')
+    parser.add_argument('--ttl', type=int, default=None,
+                        help='TTL de los carritos precargados en segundos (por defecto CACHE_TTL)')
+    args = parser.parse_args()
+
+    if args.users < 0 or args.items < args.users or args.products < 1:
+        parser.error('Se requiere --products >= 1 y --items >= --users >= 0')
+
+    app = create_app(start_workers=False)
+    with app.app_context():
+        started = time.monotonic()
+        cart_service = CartService()
+        generator = DatasetGenerator(args.users, args.items, args.products, args.zipf_s, args.days, args.seed)
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            # Bulk statements run for longer than a request may
+            cursor.execute('SET LOCAL statement_timeout = 0')
+            cursor.execute('TRUNCATE cart_items, carts, products RESTART IDENTITY')
+
+            # Products first, the items reference them; each row takes a catalog version
+            copy_rows(cursor, 'products', ('id', 'name', 'price', 'updated_at'), (
+                (product.product_id, product.name, product.price, generator.now)
+                for product in build_catalog(args.products)
+            ))
+            cursor.execute('SELECT max(version) FROM products')
+            catalog_version = cursor.fetchone()[0]
+
+            # Versions continue after every version handed out so far, so
+            # the generated carts replace older cached entries
+            cursor.execute('SELECT last_value FROM cart_version_seq')
+            base_version = cursor.fetchone()[0]
+            if cart_service.write_behind:
+                base_version = max(base_version, redis_client.get_version(cart_service.version_key) or 0)
+
+            items_written = 0
+            cached = 0
+            for first in range(1, args.users + 1, args.chunk_size):
+                last = min(first + args.chunk_size - 1, args.users)
+                carts = list(generator.carts(first, last))
+                copy_rows(cursor, 'carts', ('id', 'user_id', 'version', 'created_at', 'updated_at'), (
+                    (cart_id, user_id, base_version + cart_id, created_at, updated_at)
+                    for cart_id, user_id, created_at, updated_at, _ in carts
+                ))
+                copy_rows(cursor, 'cart_items', ('cart_id', 'product_id', 'quantity', 'created_at', 'updated_at'), (
+                    (cart_id, item.product_id, item.quantity, created_at, updated_at)
+                    for cart_id, _, created_at, updated_at, items in carts
+                    for item in items
+                ))
+                items_written += sum(len(items) for *_, items in carts)
+
+                if args.redis:
+                    mappings = {
+                        cart_service._get_cart_key(user_id): (base_version + cart_id, cart_service._cart_to_hash(items))
+                        for cart_id, user_id, _, _, items in carts
+                        if not args.redis_max_carts or cart_id <= args.redis_max_carts
+                    }
+                    cached += len(redis_client.set_versioned_hashes(mappings, args.ttl or cart_service.cache_ttl))
+                print(f"  {last} carts, {items_written} items ({last / (time.monotonic() - started):.0f} carts/s)")
+
+            if args.users:
+                cursor.execute("SELECT setval(pg_get_serial_sequence('carts', 'id'), %s)", (args.users,))
+                cursor.execute('SELECT setval(%s, %s)', ('cart_version_seq', base_version + args.users))
+            connection.commit()
+        finally:
+            connection.close()
+
+        # Other processes reload the catalog on their next version check
+        redis_client.raise_version(catalog.version_key, catalog_version)
+        if cart_service.write_behind:
+            cart_service.sync_version_counter()
+        # The carts were replaced behind the filter's back
+        if cart_filter.enabled:
+            cart_filter.rebuild(chunk_size=args.chunk_size)
+        print(
+            f"✅ Generated {args.products} products, {args.users} carts and {items_written} items "
+            f"(seed {args.seed}), {cached} carts cached in Redis, in {time.monotonic() - started:.1f}s"
+        )
+
+if __name__ == '__main__':
+    generate_data()
@@ -0,0 +1,27 @@
+from app import create_app
+from app.models.database import db, migrate_schema, pending_migrations
+import argparse
+
+def run_migrations():
+    parser = argparse.ArgumentParser(
+        description='Migra las tablas creadas por versiones anteriores (fusiona carritos y líneas duplicados, '
+                    'crea los índices únicos y mueve nombres y precios a products)'
+    )
+    parser.add_argument('--check', action='store_true',
+                        help='Solo listar las migraciones pendientes, sin modificar nada')
+    args = parser.parse_args()
+
+    app = create_app(start_workers=False, require_schema=False)
+    with app.app_context():
+        if args.check:
+            pending = pending_migrations(db.session.connection())
+            db.session.rollback()
+            for name in pending:
+                print(f"  pending: {name}")
+            print(f"✅ {len(pending)} schema migrations pending")
+            return
+        applied = migrate_schema()
+        print(f"✅ Schema up to date ({len(applied)} migrations applied)")
+
+if __name__ == '__main__':
+    run_migrations()
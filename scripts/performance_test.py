@@ -1,88 +1,220 @@
+import argparse
+import json
+import logging
 import requests
+import sys
+import threading
 import time
-import statistics
-import matplotlib.pyplot as plt
-from app import create_app
-from app.cache.redis_client import redis_client
-
-def measure_response_time(url, runs=50):
-    """Measure the response time for a given URL over multiple runs"""
-    response_times = []
-    
-    for i in range(runs):
-        start_time = time.time()
-        response = requests.get(url)
-        end_time = time.time()
-        
-        # Ensure the request was successful
-        if response.status_code == 200:
-            response_time = (end_time - start_time) * 1000  # Convert to milliseconds
-            response_times.append(response_time)
-        else:
-            print(f"Request failed with status code {response.status_code}")
-    
-    return response_times
-
-def clear_cache():
-    """Clear Redis cache for all test users"""
-    for i in range(1, 21):
-        redis_client.delete_data(f"cart:user{i}")
-
-def run_performance_test():
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Callable, Optional
+from scripts.workload import DEFAULT_MIX, Workload, parse_mix, percentile
+
+PERCENTILES = {'p50': 0.50, 'p95': 0.95, 'p99': 0.99, 'p999': 0.999}
+
+def http_sender(base_url: str) -> Callable[[], Callable]:
+    """Factory of per-thread senders that hit a running server over HTTP"""
+    def make_sender():
+        session = requests.Session()
+
+        def send(method: str, path: str, body: Optional[Dict[str, Any]]) -> int:
+            return session.request(method, base_url + path, json=body, timeout=30).status_code
+        return send
+    return make_sender
+
+def in_process_sender(database_uri: Optional[str]) -> Callable[[], Callable]:
+    """Factory of per-thread senders that call the Flask app in this process"""
+    from app.config import Config
+    if database_uri:
+        Config.SQLALCHEMY_DATABASE_URI = database_uri
+    from app import create_app
     app = create_app()
-    base_url = "http://localhost:5000"
-    
-    with app.app_context():
-        # Test parameters
-        test_user = "user5"  # Select one of the test users
-        cart_url = f"{base_url}/cart/{test_user}"
-        runs = 50
-        
-        print("Running performance tests...")
-        print("=" * 50)
-        
-        # Test 1: First request (no cache)
-        print("Test 1: First request (no cache)")
-        clear_cache()  # Ensure cache is empty
-        cold_times = measure_response_time(cart_url, 1)
-        print(f"Cold response time: {cold_times[0]:.2f}ms")
-        
-        # Test 2: Subsequent requests (with cache)
-        print("\nTest 2: Subsequent requests (with cache)")
-        cached_times = measure_response_time(cart_url, runs)
-        avg_cached = statistics.mean(cached_times)
-        min_cached = min(cached_times)
-        max_cached = max(cached_times)
-        print(f"Average cached response time: {avg_cached:.2f}ms")
-        print(f"Min cached response time: {min_cached:.2f}ms")
-        print(f"Max cached response time: {max_cached:.2f}ms")
-        
-        # Test 3: Requests without cache
-        print("\nTest 3: Requests without cache (clearing cache before each request)")
-        uncached_times = []
-        for i in range(runs):
-            clear_cache()
-            times = measure_response_time(cart_url, 1)
-            uncached_times.extend(times)
-        
-        avg_uncached = statistics.mean(uncached_times)
-        min_uncached = min(uncached_times)
-        max_uncached = max(uncached_times)
-        print(f"Average uncached response time: {avg_uncached:.2f}ms")
-        print(f"Min uncached response time: {min_uncached:.2f}ms")
-        print(f"Max uncached response time: {max_uncached:.2f}ms")
-        
-        # Calculate improvement
-        improvement = ((avg_uncached - avg_cached) / avg_uncached) * 100
-        print(f"\nCache performance improvement: {improvement:.2f}%")
-        
-        # Plot results
-        plt.figure(figsize=(10, 6))
-        plt.boxplot([cached_times, uncached_times], labels=['Cached', 'Uncached'])
-        plt.title('Response Time Comparison: Cached vs. Uncached')
-        plt.ylabel('Response Time (ms)')
-        plt.savefig('performance_comparison.png')
-        print("\nPerformance comparison chart saved to 'performance_comparison.png'")
+    # Per-request INFO logs would dominate the measurements
+    logging.getLogger().setLevel(logging.WARNING)
+
+    def make_sender():
+        client = app.test_client()
+
+        def send(method: str, path: str, body: Optional[Dict[str, Any]]) -> int:
+            return client.open(path, method=method, json=body).status_code
+        return send
+    return make_sender
+
+class Recorder:
+    """Latency samples and status counts per operation, shared by the workers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, operation: str, elapsed_ms: float, status: str, error: bool) -> None:
+        with self._lock:
+            self.latencies[operation].append(elapsed_ms)
+            self.statuses[operation][status] += 1
+            if error:
+                self.errors[operation] += 1
+
+def run_worker(worker_id: int, args, make_sender, recorder: Optional[Recorder], deadline: float) -> None:
+    """Send requests back to back until the deadline (closed-loop client)"""
+    send = make_sender()
+    seed = None if args.seed is None else args.seed + worker_id
+    workload = Workload(args.users, args.products, args.zipf_s, args.mix, seed)
+    while time.monotonic() < deadline:
+        operation, method, path, body = workload.next_request()
+        start = time.perf_counter()
+        try:
+            status = send(method, path, body)
+            error = status >= 500
+            status = str(status)
+        except Exception as e:
+            status, error = type(e).__name__, True
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if recorder is not None:
+            recorder.record(operation, elapsed_ms, status, error)
+
+def run_phase(args, make_sender, seconds: float, recorder: Optional[Recorder]) -> float:
+    """Run every worker for the given time and return the measured wall time"""
+    start = time.monotonic()
+    deadline = start + seconds
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [
+            executor.submit(run_worker, worker_id, args, make_sender, recorder, deadline)
+            for worker_id in range(args.concurrency)
+        ]
+        for future in futures:
+            future.result()
+    return time.monotonic() - start
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    """Throughput and latency distribution of a set of samples"""
+    ordered = sorted(latencies)
+    summary = {
+        'requests': len(ordered),
+        'errors': errors,
+        'rps': round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {name: round(percentile(ordered, fraction), 3) for name, fraction in PERCENTILES.items()}
+    }
+    summary['latency_ms']['mean'] = round(sum(ordered) / len(ordered), 3) if ordered else 0.0
+    summary['latency_ms']['max'] = round(ordered[-1], 3) if ordered else 0.0
+    return summary
+
+def build_results(args, recorder: Recorder, elapsed: float) -> Dict[str, Any]:
+    every_latency = [value for values in recorder.latencies.values() for value in values]
+    results = {
+        'config': {
+            'target': args.base_url or 'in-process',
+            'concurrency': args.concurrency,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'users': args.users,
+            'products': args.products,
+            'zipf_s': args.zipf_s,
+            'mix': args.mix,
+            'seed': args.seed
+        },
+        'elapsed_s': round(elapsed, 3),
+        'total': summarize(every_latency, sum(recorder.errors.values()), elapsed),
+        'operations': {}
+    }
+    for operation in sorted(recorder.latencies):
+        summary = summarize(recorder.latencies[operation], recorder.errors[operation], elapsed)
+        summary['statuses'] = dict(recorder.statuses[operation])
+        results['operations'][operation] = summary
+    return results
+
+def print_results(results: Dict[str, Any]) -> None:
+    header = f"{'operation':<14}{'requests':>10}{'errors':>8}{'rps':>10}" + ''.join(f"{name:>10}" for name in PERCENTILES)
+    print(header)
+    print('-' * len(header))
+    rows = list(results['operations'].items()) + [('TOTAL', results['total'])]
+    for operation, summary in rows:
+        latency = summary['latency_ms']
+        print(
+            f"{operation:<14}{summary['requests']:>10}{summary['errors']:>8}{summary['rps']:>10.1f}"
+            + ''.join(f"{latency[name]:>10.2f}" for name in PERCENTILES)
+        )
+    print("(latencias en ms)")
+
+def compare_with_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Regressions against a stored run: throughput below, or p99 above, the
+    baseline by more than the tolerance (fraction, e.g. 0.1 = 10%)
+    """
+    regressions = []
+    pairs = [('TOTAL', results['total'], baseline.get('total'))] + [
+        (operation, summary, baseline.get('operations', {}).get(operation))
+        for operation, summary in results['operations'].items()
+    ]
+    for operation, current, previous in pairs:
+        if not previous or not previous.get('requests'):
+            continue
+        if current['rps'] < previous['rps'] * (1 - tolerance):
+            regressions.append(f"{operation}: rps {previous['rps']:.1f} -> {current['rps']:.1f}")
+        if current['latency_ms']['p99'] > previous['latency_ms']['p99'] * (1 + tolerance):
+            regressions.append(
+                f"{operation}: p99 {previous['latency_ms']['p99']:.2f}ms -> {current['latency_ms']['p99']:.2f}ms"
+            )
+    return regressions
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark concurrente del servicio de carritos con carga mixta y usuarios Zipf'
+    )
+    parser.add_argument('--base-url', help='URL de un servidor en ejecución (por defecto la app corre en este proceso)')
+    parser.add_argument('--database-uri', help='URI de PostgreSQL para el modo en proceso')
+    parser.add_argument('--concurrency', type=int, default=16, help='Clientes concurrentes')
+    parser.add_argument('--duration', type=float, default=30.0, help='Segundos medidos')
+    parser.add_argument('--warmup', type=float, default=5.0, help='Segundos de calentamiento no medidos')
+    parser.add_argument('--users', type=int, default=10000, help='Tamaño de la población de usuarios')
+    parser.add_argument('--products', type=int, default=500, help='Tamaño del catálogo')
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='Exponente de la distribución Zipf')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help='Pesos por operación, p. ej. get=60,add=15,update=10,remove=7,clear=3,top_products=5')
+    parser.add_argument('--seed', type=int, help='Semilla para reproducir la misma secuencia')
+    parser.add_argument('--output', default='benchmark_results.json', help='Archivo JSON de resultados')
+    parser.add_argument('--baseline', help='Resultados JSON previos contra los que comparar')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Margen antes de marcar una regresión')
+    parser.add_argument('--save-baseline', help='Guardar además estos resultados como nueva línea base')
+    return parser.parse_args(argv)
+
+def run_performance_test(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.base_url:
+        make_sender = http_sender(args.base_url.rstrip('/'))
+    else:
+        make_sender = in_process_sender(args.database_uri)
+
+    print(f"Running benchmark: {args.concurrency} clients, {args.duration}s, mix {args.mix}")
+    print("=" * 50)
+    if args.warmup > 0:
+        run_phase(args, make_sender, args.warmup, None)
+
+    recorder = Recorder()
+    elapsed = run_phase(args, make_sender, args.duration, recorder)
+    results = build_results(args, recorder, elapsed)
+    print_results(results)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to '{args.output}'")
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to '{args.save_baseline}'")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions against '{args.baseline}' (tolerance {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"\nNo regressions against '{args.baseline}'")
+    return 0
 
 if __name__ == "__main__":
-    run_performance_test() 
\ No newline at end of file
+    sys.exit(run_performance_test())
@@ -0,0 +1,93 @@
+from app.cache.sharding import HashRing
+from app.config import Config, _parse_shards
+import argparse
+import os
+import redis
+
+def connect(specs):
+    """Master connection of every shard, by name"""
+    return {
+        name: redis.Redis(host=host, port=port, decode_responses=False)
+        for name, (host, port), _ in specs
+    }
+
+def move_keys(source: redis.Redis, target: redis.Redis, keys) -> int:
+    """
+    Copy keys with their remaining TTL and delete them from the source.
+    Keys the target already has are not overwritten: they were written
+    there after the switch to the new layout and are fresher.
+    """
+    pipe = source.pipeline(transaction=False)
+    for key in keys:
+        pipe.pttl(key)
+        pipe.dump(key)
+    replies = pipe.execute()
+    pipe = target.pipeline(transaction=False)
+    for key, ttl, payload in zip(keys, replies[0::2], replies[1::2]):
+        if payload is not None and ttl != -2:
+            pipe.restore(key, max(ttl, 0), payload)
+    moved = sum(1 for reply in pipe.execute(raise_on_error=False) if not isinstance(reply, Exception))
+    source.delete(*keys)
+    return moved
+
+def rebalance_shards():
+    parser = argparse.ArgumentParser(
+        description='Mueve las claves de carrito al shard que les corresponde tras cambiar REDIS_SHARDS'
+    )
+    parser.add_argument('--from', dest='old', required=True,
+                        help='Shards anteriores, con el mismo formato que REDIS_SHARDS')
+    parser.add_argument('--to', dest='new', default=os.environ.get('REDIS_SHARDS', ''),
+                        help='Shards nuevos (por defecto REDIS_SHARDS)')
+    parser.add_argument('--pattern', default=f'{Config.CART_KEY_PREFIX}*',
+                        help='Patrón de las claves a mover')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='Claves por SCAN y por pipeline')
+    parser.add_argument('--vnodes', type=int, default=Config.REDIS_SHARD_VNODES,
+                        help='Nodos virtuales por shard (igual que en la aplicación)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Solo contar las claves que cambiarían de shard')
+    args = parser.parse_args()
+
+    old_specs, new_specs = _parse_shards(args.old), _parse_shards(args.new)
+    if not old_specs or not new_specs:
+        parser.error('--from y --to (o REDIS_SHARDS) deben tener al menos un shard')
+    old_masters, new_masters = connect(old_specs), connect(new_specs)
+    ring = HashRing(list(new_masters), args.vnodes)
+    new_addresses = {name: address for name, address, _ in new_specs}
+
+    scanned = 0
+    moves = {}
+
+    def flush(name, source, keys):
+        """Move (or just count) a batch of keys leaving a shard"""
+        for owner, owned in _by_owner(ring, keys).items():
+            count = len(owned) if args.dry_run else move_keys(source, new_masters[owner], owned)
+            moves[(name, owner)] = moves.get((name, owner), 0) + count
+
+    for name, address, _ in old_specs:
+        source = old_masters[name]
+        batch = []
+        for key in source.scan_iter(match=args.pattern, count=args.batch_size):
+            scanned += 1
+            # Only keys whose new shard is another server move
+            if new_addresses[ring.get_node(key.decode())] != address:
+                batch.append(key)
+            if len(batch) >= args.batch_size:
+                flush(name, source, batch)
+                batch = []
+        flush(name, source, batch)
+
+    total = sum(moves.values())
+    for (source, target), count in sorted(moves.items()):
+        print(f"  {source} -> {target}: {count} keys")
+    action = 'would move' if args.dry_run else 'moved'
+    print(f"✅ {scanned} keys scanned, {action} {total} ({total / scanned if scanned else 0:.1%})")
+
+def _by_owner(ring: HashRing, keys):
+    groups = {}
+    for key in keys:
+        groups.setdefault(ring.get_node(key.decode()), []).append(key)
+    return groups
+
+if __name__ == '__main__':
+    rebalance_shards()
@@ -0,0 +1,25 @@
+from app import create_app
+from app.services.cart_filter import cart_filter
+import argparse
+
+def rebuild_cart_filter():
+    parser = argparse.ArgumentParser(
+        description='Reconstruye el filtro de Bloom de usuarios con carrito a partir de PostgreSQL'
+    )
+    parser.add_argument('--chunk-size', type=int, default=5000,
+                        help='Usuarios por bloque del cursor y por pipeline')
+    args = parser.parse_args()
+    
+    if not cart_filter.enabled:
+        parser.error('CART_FILTER_ENABLED no está activado')
+    
+    app = create_app(start_workers=False)
+    with app.app_context():
+        stats = cart_filter.rebuild(chunk_size=args.chunk_size)
+        print(
+            f"✅ Cart filter rebuilt: {stats['carts']} carts, {stats['bits']} bits, "
+            f"{stats['hashes']} hashes in {stats['seconds']}s"
+        )
+
+if __name__ == '__main__':
+    rebuild_cart_filter()
@@ -0,0 +1,29 @@
+from app import create_app
+from app.services.cache_warmer import CacheWarmer
+from app.config import Config
+import argparse
+
+def warm_cache():
+    parser = argparse.ArgumentParser(description='Precarga en Redis los carritos actualizados recientemente')
+    parser.add_argument('--max-carts', type=int, default=Config.CACHE_WARM_MAX_CARTS,
+                        help='Máximo de carritos a precargar (0 = todos)')
+    parser.add_argument('--since-hours', type=float, default=Config.CACHE_WARM_SINCE_HOURS,
+                        help='Solo carritos actualizados en las últimas N horas (0 = todos)')
+    parser.add_argument('--chunk-size', type=int, default=Config.CACHE_WARM_CHUNK_SIZE,
+                        help='Carritos por consulta de ítems y por pipeline')
+    parser.add_argument('--rate-limit', type=float, default=Config.CACHE_WARM_RATE_LIMIT,
+                        help='Carritos por segundo (0 = sin límite)')
+    args = parser.parse_args()
+    
+    app = create_app()
+    with app.app_context():
+        stats = CacheWarmer(
+            max_carts=args.max_carts,
+            since_hours=args.since_hours,
+            chunk_size=args.chunk_size,
+            rate_limit=args.rate_limit
+        ).run()
+        print(f"✅ Cache warmed: {stats['written']} carts written out of {stats['scanned']} read in {stats['seconds']}s")
+
+if __name__ == '__main__':
+    warm_cache()
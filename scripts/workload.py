@@ -0,0 +1,94 @@
+import bisect
+import math
+import random
+from typing import Dict, List, Optional, Tuple, Any
+
+# Default operation mix (weights, not necessarily summing to 100)
+DEFAULT_MIX = {
+    'get': 60,
+    'add': 15,
+    'update': 10,
+    'remove': 7,
+    'clear': 3,
+    'top_products': 5
+}
+
+class ZipfSampler:
+    """Draws ranks 1..n with probability proportional to 1 / rank^s"""
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        weights = [1.0 / (rank ** s) for rank in range(1, n + 1)]
+        total = sum(weights)
+        self._cdf = []
+        cumulative = 0.0
+        for weight in weights:
+            cumulative += weight / total
+            self._cdf.append(cumulative)
+
+    def sample(self) -> int:
+        """Rank between 1 and n, rank 1 being the most popular"""
+        return min(bisect.bisect_left(self._cdf, self.rng.random()), len(self._cdf) - 1) + 1
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """Parse an operation mix like "get=60,add=20,top_products=20" """
+    mix = {}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        name, _, weight = entry.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation '{name}', expected one of {', '.join(DEFAULT_MIX)}")
+        mix[name] = int(weight)
+    if not any(mix.values()):
+        raise ValueError('The operation mix needs at least one positive weight')
+    return mix
+
+class Workload:
+    """
+    Mixed cart workload over a Zipf-distributed user population. Hot users
+    are picked far more often than the long tail, so the cache sees a
+    realistic hit ratio and the hottest carts see write contention.
+    """
+
+    def __init__(self, users: int, products: int, zipf_s: float, mix: Dict[str, int],
+                 seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+        self.users = ZipfSampler(users, zipf_s, self.rng)
+        self.products = ZipfSampler(products, zipf_s, self.rng)
+        self.operations = [name for name, weight in mix.items() if weight > 0]
+        self.weights = [mix[name] for name in self.operations]
+
+    def _user_id(self) -> str:
+        return f"user{self.users.sample()}"
+
+    def next_request(self) -> Tuple[str, str, str, Optional[Dict[str, Any]]]:
+        """Next (operation, method, path, json body) to send"""
+        operation = self.rng.choices(self.operations, weights=self.weights)[0]
+        if operation == 'top_products':
+            return operation, 'GET', '/stats/top-products', None
+
+        user_id = self._user_id()
+        if operation == 'get':
+            return operation, 'GET', f"/cart/{user_id}", None
+        if operation == 'clear':
+            return operation, 'POST', f"/cart/{user_id}/clear", None
+
+        product_id = self.products.sample()
+        if operation == 'add':
+            # Name and price come from the catalog (scripts/seed_data.py --products)
+            return operation, 'POST', f"/cart/{user_id}/add", {
+                'product_id': product_id,
+                'quantity': self.rng.randint(1, 3)
+            }
+        if operation == 'update':
+            return operation, 'PUT', f"/cart/{user_id}/update/{product_id}", {'quantity': self.rng.randint(1, 5)}
+        return operation, 'POST', f"/cart/{user_id}/remove/{product_id}", None
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
@@ -0,0 +1,66 @@
+import pytest
+from app.cache.bloom import bloom_offsets, bloom_size
+from app.cache.redis_client import redis_client
+from app.models.database import db, DBCart
+from app.services.cart_filter import CartFilter
+from app.services.cart_service import CartService
+
+def test_bloom_size_matches_the_error_rate():
+    bits, hashes = bloom_size(1000, 0.01)
+    assert (bits, hashes) == (9586, 7)
+    assert bloom_size(1000, 0.001)[0] > bits
+
+def test_bloom_offsets_are_stable_and_in_range():
+    offsets = bloom_offsets('user-1', 9586, 7)
+    assert offsets == bloom_offsets('user-1', 9586, 7)
+    assert len(offsets) == 7 and all(0 <= offset < 9586 for offset in offsets)
+    assert offsets != bloom_offsets('user-2', 9586, 7)
+
+@pytest.fixture
+def users_with_carts(cart_app):
+    user_ids = [f"user-{i}" for i in range(500)]
+    db.session.add_all(DBCart(user_id=user_id) for user_id in user_ids)
+    db.session.commit()
+    return user_ids
+
+def test_filter_trusts_nobody_until_it_is_built(app_redis):
+    cart_filter = CartFilter(enabled=True, capacity=1000, error_rate=0.01)
+    assert cart_filter.might_have_carts(['a', 'b']) == [True, True]
+    assert cart_filter.get_stats()['ready'] is False
+
+def test_rebuilt_filter_has_no_false_negatives(users_with_carts):
+    cart_filter = CartFilter(enabled=True, capacity=1000, error_rate=0.01)
+
+    assert cart_filter.rebuild(chunk_size=64)['carts'] == 500
+
+    assert all(cart_filter.might_have_carts(users_with_carts))
+    unknown = cart_filter.might_have_carts([f"stranger-{i}" for i in range(2000)])
+    # About 1% at the filter's capacity, fewer with half of it
+    assert unknown.count(True) < 40
+    assert cart_filter.get_stats()['ready'] is True
+
+def test_users_added_during_a_rebuild_are_kept(monkeypatch, users_with_carts):
+    cart_filter = CartFilter(enabled=True, capacity=1000, error_rate=0.01)
+    set_bits = redis_client.set_bits
+
+    def save_while_rebuilding(*args):
+        set_bits(*args)
+        # Written after the rebuild read the table
+        cart_filter.add('during')
+
+    monkeypatch.setattr(redis_client, 'set_bits', save_while_rebuilding)
+    cart_filter.rebuild(chunk_size=64)
+
+    assert cart_filter.might_have_carts(['during'] + users_with_carts) == [True] * 501
+    assert cart_filter.get_stats()['carts_at_build'] == 500
+
+def test_unknown_users_skip_the_database(monkeypatch, cart_app):
+    cart_filter = CartFilter(enabled=True, capacity=1000, error_rate=0.01)
+    cart_filter.rebuild()
+    service = CartService()
+    service.cart_filter = cart_filter
+    reads = []
+    monkeypatch.setattr(service, '_read_cart_from_db', lambda user_id: reads.append(user_id))
+
+    assert service.get_cart('stranger').line_count == 0
+    assert reads == []
@@ -0,0 +1,112 @@
+import time
+import pytest
+from app.cache.redis_client import redis_client
+from app.config import Config
+from app.models.cart import Product
+from app.models.database import db, DBCart
+from app.services.cart_flusher import CartFlusher
+from app.services.cart_service import CartService
+from app.services.catalog_service import catalog
+
+@pytest.fixture
+def write_behind(monkeypatch, cart_app):
+    """Write-behind cart service with its consumer group, on a new database and Redis server"""
+    monkeypatch.setattr(Config, 'PERSISTENCE_MODE', 'write_behind')
+    monkeypatch.setattr(Config, 'FLUSHER_BLOCK_MS', 10)
+    monkeypatch.setattr(Config, 'FLUSHER_CLAIM_IDLE_MS', 200)
+    catalog.save_products([Product(product_id=product_id, name=f"P{product_id}", price=1.0) for product_id in (1, 2)])
+    redis_client.ensure_consumer_group(Config.CART_CHANGES_STREAM, Config.CART_FLUSHER_GROUP)
+    return CartService()
+
+def stored_cart(user_id):
+    """(version, {product_id: quantity}) of the cart in the database, None if it has none"""
+    db.session.expire_all()
+    cart = DBCart.query.filter_by(user_id=user_id).first()
+    if cart is None:
+        return None
+    return cart.version, {item.product_id: item.quantity for item in cart.items}
+
+def take_entries(consumer):
+    """Deliver the new stream entries to consumer without acknowledging them, as a crash would"""
+    return redis_client.read_stream_group(
+        Config.CART_CHANGES_STREAM, Config.CART_FLUSHER_GROUP, consumer, 100, 10
+    )
+
+def pending_entries():
+    return redis_client.count_pending_entries(Config.CART_CHANGES_STREAM, Config.CART_FLUSHER_GROUP)
+
+def test_batch_keeps_the_newest_change_of_each_user(write_behind):
+    for _ in range(3):
+        write_behind.add_item('a', {'product_id': 1, 'quantity': 1})
+    latest = write_behind.add_item('a', {'product_id': 2, 'quantity': 1}).version
+    other = write_behind.add_item('b', {'product_id': 2, 'quantity': 5}).version
+    flusher = CartFlusher('me')
+
+    assert flusher.flush_once() == 5
+
+    assert flusher.flushed_carts == 2
+    assert stored_cart('a') == (latest, {1: 3, 2: 1})
+    assert stored_cart('b') == (other, {2: 5})
+    assert pending_entries() == 0
+    assert redis_client.master.xlen(Config.CART_CHANGES_STREAM) == 0
+
+def test_own_pending_entries_go_before_new_ones(write_behind):
+    first = write_behind.add_item('p', {'product_id': 1, 'quantity': 1}).version
+    # A batch of this consumer that failed before its commit
+    assert len(take_entries('me')) == 1
+    second = write_behind.add_item('p', {'product_id': 1, 'quantity': 1}).version
+    flusher = CartFlusher('me')
+
+    assert flusher.flush_once() == 1
+    assert stored_cart('p') == (first, {1: 1})
+    assert flusher.flush_once() == 1
+    assert stored_cart('p') == (second, {1: 2})
+
+def test_entries_of_a_dead_consumer_are_claimed_before_new_ones(write_behind):
+    write_behind.add_item('t', {'product_id': 1, 'quantity': 1})
+    assert len(take_entries('dead')) == 1
+    latest = write_behind.add_item('t', {'product_id': 2, 'quantity': 1}).version
+    flusher = CartFlusher('alive')
+
+    # Not idle long enough to be taken over, and the newer change must wait for it
+    assert flusher.flush_once() == 0
+    assert stored_cart('t') is None
+    time.sleep(Config.FLUSHER_CLAIM_IDLE_MS / 1000)
+
+    assert flusher.flush_once() == 1
+    assert stored_cart('t')[1] == {1: 1}
+    assert flusher.flush_once() == 1
+    assert stored_cart('t') == (latest, {1: 1, 2: 1})
+    assert pending_entries() == 0
+
+def test_clear_and_save_apply_in_version_order(write_behind):
+    flusher = CartFlusher('me')
+    write_behind.add_item('c', {'product_id': 1, 'quantity': 1})
+    flusher.flush_once()
+    assert stored_cart('c') is not None
+    write_behind.add_item('c', {'product_id': 2, 'quantity': 1})
+    write_behind.clear_cart('c')
+    write_behind.add_item('s', {'product_id': 1, 'quantity': 1})
+    write_behind.clear_cart('s')
+    latest = write_behind.add_item('s', {'product_id': 2, 'quantity': 1}).version
+
+    assert flusher.flush_once() == 5
+
+    assert stored_cart('c') is None
+    # The save after the clear recreates the cart with only its own items
+    assert stored_cart('s') == (latest, {2: 1})
+
+def test_replayed_changes_never_undo_newer_ones(write_behind):
+    old = write_behind.add_item('r', {'product_id': 1, 'quantity': 1}).version
+    latest = write_behind.add_item('r', {'product_id': 2, 'quantity': 1}).version
+    flusher = CartFlusher('me')
+    flusher.flush_once()
+
+    # At-least-once delivery: an older save and clear delivered again
+    flusher._apply({'r': {'op': 'save', 'user_id': 'r', 'version': old,
+                          'items': [{'product_id': 1, 'quantity': 1}]}})
+    assert stored_cart('r') == (latest, {1: 1, 2: 1})
+    flusher._apply({'r': {'op': 'clear', 'user_id': 'r', 'version': old}})
+    assert stored_cart('r') == (latest, {1: 1, 2: 1})
+    flusher._apply({'r': {'op': 'clear', 'user_id': 'r', 'version': latest}})
+    assert stored_cart('r') is None
@@ -0,0 +1,133 @@
+import pytest
+from app.cache.redis_client import redis_client
+from app.models.cart import Product
+from app.routes import cart_routes
+from app.services.cart_service import CartService, CartVersionConflictError
+from app.services.catalog_service import catalog
+
+def add_products(*product_ids):
+    catalog.save_products([Product(product_id=product_id, name=f"P{product_id}", price=1.0) for product_id in product_ids])
+
+def race_on_persist(monkeypatch, service: CartService, times: int, product_id: int):
+    """Make the first `times` saves of service lose the race to another write of the same cart"""
+    persist = service._persist_cart
+    calls = []
+
+    def racing_persist(cart, *args, **kwargs):
+        calls.append(cart.version)
+        if len(calls) <= times:
+            CartService().add_item(cart.user_id, {'product_id': product_id, 'quantity': 1})
+        return persist(cart, *args, **kwargs)
+
+    monkeypatch.setattr(service, '_persist_cart', racing_persist)
+    return calls
+
+def test_set_versioned_hash_never_goes_back(app_redis):
+    key = 'cart:{v1}'
+
+    assert redis_client.set_versioned_hash(key, {'1': 1}, 5) == 1
+    # A slow writer with an older copy is skipped, without an expected version
+    assert redis_client.set_versioned_hash(key, {'1': 9}, 4) == 0
+    assert redis_client.set_versioned_hash(key, {'1': 9}, 5) == 0
+    assert app_redis.client.hgetall(key) == {'1': '1', '_version': '5'}
+    # With one it must match what is stored
+    assert redis_client.set_versioned_hash(key, {'2': 2}, 7, expected_version=4) == -1
+    assert redis_client.set_versioned_hash(key, {'2': 2}, 7, expected_version=5) == 1
+    assert app_redis.client.hgetall(key) == {'2': '2', '_version': '7'}
+    # A missing key is version 0
+    assert redis_client.set_versioned_hash('cart:{v2}', {'1': 1}, 3, expected_version=1) == -1
+    assert redis_client.set_versioned_hash('cart:{v2}', {'1': 1}, 3, expected_version=0) == 1
+
+def test_update_versioned_hash_needs_the_expected_version(app_redis):
+    key = 'cart:{u1}'
+
+    assert redis_client.update_versioned_hash(key, {'1': 2}, [], 0, 1) == 0
+    assert not app_redis.client.exists(key)
+    redis_client.set_versioned_hash(key, {'1': 1, '2': 1}, 3)
+
+    assert redis_client.update_versioned_hash(key, {'1': 5}, ['2'], 2, 4) == -1
+    assert app_redis.client.hgetall(key) == {'1': '1', '2': '1', '_version': '3'}
+    assert redis_client.update_versioned_hash(key, {'1': 5, '3': 1}, ['2'], 3, 4, expiry=30) == 1
+    assert app_redis.client.hgetall(key) == {'1': '5', '3': '1', '_version': '4'}
+    assert 0 < app_redis.client.ttl(key) <= 30
+    # The version it was applied on is gone
+    assert redis_client.update_versioned_hash(key, {'1': 6}, [], 3, 5) == -1
+
+def test_conflicting_write_is_made_again_on_the_latest_cart(monkeypatch, cart_app):
+    add_products(1, 2)
+    service = CartService()
+    calls = race_on_persist(monkeypatch, service, 1, product_id=2)
+
+    cart = service.add_item('race', {'product_id': 1, 'quantity': 1})
+
+    assert len(calls) == 2
+    # The retry started from the cart the other write saved
+    assert calls[1] > calls[0]
+    assert {item.product_id: item.quantity for item in cart.items} == {1: 1, 2: 1}
+    assert cart.version == service.get_cart('race').version
+    assert {item.product_id for item in CartService().get_cart('race').items} == {1, 2}
+
+def test_conflicts_raise_once_the_retries_run_out(monkeypatch, cart_app):
+    add_products(1, 2)
+    service = CartService()
+    calls = race_on_persist(monkeypatch, service, service.write_retries + 1, product_id=2)
+
+    with pytest.raises(CartVersionConflictError):
+        service.add_item('lost', {'product_id': 1, 'quantity': 1})
+
+    assert len(calls) == service.write_retries + 1
+    # Only the competing writes were saved
+    cart = CartService().get_cart('lost')
+    assert {item.product_id: item.quantity for item in cart.items} == {2: service.write_retries + 1}
+
+def test_stale_if_match_is_412_and_lost_races_409(monkeypatch, cart_app):
+    add_products(1, 2)
+    client = cart_app.test_client()
+    etag = client.post('/cart/http/add', json={'product_id': 1, 'quantity': 1}).headers['ETag']
+    assert client.post('/cart/http/add', json={'product_id': 1, 'quantity': 1}, headers={'If-Match': etag}).status_code == 200
+
+    stale = client.post('/cart/http/add', json={'product_id': 1, 'quantity': 1}, headers={'If-Match': etag})
+    assert stale.status_code == 412
+    assert stale.get_json()['version'] == CartService().get_cart('http').version
+    assert client.post('/cart/http/clear', headers={'If-Match': etag}).status_code == 412
+
+    race_on_persist(monkeypatch, cart_routes.cart_service, cart_routes.cart_service.write_retries + 1, product_id=2)
+    lost = client.post('/cart/http/add', json={'product_id': 1, 'quantity': 1})
+    assert lost.status_code == 409
+    assert lost.get_json() == {'message': 'El carrito cambió durante la operación, reintente'}
+
+def test_clear_then_add_keeps_only_the_new_items(cart_app, app_redis):
+    add_products(1, 2)
+    service = CartService()
+    key = service._get_cart_key('clr')
+    before = service.add_item('clr', {'product_id': 1, 'quantity': 3}).version
+
+    cleared = service.clear_cart('clr')
+
+    assert cleared > before
+    assert app_redis.client.hget(key, '_version') == str(cleared)
+    assert service.get_cart('clr').line_count == 0
+    # A reader that loaded the cart before the clear cannot put it back
+    assert redis_client.set_versioned_hash(key, {'1': 3}, before) == 0
+    assert service.get_cart('clr').line_count == 0
+
+    cart = service.add_item('clr', {'product_id': 2, 'quantity': 1})
+
+    assert cart.version > cleared
+    assert [item.product_id for item in cart.items] == [2]
+    # The empty marker was replaced, not merged into
+    assert app_redis.client.hgetall(key) == {'2': '1', '_version': str(cart.version)}
+    assert redis_client.set_versioned_hash(key, {}, cleared) == 0
+    assert [item.product_id for item in CartService().get_cart('clr').items] == [2]
+
+def test_negative_cache_entry_is_replaced_by_the_first_add(cart_app, app_redis):
+    add_products(1)
+    service = CartService()
+    key = service._get_cart_key('new')
+
+    assert service.get_cart('new').line_count == 0
+    assert app_redis.client.hgetall(key) == {'_empty': '1'}
+    cart = service.add_item('new', {'product_id': 1, 'quantity': 2})
+
+    assert app_redis.client.hgetall(key) == {'1': '2', '_version': str(cart.version)}
+    assert service.get_cart('new').get_item(1).quantity == 2
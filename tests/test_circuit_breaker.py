@@ -0,0 +1,175 @@
+import pytest
+import redis
+import app.circuit_breaker as breaker_module
+from app.cache.redis_client import redis_client
+from app.circuit_breaker import (
+    CLOSED, HALF_OPEN, OPEN, BudgetExceededError, CircuitBreaker, CircuitOpenError, RedisBudgetExceededError,
+    RedisCircuitOpenError, RedisGuard, check_budget, remaining_budget, start_budget
+)
+
+class Clock:
+    """Stands in for the time module of app.circuit_breaker"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(breaker_module, 'time', clock)
+    yield clock
+    start_budget(0)
+
+def open_breaker(clock, threshold=3) -> CircuitBreaker:
+    breaker = CircuitBreaker('test', failure_threshold=threshold, failure_window=10, open_seconds=5)
+    for _ in range(threshold):
+        breaker.record_failure()
+    return breaker
+
+def failing():
+    raise redis.ConnectionError('down')
+
+def test_breaker_opens_after_threshold_failures_within_the_window(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, failure_window=10, open_seconds=5)
+    breaker.record_failure()
+    breaker.record_failure()
+    # Failures older than the window are forgotten
+    clock.now += 11
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.before_call() is False
+
+    breaker.record_failure()
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.rejected == 1
+
+def test_half_open_admits_a_single_trial_that_closes_it(clock):
+    breaker = open_breaker(clock)
+    clock.now += 4.9
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 0.1
+    assert breaker.before_call() is True
+    assert breaker.state == HALF_OPEN
+    # Everyone else keeps failing fast while the trial runs
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+
+    assert breaker.state == CLOSED
+    assert breaker.before_call() is False
+    # The failures that opened it no longer count
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+def test_failed_trial_opens_the_breaker_again(clock):
+    breaker = open_breaker(clock)
+    clock.now += 5
+    assert breaker.before_call() is True
+
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    clock.now += 4
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += 1
+    assert breaker.before_call() is True
+
+def test_trial_that_never_reports_back_is_replaced(clock):
+    breaker = open_breaker(clock)
+    clock.now += 5
+    assert breaker.before_call() is True
+    clock.now += 4
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 1
+
+    assert breaker.before_call() is True
+
+def test_budget_runs_out(clock):
+    assert remaining_budget() is None
+    start_budget(100)
+    check_budget('db')
+    assert remaining_budget() == pytest.approx(0.1)
+
+    clock.now += 0.1
+
+    with pytest.raises(BudgetExceededError):
+        check_budget('db')
+    # 0 is no limit
+    start_budget(0)
+    check_budget('db')
+
+def test_spent_budget_refuses_redis_calls_without_opening_the_circuit(clock):
+    guard = RedisGuard(CircuitBreaker('test', 1, 10, 5), max_deferred=10)
+    calls = []
+    start_budget(50)
+    clock.now += 0.05
+
+    with pytest.raises(RedisBudgetExceededError) as error:
+        guard.call(lambda: calls.append('op'), calls.append)
+
+    # Code that handles Redis timeouts handles it too
+    assert isinstance(error.value, redis.TimeoutError)
+    assert calls == []
+    assert guard.breaker.state == CLOSED
+
+def test_open_circuit_fails_redis_calls_fast(clock):
+    guard = RedisGuard(CircuitBreaker('test', 2, 10, 5), max_deferred=10)
+    for _ in range(2):
+        with pytest.raises(redis.ConnectionError):
+            guard.call(failing, lambda commands: None)
+
+    with pytest.raises(RedisCircuitOpenError) as error:
+        guard.call(lambda: 'ok', lambda commands: None)
+
+    assert isinstance(error.value, redis.ConnectionError)
+    clock.now += 5
+    assert guard.call(lambda: 'ok', lambda commands: None) == 'ok'
+    assert guard.breaker.state == CLOSED
+
+def test_deferred_commands_are_replayed_before_the_next_call(clock):
+    guard = RedisGuard(CircuitBreaker('test', 5, 10, 5), max_deferred=2)
+    calls = []
+    guard.defer('DEL', 'a')
+    guard.defer('DEL', 'b')
+    guard.defer('DEL', 'a')
+    guard.defer('DEL', 'c')
+    assert guard.deferred_count() == 2
+    assert guard.dropped == 1
+
+    def broken_replay(commands):
+        calls.append(commands)
+        raise redis.ConnectionError('down')
+
+    with pytest.raises(redis.ConnectionError):
+        guard.call(lambda: calls.append('op'), broken_replay)
+    # Nothing lost, and the command was not sent ahead of them
+    assert calls == [[('DEL', 'a'), ('DEL', 'b')]]
+    assert guard.deferred_count() == 2
+
+    calls.clear()
+    assert guard.call(lambda: calls.append('op') or 'ok', calls.append) == 'ok'
+    assert calls == [[('DEL', 'a'), ('DEL', 'b')], 'op']
+    assert guard.deferred_count() == 0
+
+def test_deferred_delete_reaches_redis_with_the_next_command(app_redis):
+    app_redis.client.set('cart:{gone}', 'stale')
+    redis_client.defer_delete('cart:{gone}')
+    assert app_redis.client.exists('cart:{gone}')
+
+    redis_client.master.ping()
+
+    assert not app_redis.client.exists('cart:{gone}')
+    assert redis_client.get_deferred_stats()[0]['deferred'] == 0
@@ -0,0 +1,68 @@
+import multiprocessing
+import os
+from app.metrics import MetricsRegistry, mark_process_dead, reset_shared_metrics
+
+def make_registry():
+    """A registry like the app's, with a counter, a histogram and a per-process gauge"""
+    registry = MetricsRegistry()
+    requests = registry.counter('requests_total', 'Requests', ('status',))
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    registry.register_collector(lambda: [('open_files', 'Open files', 'gauge', [({}, 3)])])
+    return registry, requests, latency
+
+def serve_in_child(directory: str) -> int:
+    """Record metrics in a forked worker, which writes its snapshot and exits; returns its pid"""
+    def worker():
+        registry, requests, latency = make_registry()
+        registry.share(directory, interval=3600)
+        requests.inc(status='200')
+        requests.inc(2, status='500')
+        latency.observe(0.5)
+        registry.write_snapshot()
+
+    process = multiprocessing.get_context('fork').Process(target=worker)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    return process.pid
+
+def test_registry_without_sharing_renders_its_own_values():
+    registry, requests, latency = make_registry()
+    requests.inc(status='200')
+    latency.observe(0.05)
+
+    text = registry.render()
+
+    assert 'requests_total{status="200"} 1\n' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1\n' in text
+    assert 'open_files 3\n' in text
+
+def test_shared_metrics_add_up_every_worker(tmp_path):
+    directory = str(tmp_path)
+    reset_shared_metrics(directory)
+    child = serve_in_child(directory)
+    registry, requests, latency = make_registry()
+    registry.share(directory, interval=3600)
+    requests.inc(status='200')
+    latency.observe(0.05)
+
+    text = registry.render()
+
+    assert 'requests_total{status="200"} 2\n' in text
+    assert 'requests_total{status="500"} 2\n' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1\n' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2\n' in text
+    assert 'latency_seconds_count 2\n' in text
+    # One HELP/TYPE per metric, and the gauges of each worker
+    assert text.count('# TYPE open_files gauge') == 1
+    assert f'open_files{{worker="{child}"}} 3\n' in text
+    assert f'open_files{{worker="{os.getpid()}"}} 3\n' in text
+
+    mark_process_dead(directory, child)
+    text = registry.render()
+
+    assert f'worker="{child}"' not in text
+    assert 'requests_total{status="200"} 2\n' in text
+
+    reset_shared_metrics(directory)
+    assert os.listdir(directory) == []
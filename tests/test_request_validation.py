@@ -0,0 +1,44 @@
+import pytest
+from app.routes.cart_routes import parse_item, parse_operations, parse_quantity
+from app.routes.catalog_routes import parse_product
+
+@pytest.mark.parametrize('body', [
+    None, [], [1], 'x', 3, {}, {'product_id': 1}, {'quantity': 1},
+    {'product_id': True, 'quantity': 1}, {'product_id': 1, 'quantity': True},
+    {'product_id': '1', 'quantity': 1}, {'product_id': 1, 'quantity': 0}, {'product_id': 1, 'quantity': 1.5}
+])
+def test_add_rejects_malformed_items(body):
+    assert parse_item(body) is None
+
+def test_add_accepts_integer_ids_and_positive_quantities():
+    assert parse_item({'product_id': 0, 'quantity': 2}) == {'product_id': 0, 'quantity': 2}
+
+@pytest.mark.parametrize('body', [None, [], 'x', {}, {'quantity': True}, {'quantity': False}, {'quantity': 0}, {'quantity': '2'}])
+def test_update_rejects_malformed_quantities(body):
+    assert parse_quantity(body) is None
+
+def test_update_accepts_positive_quantities():
+    assert parse_quantity({'quantity': 3}) == 3
+
+@pytest.mark.parametrize('operation', [
+    {'op': 'add', 'product_id': True, 'quantity': 1},
+    {'op': 'add', 'product_id': 1, 'quantity': True},
+    {'op': 'remove', 'product_id': False},
+    {'op': 'update', 'product_id': 1, 'quantity': 0},
+    {'op': 'drop', 'product_id': 1},
+    [1]
+])
+def test_patch_rejects_malformed_operations(operation):
+    assert parse_operations({'operations': [{'op': 'remove', 'product_id': 1}, operation]}) is None
+
+@pytest.mark.parametrize('body', [None, [], [{'op': 'remove', 'product_id': 1}], 'x', {'operations': []}])
+def test_patch_rejects_bodies_without_operations(body):
+    assert parse_operations(body) is None
+
+def test_patch_accepts_valid_operations():
+    operations = [{'op': 'add', 'product_id': 1, 'quantity': 2}, {'op': 'remove', 'product_id': 3}]
+    assert parse_operations({'operations': operations}) == operations
+
+@pytest.mark.parametrize('body', [None, ['Mouse', 1], {'name': 'Mouse', 'price': True}, {'name': '', 'price': 1}])
+def test_product_rejects_malformed_bodies(body):
+    assert parse_product(1, body) is None
@@ -0,0 +1,68 @@
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from app.models.database import (
+    db, check_schema, migrate_schema, pending_migrations, SchemaMigrationRequiredError
+)
+
+# Tables as created by the versions before the unique indexes, cart
+# versions and the products table
+OLD_SCHEMA = """
+CREATE TABLE carts (
+    id SERIAL PRIMARY KEY, user_id VARCHAR(100) NOT NULL,
+    created_at TIMESTAMP, updated_at TIMESTAMP
+);
+CREATE TABLE cart_items (
+    id SERIAL PRIMARY KEY, cart_id INTEGER NOT NULL REFERENCES carts (id), product_id INTEGER NOT NULL,
+    name VARCHAR(100) NOT NULL, price FLOAT NOT NULL, quantity INTEGER NOT NULL,
+    created_at TIMESTAMP, updated_at TIMESTAMP
+);
+INSERT INTO carts (id, user_id, updated_at) VALUES
+    (1, 'u1', '2024-01-01'), (2, 'u1', '2024-02-01'), (3, 'u2', '2024-01-01');
+INSERT INTO cart_items (cart_id, product_id, name, price, quantity, updated_at) VALUES
+    (1, 1, 'Mouse', 10, 1, '2024-01-01'),
+    (1, 2, 'Teclado', 20, 5, '2024-01-01'),
+    (2, 1, 'Mouse', 12, 3, '2024-02-01'),
+    (3, 3, 'Monitor', 99, 1, '2024-01-01'),
+    (3, 3, 'Monitor', 99, 2, '2024-01-05');
+SELECT setval('carts_id_seq', 3);
+"""
+
+@pytest.fixture
+def app(postgres_database):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = postgres_database
+    db.init_app(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+def test_new_databases_need_no_migration(app):
+    db.create_all()
+    assert pending_migrations(db.session.connection()) == []
+
+def test_old_databases_are_refused_until_migrated(app):
+    db.session.execute(text(OLD_SCHEMA))
+    db.session.commit()
+    db.create_all()
+    with pytest.raises(SchemaMigrationRequiredError, match='migrate_schema'):
+        check_schema(db.session.connection())
+    db.session.rollback()
+
+    assert migrate_schema()
+    check_schema(db.session.connection())
+
+    # u1's carts are merged into the newest one, where the newest line of each product wins
+    rows = db.session.execute(text(
+        'SELECT carts.id, user_id, product_id, quantity FROM carts '
+        'JOIN cart_items ON cart_items.cart_id = carts.id ORDER BY user_id, product_id'
+    )).all()
+    assert [tuple(row) for row in rows] == [(2, 'u1', 1, 3), (2, 'u1', 2, 5), (3, 'u2', 3, 2)]
+    products = db.session.execute(text('SELECT id, name, price FROM products ORDER BY id')).all()
+    assert [tuple(row) for row in products] == [(1, 'Mouse', 12.0), (2, 'Teclado', 20.0), (3, 'Monitor', 99.0)]
+    assert db.session.execute(text('SELECT count(DISTINCT version) FROM carts')).scalar() == 2
+
+    # Running it again changes nothing
+    assert migrate_schema() == []
+    assert db.session.execute(text('SELECT count(*) FROM cart_items')).scalar() == 3
@@ -0,0 +1,235 @@
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+import pytest
+import redis
+from conftest import ROOT
+from app.cache.sharding import HashRing, hash_tag
+from app.cache.redis_client import RedisClient
+from app.config import Config
+from scripts.rebalance_shards import move_keys
+
+KEYS = [f"cart:{{user{i}}}" for i in range(20000)]
+
+def sharded_client(monkeypatch, shards, read_your_writes=False) -> RedisClient:
+    """RedisClient over the given (name, master, [replicas]) test servers"""
+    monkeypatch.setattr(Config, 'REDIS_SHARDS', [
+        (name, (master.host, master.port), [(replica.host, replica.port) for replica in replicas])
+        for name, master, replicas in shards
+    ])
+    monkeypatch.setattr(Config, 'REDIS_READ_YOUR_WRITES', read_your_writes)
+    return RedisClient()
+
+def keys_by_shard(client: RedisClient, count: int = 3):
+    """count cart keys owned by each shard of client"""
+    found = {shard.name: [] for shard in client.shards}
+    for key in KEYS:
+        owned = found[client.shard_for(key).name]
+        if len(owned) < count:
+            owned.append(key)
+        if all(len(owned) == count for owned in found.values()):
+            return found
+    raise AssertionError('Not every shard owns a key')
+
+def test_hash_tag_keeps_a_cart_and_its_lock_together():
+    assert hash_tag('cart:{u1}') == 'u1'
+    assert hash_tag('lock:cart:{u1}') == 'u1'
+    # Without a non-empty tag the whole key decides
+    assert hash_tag('cart:{}u1') == 'cart:{}u1'
+    assert hash_tag('stats:top_products') == 'stats:top_products'
+    ring = HashRing(['a', 'b', 'c'])
+    assert ring.get_node('cart:{u1}') == ring.get_node('lock:cart:{u1}')
+
+def test_ring_spreads_keys_evenly():
+    nodes = ['a', 'b', 'c', 'd']
+    counts = Counter(HashRing(nodes).get_node(key) for key in KEYS)
+    assert set(counts) == set(nodes)
+    mean = len(KEYS) / len(nodes)
+    assert all(abs(count - mean) / mean < 0.2 for count in counts.values()), counts
+
+def test_ring_needs_a_node():
+    with pytest.raises(ValueError):
+        HashRing([])
+
+def test_adding_a_node_only_moves_keys_to_it():
+    before, after = HashRing(['a', 'b', 'c']), HashRing(['a', 'b', 'c', 'd'])
+    moved = [key for key in KEYS if before.get_node(key) != after.get_node(key)]
+    assert {after.get_node(key) for key in moved} == {'d'}
+    # About 1/N of the keys, not the (N-1)/N a modulo would move
+    assert 0.15 < len(moved) / len(KEYS) < 0.35
+
+def test_removing_a_node_only_moves_its_keys():
+    before, after = HashRing(['a', 'b', 'c', 'd']), HashRing(['a', 'c', 'd'])
+    moved = [key for key in KEYS if before.get_node(key) != after.get_node(key)]
+    assert {before.get_node(key) for key in moved} == {'b'}
+    assert len(moved) == sum(1 for key in KEYS if before.get_node(key) == 'b')
+
+def test_group_keeps_the_order_of_the_keys():
+    ring = HashRing(['a', 'b'])
+    groups = ring.group(KEYS[:200])
+    assert sorted(key for group in groups.values() for key in group) == sorted(KEYS[:200])
+    for node, group in groups.items():
+        assert group == [key for key in KEYS[:200] if ring.get_node(key) == node]
+
+def test_batch_writes_go_to_the_shard_owning_each_key(monkeypatch, redis_servers):
+    first, second = redis_servers(), redis_servers()
+    client = sharded_client(monkeypatch, [('fan-a', first, []), ('fan-b', second, [])])
+    owned = keys_by_shard(client)
+
+    written = client.set_versioned_hashes({
+        key: (index + 1, {'1': index + 1}) for index, key in enumerate(owned['fan-a'] + owned['fan-b'])
+    }, 60)
+
+    assert len(written) == 6
+    assert sorted(first.client.keys('cart:*')) == sorted(owned['fan-a'])
+    assert sorted(second.client.keys('cart:*')) == sorted(owned['fan-b'])
+    assert all(0 < first.client.ttl(key) <= 60 for key in owned['fan-a'])
+
+def test_batch_reads_fan_out_to_every_shard_in_parallel(monkeypatch, redis_servers):
+    first, second = redis_servers(), redis_servers()
+    client = sharded_client(monkeypatch, [('read-a', first, []), ('read-b', second, [])])
+    owned = keys_by_shard(client)
+    # Interleaved, so the replies have to be put back in order
+    keys = [key for pair in zip(owned['read-a'], owned['read-b']) for key in pair] + ['cart:{missing}']
+    client.set_versioned_hashes({key: (1, {'7': index}) for index, key in enumerate(keys[:-1])})
+
+    hashes = client.get_hashes(keys)
+
+    assert [fields and fields['7'] for fields in hashes] == list(range(len(keys) - 1)) + [None]
+    threads = {}
+    client._fan_out(client.group_by_shard(keys), lambda shard, part: threads.setdefault(
+        shard.name, threading.current_thread().name
+    ))
+    assert set(threads) == {'read-a', 'read-b'}
+    assert all(name.startswith('redis-shard') for name in threads.values())
+
+def test_batch_deletes_skip_newer_carts_on_every_shard(monkeypatch, redis_servers):
+    first, second = redis_servers(), redis_servers()
+    client = sharded_client(monkeypatch, [('del-a', first, []), ('del-b', second, [])])
+    owned = keys_by_shard(client, 2)
+    keys = owned['del-a'] + owned['del-b']
+    client.set_versioned_hashes({key: (5, {'1': 1}) for key in keys})
+
+    # The last key of each shard was written again after the version being deleted
+    deleted = client.delete_versioned_hashes({key: 5 if index % 2 == 0 else 4 for index, key in enumerate(keys)})
+
+    assert sorted(deleted) == sorted([owned['del-a'][0], owned['del-b'][0]])
+    assert first.client.keys('cart:*') == [owned['del-a'][1]]
+    assert second.client.keys('cart:*') == [owned['del-b'][1]]
+
+def test_session_token_covers_every_written_shard(monkeypatch, redis_servers):
+    first, second = redis_servers(), redis_servers()
+    client = sharded_client(
+        monkeypatch, [('ryw-a', first, []), ('ryw-b', second, [])], read_your_writes=True
+    )
+    owned = keys_by_shard(client, 1)
+
+    client.begin_session(None)
+    client.set_versioned_hash(owned['ryw-b'][0], {'1': 1}, 1)
+    token = client.end_session()
+    assert token == f"1:{second.client.info('replication')['master_repl_offset']}"
+
+    client.begin_session(None)
+    client.set_versioned_hashes({owned['ryw-a'][0]: (1, {'1': 1}), owned['ryw-b'][0]: (2, {'1': 2})})
+    token = client.end_session()
+    offsets = dict(part.split(':') for part in token.split(','))
+    assert set(offsets) == {'0', '1'}
+
+    client.begin_session(token)
+    assert client.current_read_floor(client.shards[0]) == int(offsets['0'])
+    assert client.current_read_floor(client.shards[1]) == int(offsets['1'])
+    # A request that only reads gets no new token
+    assert client.end_session() is None
+
+def test_reads_wait_for_the_replica_of_each_shard(monkeypatch, redis_servers):
+    first, second = redis_servers(), redis_servers()
+    first_replica, second_replica = redis_servers(first), redis_servers(second)
+    first_replica.wait_for_sync()
+    second_replica.wait_for_sync()
+    client = sharded_client(monkeypatch, [
+        ('wait-a', first, [first_replica]), ('wait-b', second, [second_replica])
+    ], read_your_writes=True)
+    owned = keys_by_shard(client, 1)
+    key = owned['wait-b'][0]
+    for shard in client.shards:
+        shard.router.probe()
+
+    client.begin_session(None)
+    client.set_versioned_hash(key, {'1': 3}, 1)
+    token = client.end_session()
+    client.begin_session(token)
+
+    # The replicas were probed before the write: only the master qualifies
+    # on the written shard, the other shard still reads from its replica
+    assert client.shards[1].router.choose(client.current_read_floor(client.shards[1])) is None
+    assert client.shards[0].router.choose(client.current_read_floor(client.shards[0])) is not None
+    assert client.get_hashes([key]) == [{'1': 3, '_version': 1}]
+
+    # Once the replica is seen to have caught up it serves the reads again
+    floor = client.current_read_floor(client.shards[1])
+    for _ in range(100):
+        client.shards[1].router.probe()
+        if client.shards[1].router.choose(floor) is not None:
+            break
+        time.sleep(0.05)
+    assert client.shards[1].router.choose(floor).name == second_replica.address
+    assert client.get_hashes([key]) == [{'1': 3, '_version': 1}]
+
+def test_move_keys_keeps_ttls_and_fresher_target_keys(redis_servers):
+    source, target = redis_servers(), redis_servers()
+    source.client.hset('cart:{a}', mapping={'1': 2, '_version': 3})
+    source.client.expire('cart:{a}', 100)
+    source.client.hset('cart:{b}', mapping={'1': 1})
+    source.client.hset('cart:{c}', mapping={'1': 1, '_version': 1})
+    # Written on the new shard after the switch
+    target.client.hset('cart:{c}', mapping={'1': 9, '_version': 2})
+    # The script's connections return bytes
+    moved = move_keys(
+        redis.Redis(host=source.host, port=source.port), redis.Redis(host=target.host, port=target.port),
+        [b'cart:{a}', b'cart:{b}', b'cart:{c}', b'cart:{gone}']
+    )
+
+    assert moved == 2
+    assert source.client.keys('*') == []
+    assert target.client.hgetall('cart:{a}') == {'1': '2', '_version': '3'}
+    assert 90 < target.client.ttl('cart:{a}') <= 100
+    assert target.client.ttl('cart:{b}') == -1
+    assert target.client.hgetall('cart:{c}') == {'1': '9', '_version': '2'}
+
+def test_rebalance_script_moves_keys_to_the_new_shard(redis_servers):
+    old, new = redis_servers(), redis_servers()
+    keys = KEYS[:500]
+    pipe = old.client.pipeline()
+    for index, key in enumerate(keys):
+        pipe.hset(key, mapping={'1': index, '_version': 1})
+        pipe.expire(key, 600)
+    pipe.set('stats:top_products', 1)
+    pipe.execute()
+    old_layout = f"a={old.address}"
+    new_layout = f"a={old.address};b={new.address}"
+
+    dry_run = subprocess.run(
+        [sys.executable, '-m', 'scripts.rebalance_shards', '--from', old_layout, '--to', new_layout,
+         '--batch-size', '64', '--dry-run'],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    assert old.client.dbsize() == len(keys) + 1
+    result = subprocess.run(
+        [sys.executable, '-m', 'scripts.rebalance_shards', '--from', old_layout, '--to', new_layout,
+         '--batch-size', '64'],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+    ring = HashRing(['a', 'b'], Config.REDIS_SHARD_VNODES)
+    expected = sorted(key for key in keys if ring.get_node(key) == 'b')
+    assert 0 < len(expected) < len(keys)
+    assert sorted(new.client.keys('*')) == expected
+    assert sorted(old.client.keys('cart:*')) == sorted(set(keys) - set(expected))
+    # Only cart keys move
+    assert old.client.get('stats:top_products') == '1'
+    assert all(0 < new.client.ttl(key) <= 600 for key in expected)
+    assert new.client.hget(expected[0], '1') == str(keys.index(expected[0]))
+    assert f"would move {len(expected)}" in dry_run.stdout
+    assert f"moved {len(expected)}" in result.stdout
@@ -0,0 +1,82 @@
+import threading
+import time
+from app.cache.local_cache import local_cache
+from app.cache.redis_client import redis_client
+from app.models.cart import Product
+from app.services.cart_service import CartService
+from app.services.catalog_service import catalog
+
+def uncached_cart(service: CartService, user_id: str) -> str:
+    """Save a cart to the database only, returns its cache key"""
+    catalog.save_products([Product(product_id=1, name='P1', price=1.0)])
+    service.add_item(user_id, {'product_id': 1, 'quantity': 2})
+    cart_key = service._get_cart_key(user_id)
+    redis_client.delete_data(cart_key)
+    local_cache.clear()
+    return cart_key
+
+def count_db_reads(monkeypatch, service: CartService, delay: float = 0) -> list:
+    """Record the database reads of service, each taking at least `delay` seconds"""
+    read = service._read_cart_from_db
+    reads = []
+
+    def slow_read(user_id):
+        reads.append(user_id)
+        time.sleep(delay)
+        return read(user_id)
+
+    monkeypatch.setattr(service, '_read_cart_from_db', slow_read)
+    return reads
+
+def test_concurrent_misses_load_the_cart_once(monkeypatch, cart_app):
+    service = CartService()
+    uncached_cart(service, 'hot')
+    reads = count_db_reads(monkeypatch, service, delay=0.2)
+    start = threading.Barrier(8)
+    versions = []
+
+    def read_cart():
+        with cart_app.app_context():
+            start.wait()
+            cart = service.get_cart('hot')
+            versions.append((cart.version, cart.get_item(1).quantity))
+
+    threads = [threading.Thread(target=read_cart) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert reads == ['hot']
+    assert len(versions) == 8 and len(set(versions)) == 1
+
+def test_waiters_read_the_database_when_the_loader_takes_too_long(monkeypatch, cart_app):
+    service = CartService()
+    cart_key = uncached_cart(service, 'slow')
+    service.lock_wait_ms = 100
+    reads = count_db_reads(monkeypatch, service)
+    # A loader that died (or hangs) while holding the lock
+    assert redis_client.acquire_lock(f"{service.lock_prefix}{cart_key}", 10000) is not None
+
+    started = time.monotonic()
+    cart = service.get_cart('slow')
+
+    assert time.monotonic() - started >= 0.1
+    assert reads == ['slow']
+    assert cart.get_item(1).quantity == 2
+
+def test_waiters_stop_waiting_when_the_loader_found_no_cart(monkeypatch, cart_app):
+    service = CartService()
+    cart_key = service._get_cart_key('nobody')
+    reads = count_db_reads(monkeypatch, service)
+    lock_key = f"{service.lock_prefix}{cart_key}"
+    token = redis_client.acquire_lock(lock_key, 10000)
+    # The loader finishes without caching anything
+    threading.Timer(0.1, redis_client.release_lock, (lock_key, token)).start()
+
+    started = time.monotonic()
+    cart = service.get_cart('nobody')
+
+    assert time.monotonic() - started < service.lock_wait_ms / 1000
+    assert cart.line_count == 0
+    assert reads == ['nobody']
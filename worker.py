@@ -0,0 +1,15 @@
+from app import create_app
+from app.services.cart_flusher import CartFlusher
+from app.services.cart_archiver import start_background_archiving
+from app.config import Config
+
+app = create_app()
+
+if __name__ == '__main__':
+    # Abandoned-cart archiving, in the background of the worker process
+    if Config.CART_ARCHIVE_ENABLED:
+        start_background_archiving(app)
+    
+    # Write-behind flusher: moves cart changes from the Redis Stream to PostgreSQL
+    with app.app_context():
+        CartFlusher().run()
\ No newline at end of file
@@ -0,0 +1,5 @@
+from app import create_app
+
+# Preloaded by pre-forking servers (see gunicorn.conf.py): background threads
+# and connection pools are set up in each worker after the fork
+app = create_app(start_workers=False)